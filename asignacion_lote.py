@@ -0,0 +1,425 @@
+import argparse
+import datetime
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from cotizador_lote import COLUMNAS_SALIDA, cargar_tablas, opciones_lote, preparar_pedidos
+from migraciones import verificar_esquema
+from motor_cotizacion import DB_PATH, normalizar_proveedor
+
+DIAS_HORIZONTE = 3
+# Hasta este tamaño el modo automático usa el flujo de costo mínimo exacto
+LIMITE_EXACTO = 5_000
+# Ciclos de mejora como máximo después de la heurística
+MAX_MEJORAS = 5_000
+
+# Días de la semana (0 = lunes) por abreviatura de periodicidad
+DIAS_SEMANA = {'L': 0, 'MA': 1, 'M': 2, 'MI': 2, 'X': 2, 'J': 3, 'V': 4, 'S': 5, 'D': 6}
+TODOS_LOS_DIAS = frozenset(range(7))
+
+
+# --- PERIODICIDAD ---
+
+def dias_de_periodicidad(texto):
+    """Días de la semana en que sale la ruta.
+
+    'DIARIA' son todos los días; 'L-V' es un rango de lunes a viernes (igual L-S, L-D) y el resto
+    de combinaciones ('L-M-V', 'MA-J') son listas de días. Sin periodicidad o con una que no se
+    reconoce no se restringe.
+    """
+    if texto is None or (isinstance(texto, float) and np.isnan(texto)):
+        return TODOS_LOS_DIAS
+    texto = str(texto).strip().upper().replace(' ', '')
+    if texto in ('', 'DIARIA', 'DIARIO'):
+        return TODOS_LOS_DIAS
+    partes = [p for p in texto.replace(',', '-').replace('/', '-').split('-') if p]
+    if any(p not in DIAS_SEMANA for p in partes):
+        return TODOS_LOS_DIAS
+    if len(partes) == 2 and partes[0] == 'L' and partes[1] in ('V', 'S', 'D'):
+        return frozenset(range(DIAS_SEMANA[partes[1]] + 1))
+    return frozenset(DIAS_SEMANA[p] for p in partes)
+
+
+# --- CANDIDATOS Y CAPACIDADES ---
+
+def leer_capacidades(ruta, proveedores, fecha_inicio, dias):
+    """Capacidad diaria (envíos) por recurso proveedor × día del horizonte.
+
+    El CSV trae 'proveedor' y 'capacidad'; con columna 'fecha' (AAAA-MM-DD) la fila solo aplica a ese
+    día y tiene prioridad sobre la capacidad general. Los proveedores que no aparecen no tienen límite.
+    """
+    capacidad = np.full(len(proveedores) * dias, np.inf)
+    if ruta is None:
+        return capacidad
+    df = pd.read_csv(ruta, dtype={'proveedor': str, 'fecha': str})
+    codigo = {p: i for i, p in enumerate(proveedores)}
+    df['codigo'] = df['proveedor'].map(lambda p: codigo.get(normalizar_proveedor(p), -1))
+    df = df[df['codigo'] >= 0]
+    if 'fecha' not in df.columns:
+        df['fecha'] = None
+    generales = df[df['fecha'].isna()]
+    for cod, cap in zip(generales['codigo'], generales['capacidad']):
+        capacidad[cod * dias:(cod + 1) * dias] = cap
+    for cod, fecha, cap in zip(df['codigo'], df['fecha'], df['capacidad']):
+        if isinstance(fecha, str):
+            d = (datetime.date.fromisoformat(fecha) - fecha_inicio).days
+            if 0 <= d < dias:
+                capacidad[cod * dias + d] = cap
+    # La capacidad se cuenta en envíos enteros
+    return np.floor(capacidad)
+
+def dias_listos(df_pedidos, fecha_inicio, dias):
+    # Día del horizonte desde el que puede salir cada pedido (columna opcional 'fecha_lista')
+    if 'fecha_lista' not in df_pedidos.columns:
+        return np.zeros(len(df_pedidos), dtype=int)
+    fechas = pd.to_datetime(df_pedidos['fecha_lista'], errors='coerce')
+    desfase = (fechas - pd.Timestamp(fecha_inicio)).dt.days
+    return desfase.fillna(0).clip(lower=0, upper=dias).to_numpy(dtype=int)
+
+def candidatos(opciones, listos, fecha_inicio, dias, costo_dia=0.0):
+    """Expande cada opción a los días del horizonte en que la ruta sale.
+
+    Devuelve (proveedores, candidatos) con una fila por (pedido, recurso): la opción más barata de
+    ese proveedor y día. El recurso es codigo_proveedor * dias + dia; el costo suma costo_dia por
+    cada día de espera desde que el pedido está listo.
+    """
+    codigo_proveedor, proveedores = pd.factorize(opciones['proveedor'])
+    codigo_periodicidad, periodicidades = pd.factorize(opciones['periodicidad'], use_na_sentinel=False)
+    dia_semana = [(fecha_inicio + datetime.timedelta(days=d)).weekday() for d in range(dias)]
+    sale = np.array(
+        [[ds in dias_de_periodicidad(p) for ds in dia_semana] for p in periodicidades], dtype=bool
+    ).reshape(len(periodicidades), dias)
+
+    opcion = np.repeat(np.arange(len(opciones)), dias)
+    dia = np.tile(np.arange(dias), len(opciones))
+    pedido = opciones['pedido'].to_numpy()[opcion]
+    valido = sale[codigo_periodicidad[opcion], dia] & (dia >= listos[pedido])
+    opcion, dia, pedido = opcion[valido], dia[valido], pedido[valido]
+
+    recurso = codigo_proveedor[opcion] * dias + dia
+    costo = opciones['precio_envio'].to_numpy(dtype=float)[opcion] + costo_dia * (dia - listos[pedido])
+    df = pd.DataFrame({'pedido': pedido, 'recurso': recurso, 'costo': costo, 'opcion': opcion, 'dia': dia})
+    # Se conserva la opción más barata por (pedido, recurso) y se ordena por (pedido, costo, día)
+    df = df.sort_values(['pedido', 'recurso', 'costo'], kind='stable').drop_duplicates(['pedido', 'recurso'])
+    df = df.sort_values(['pedido', 'costo', 'dia'], kind='stable').reset_index(drop=True)
+    return np.asarray(proveedores, dtype=object), df
+
+
+# --- ASIGNACIÓN ---
+
+def asignar_regret(n_pedidos, cand, capacidad):
+    """Heurística de arrepentimiento por rondas.
+
+    En cada ronda se calcula, con los recursos que aún tienen cupo, la diferencia entre la segunda y
+    la mejor opción de cada pedido; se asignan primero los pedidos que más pierden si esperan. Los
+    que se quedan sin su mejor recurso durante la ronda pasan a la siguiente.
+    Devuelve el recurso asignado por pedido (-1 si no se asignó) y el número de rondas.
+    """
+    pedido = cand['pedido'].to_numpy()
+    recurso = cand['recurso'].to_numpy()
+    costo = cand['costo'].to_numpy(dtype=float)
+    restante = capacidad.astype(float).tolist()
+    en = np.full(n_pedidos, -1)
+    rondas = 0
+    while True:
+        idx = np.flatnonzero((en[pedido] < 0) & (np.asarray(restante)[recurso] >= 1))
+        if not len(idx):
+            break
+        rondas += 1
+        p = pedido[idx]
+        primeros = np.flatnonzero(np.r_[True, p[1:] != p[:-1]])
+        mejor = idx[primeros]
+        con_segundo = np.diff(np.r_[primeros, len(idx)]) > 1
+        segundo = np.where(con_segundo, costo[idx[np.minimum(primeros + 1, len(idx) - 1)]], np.inf)
+        arrepentimiento = segundo - costo[mejor]
+        orden = mejor[np.lexsort((costo[mejor], -arrepentimiento))]
+        for r, pe in zip(recurso[orden].tolist(), pedido[orden].tolist()):
+            if restante[r] >= 1:
+                restante[r] -= 1
+                en[pe] = r
+    return en, rondas
+
+
+def _matriz_costos(n_pedidos, cand, n_recursos):
+    C = np.full((n_pedidos, n_recursos), np.inf)
+    C[cand['pedido'].to_numpy(), cand['recurso'].to_numpy()] = cand['costo'].to_numpy(dtype=float)
+    return C
+
+class GrafoResidual:
+    """Grafo residual de la asignación con un nodo por recurso (proveedor × día), un nodo
+    "sin asignar" y un sumidero.
+
+    La arista a -> b vale lo que cambia el costo al mover a b el pedido de a que menos lo encarece,
+    C[pedido, b] - C[pedido, a], con costo 0 fuera de los recursos. r -> sumidero existe si r tiene
+    cupo y sumidero -> r si r tiene pedidos. Al mover pedidos solo se recalculan las filas de los
+    nodos afectados.
+    """
+
+    def __init__(self, C, en, con_opciones, capacidad):
+        self.C = C
+        self.en = en
+        self.capacidad = capacidad
+        self.n_recursos = n = C.shape[1]
+        self.sin_asignar = n
+        self.sumidero = n + 1
+        self.miembros = [set() for _ in range(n + 1)]
+        for pedido, r in enumerate(en.tolist()):
+            if r >= 0:
+                self.miembros[r].add(pedido)
+            elif con_opciones[pedido]:
+                self.miembros[n].add(pedido)
+        self.W = np.full((n + 2, n + 2), np.inf)
+        self.W_pedido = np.full(self.W.shape, -1)
+        for nodo in range(n + 1):
+            self._actualizar(nodo)
+
+    def _actualizar(self, nodo):
+        n = self.n_recursos
+        filas = np.fromiter(self.miembros[nodo], dtype=np.int64, count=len(self.miembros[nodo]))
+        self.W[nodo] = np.inf
+        self.W_pedido[nodo] = -1
+        if nodo == self.sin_asignar:
+            if len(filas):
+                sub = self.C[filas]
+                self.W[nodo, :n] = sub.min(axis=0)
+                self.W_pedido[nodo, :n] = filas[sub.argmin(axis=0)]
+            return
+        if len(filas) < self.capacidad[nodo]:
+            self.W[nodo, self.sumidero] = 0.0
+        self.W[self.sumidero, nodo] = 0.0 if len(filas) else np.inf
+        if len(filas):
+            actual = self.C[filas, nodo]
+            delta = self.C[filas] - actual[:, None]
+            self.W[nodo, :n] = delta.min(axis=0)
+            self.W_pedido[nodo, :n] = filas[delta.argmin(axis=0)]
+            self.W[nodo, nodo] = np.inf
+            self.W[nodo, self.sin_asignar] = -actual.max()
+            self.W_pedido[nodo, self.sin_asignar] = filas[actual.argmax()]
+
+    def mover(self, aristas):
+        # Los pedidos de cada arista son distintos: cada uno sale de un nodo distinto del camino o ciclo
+        movimientos = [(self.W_pedido[a, b], a, b) for a, b in aristas if self.W_pedido[a, b] >= 0]
+        for pedido, a, b in movimientos:
+            self.miembros[a].discard(pedido)
+            self.miembros[b].add(pedido)
+            self.en[pedido] = -1 if b == self.sin_asignar else b
+        for nodo in {a for _, a, _ in movimientos} | {b for _, _, b in movimientos}:
+            self._actualizar(nodo)
+
+def _bellman_ford(W, dist):
+    # Devuelve (dist, pred, True si seguía mejorando tras n rondas: hay un ciclo negativo)
+    n = len(W)
+    todos = np.arange(n)
+    pred = np.full(n, -1)
+    for _ in range(n):
+        via = dist[:, None] + W
+        desde = via.argmin(axis=0)
+        nueva = via[desde, todos]
+        mejora = nueva < dist - 1e-9
+        if not mejora.any():
+            return dist, pred, False
+        dist[mejora] = nueva[mejora]
+        pred[mejora] = desde[mejora]
+    return dist, pred, True
+
+def _ciclo_en(pred):
+    # Primer ciclo del grafo de predecesores, como lista de aristas (a, b)
+    for inicio in range(len(pred)):
+        visto = set()
+        nodo = inicio
+        while nodo >= 0 and nodo not in visto:
+            visto.add(nodo)
+            nodo = pred[nodo]
+        if nodo >= 0:
+            ciclo = [nodo]
+            while pred[ciclo[-1]] != nodo:
+                ciclo.append(pred[ciclo[-1]])
+            return [(pred[b], b) for b in ciclo]
+    return None
+
+def cancelar_ciclos(grafo, max_iteraciones):
+    """Aplica ciclos de costo negativo (mover pedidos entre recursos sin cambiar cuántos se asignan).
+
+    Sin ciclos negativos la asignación es la más barata para esa cantidad de pedidos.
+    Devuelve el número de ciclos aplicados.
+    """
+    for iteracion in range(max_iteraciones):
+        _, pred, con_ciclo = _bellman_ford(grafo.W, np.zeros(len(grafo.W)))
+        ciclo = _ciclo_en(pred) if con_ciclo else None
+        if ciclo is None:
+            return iteracion
+        grafo.mover(ciclo)
+    return max_iteraciones
+
+def aumentar(grafo):
+    """Caminos más cortos sucesivos desde "sin asignar" hasta el sumidero.
+
+    Cada camino asigna un pedido más al menor costo adicional posible; si la asignación de partida
+    no tiene ciclos negativos el resultado es óptimo. Devuelve cuántos pedidos se agregaron.
+    """
+    agregados = 0
+    while True:
+        dist = np.full(len(grafo.W), np.inf)
+        dist[grafo.sin_asignar] = 0.0
+        dist, pred, _ = _bellman_ford(grafo.W, dist)
+        if not np.isfinite(dist[grafo.sumidero]):
+            return agregados
+        camino = []
+        nodo = grafo.sumidero
+        while nodo >= 0 and nodo != grafo.sin_asignar and len(camino) < len(pred):
+            camino.append((pred[nodo], nodo))
+            nodo = pred[nodo]
+        if nodo != grafo.sin_asignar:
+            # Solo pasa si quedaron ciclos negativos sin cancelar
+            return agregados
+        grafo.mover(camino)
+        agregados += 1
+
+def asignar_exacto(n_pedidos, cand, capacidad):
+    """Flujo de costo mínimo: asigna la mayor cantidad posible de pedidos y, entre esas
+    asignaciones, la de menor costo total. Cada aumento es O(pedidos × recursos); pensado para
+    lotes de hasta unos miles de pedidos."""
+    C = _matriz_costos(n_pedidos, cand, len(capacidad))
+    en = np.full(n_pedidos, -1)
+    aumentar(GrafoResidual(C, en, np.isfinite(C).any(axis=1), capacidad))
+    return en
+
+def mejorar_asignacion(n_pedidos, cand, capacidad, en, max_iteraciones=MAX_MEJORAS):
+    # Parte de la heurística, cancela ciclos negativos y agrega los pedidos que aún quepan
+    C = _matriz_costos(n_pedidos, cand, len(capacidad))
+    en = en.copy()
+    grafo = GrafoResidual(C, en, np.isfinite(C).any(axis=1), capacidad)
+    ciclos = cancelar_ciclos(grafo, max_iteraciones)
+    agregados = aumentar(grafo) if ciclos < max_iteraciones else 0
+    return en, ciclos, agregados
+
+def _candidato_de(cand, en, n_recursos):
+    # Índice en 'cand' de la fila (pedido, recurso) asignada; -1 si el pedido quedó sin asignar
+    claves = cand['pedido'].to_numpy() * n_recursos + cand['recurso'].to_numpy()
+    orden = np.argsort(claves, kind='stable')
+    asignado = np.full(len(en), -1)
+    con_recurso = np.flatnonzero(en >= 0)
+    asignado[con_recurso] = orden[np.searchsorted(claves[orden], con_recurso * n_recursos + en[con_recurso])]
+    return asignado
+
+
+def asignar_pedidos(tablas, df_pedidos, fecha_inicio, dias=DIAS_HORIZONTE, ruta_capacidades=None,
+                    costo_dia=0.0, metodo='auto', limite_exacto=LIMITE_EXACTO, max_mejoras=MAX_MEJORAS):
+    """Asigna cada pedido a una opción y día de salida minimizando el costo total.
+
+    metodo: 'regret', 'exacto' o 'auto' (exacto hasta limite_exacto pedidos). La heurística se
+    mejora después con hasta max_mejoras ciclos de intercambio (0 = solo la heurística).
+    Devuelve (DataFrame por pedido, DataFrame de uso por proveedor y día, información del cálculo).
+    """
+    df = df_pedidos.reset_index(drop=True).copy()
+    opciones = opciones_lote(tablas, df)
+    listos = dias_listos(df, fecha_inicio, dias)
+    proveedores, cand = candidatos(opciones, listos, fecha_inicio, dias, costo_dia)
+    capacidad = leer_capacidades(ruta_capacidades, proveedores, fecha_inicio, dias)
+
+    if metodo == 'auto':
+        metodo = 'exacto' if len(df) <= limite_exacto else 'regret'
+    inicio = time.perf_counter()
+    rondas = ciclos = agregados = None
+    if metodo == 'exacto':
+        en = asignar_exacto(len(df), cand, capacidad)
+    else:
+        en, rondas = asignar_regret(len(df), cand, capacidad)
+        if max_mejoras:
+            en, ciclos, agregados = mejorar_asignacion(len(df), cand, capacidad, en, max_mejoras)
+    duracion = time.perf_counter() - inicio
+    asignado = _candidato_de(cand, en, len(capacidad))
+
+    elegidos = asignado[asignado >= 0]
+    con_asignacion = np.flatnonzero(asignado >= 0)
+    filas = opciones.iloc[cand['opcion'].to_numpy()[elegidos]]
+    for col in COLUMNAS_SALIDA:
+        df[col] = pd.Series(filas[col].to_numpy(), index=con_asignacion).reindex(df.index).to_numpy()
+    dia = pd.Series(cand['dia'].to_numpy()[elegidos], index=con_asignacion).reindex(df.index)
+    df['fecha_envio'] = [
+        (fecha_inicio + datetime.timedelta(days=int(d))).isoformat() if not pd.isna(d) else None for d in dia
+    ]
+    df['costo_asignado'] = pd.Series(cand['costo'].to_numpy()[elegidos], index=con_asignacion).reindex(df.index).to_numpy()
+    con_candidatos = np.zeros(len(df), bool)
+    con_candidatos[cand['pedido'].to_numpy()] = True
+    con_opciones = np.zeros(len(df), bool)
+    con_opciones[opciones['pedido'].to_numpy()] = True
+    df['estado'] = np.select(
+        [asignado >= 0, con_candidatos, con_opciones],
+        ['ok', 'sin_capacidad', 'sin_salida'],
+        default='sin_opciones',
+    )
+
+    recursos = cand['recurso'].to_numpy()[elegidos]
+    usados = np.bincount(recursos, minlength=len(capacidad))
+    uso = pd.DataFrame({
+        'proveedor': np.repeat(proveedores, dias),
+        'fecha': [(fecha_inicio + datetime.timedelta(days=d)).isoformat() for d in range(dias)] * len(proveedores),
+        'envios': usados,
+        'capacidad': capacidad,
+    })
+    info = {
+        'metodo': metodo, 'rondas': rondas, 'ciclos': ciclos, 'agregados': agregados, 'duracion_s': duracion,
+        'asignados': len(elegidos), 'costo_total': float(df['costo_asignado'].sum()),
+    }
+    return df, uso[uso['envios'] > 0].reset_index(drop=True), info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Asigna un lote de pedidos a proveedores con capacidad diaria y periodicidad.")
+    parser.add_argument('entrada', help="Pedidos (CSV) con 'cp' y 'ID_PRODUCTO' o dimensiones; 'fecha_lista' opcional")
+    parser.add_argument('salida', help="CSV con la asignación por pedido")
+    parser.add_argument('--db', default=DB_PATH, help="Ruta de la base de datos SQLite")
+    parser.add_argument('--capacidades', default=None, help="CSV con proveedor, capacidad y fecha opcional")
+    parser.add_argument('--fecha', default=datetime.date.today().isoformat(), help="Primer día del horizonte (AAAA-MM-DD)")
+    parser.add_argument('--dias', type=int, default=DIAS_HORIZONTE, help="Días del horizonte de salida")
+    parser.add_argument('--costo-dia', type=float, default=0.0, help="Penalización por cada día de espera")
+    parser.add_argument('--metodo', choices=['auto', 'regret', 'exacto'], default='auto')
+    parser.add_argument('--limite-exacto', type=int, default=LIMITE_EXACTO)
+    parser.add_argument('--max-mejoras', type=int, default=MAX_MEJORAS, help="Ciclos de mejora tras la heurística (0 = ninguno)")
+    parser.add_argument('--usuario', type=int, default=None, help="id_usuario para aplicar descuentos si el archivo no trae la columna")
+    parser.add_argument('--comparar', action='store_true', help="Resuelve también con el método exacto y muestra la diferencia de costo")
+    args = parser.parse_args()
+    if not os.path.exists(args.entrada):
+        parser.error(f"No existe el archivo de entrada: {args.entrada}")
+    fecha_inicio = datetime.date.fromisoformat(args.fecha)
+
+    verificar_esquema(args.db)
+    conn = sqlite3.connect(args.db)
+    try:
+        inicio = time.perf_counter()
+        tablas = cargar_tablas(conn)
+        pedidos = preparar_pedidos(conn, pd.read_csv(args.entrada, dtype={'cp': str, 'ID_PRODUCTO': str}), args.usuario)
+    finally:
+        conn.close()
+
+    df, uso, info = asignar_pedidos(
+        tablas, pedidos, fecha_inicio, args.dias, args.capacidades, args.costo_dia,
+        args.metodo, args.limite_exacto, args.max_mejoras,
+    )
+    df.to_csv(args.salida, index=False)
+    duracion = time.perf_counter() - inicio
+
+    detalle = ""
+    if info['rondas'] is not None:
+        detalle = f", {info['rondas']} rondas"
+    if info['ciclos'] is not None:
+        detalle += f", {info['ciclos']} ciclos de mejora, {info['agregados']} pedidos agregados"
+    print(f"Asignación {info['metodo']} en {info['duracion_s']:.2f} s{detalle}")
+    print(df['estado'].value_counts().to_string())
+    print(uso.to_string(index=False))
+    print(f"✅ {len(df)} pedidos en {duracion:.2f} s, costo total {info['costo_total']:.2f} -> {args.salida}")
+
+    if args.comparar:
+        _, _, exacto = asignar_pedidos(tablas, pedidos, fecha_inicio, args.dias, args.capacidades, args.costo_dia, 'exacto')
+        diferencia = info['costo_total'] - exacto['costo_total']
+        print(f"Exacto: {exacto['asignados']} pedidos, costo {exacto['costo_total']:.2f} en {exacto['duracion_s']:.2f} s "
+              f"(heurística: {info['asignados']} pedidos, diferencia {diferencia:.2f}, "
+              f"{diferencia / exacto['costo_total'] * 100 if exacto['costo_total'] else 0:.2f} %)")
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,23 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import hashlib
-import math
+import os
+
+from auditoria import RegistroCotizaciones, nueva_cotizacion
+from busqueda_skus import TAMANO_PAGINA, buscar_skus
+from cache_datos import CacheLRU, leer_versiones
+from conexion_db import GestorConexiones
+from cotizacion_sql import cotizar_sql
+from instantanea import cargar_instantanea, ruta_instantanea
+from materializacion import ContextoMaterializacion, cotizar_materializado
+from migraciones import EsquemaDesactualizado, verificar_esquema
+from motor_cotizacion import DB_PATH, OpcionEnvio, RateBook, calcular_pesos, normalizar_cp
+from perfilado import Medidor, capturar_perfil, configurar_registro
+
+TTL_CACHE_S = 300
+MAX_COTIZACIONES_CACHE = 20_000
+TABLAS_TARIFAS = ('cobertura_transportistas', 'tarifas_envio', 'descuentos_usuario')
+USUARIO_ADMIN = 'admin'
 
 # --- LÓGICA DE AUTENTICACIÓN ---
 if 'authenticated' not in st.session_state:
@@ -15,23 +30,76 @@ if 'user_id' not in st.session_state:
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+@st.cache_resource
+def obtener_gestor():
+    # Pool de conexiones compartido por todas las sesiones. La app no migra: si el esquema va atrás
+    # del código se detiene hasta que se ejecute python migraciones.py
+    try:
+        verificar_esquema(DB_PATH)
+    except EsquemaDesactualizado as e:
+        st.error(f"❌ {e}")
+        st.stop()
+    return GestorConexiones(DB_PATH)
+
 def ejecutar_sql(query, params=()):
-    conn = sqlite3.connect('db_envios.db.db')
     try:
-        df = pd.read_sql_query(query, conn, params=params)
+        df = obtener_gestor().consultar(query, params=params)
     except Exception as e:
         st.error(f"Error al ejecutar la consulta: {e}")
         df = pd.DataFrame()
-    finally:
-        conn.close()
     return df
 
-def get_discounts(user_id):
-    if user_id is None:
+def consultar_cacheado(nombre_cache, clave, query, params=()):
+    # Como ejecutar_sql, pero la consulta falla dentro de la caché: un error no se guarda como resultado vacío
+    try:
+        return obtener_caches()[nombre_cache].obtener(clave, lambda: obtener_gestor().consultar(query, params=params))
+    except Exception as e:
+        st.error(f"Error al ejecutar la consulta: {e}")
         return pd.DataFrame()
-    user_id_str = str(user_id)
-    query = "SELECT proveedor, descuento_porcentaje, zona FROM descuentos_usuario WHERE id_usuario = ?"
-    return ejecutar_sql(query, params=(user_id,))
+
+@st.cache_resource
+def obtener_caches():
+    # Compartidas entre sesiones; cada caché se vacía cuando cambia la versión de sus tablas
+    return {
+        'rate_book': CacheLRU(maxsize=1, tablas=TABLAS_TARIFAS),
+        'cotizaciones': CacheLRU(maxsize=MAX_COTIZACIONES_CACHE, tablas=TABLAS_TARIFAS),
+        'skus': CacheLRU(maxsize=2_000, ttl=TTL_CACHE_S, tablas=('productos',)),
+        'productos': CacheLRU(maxsize=10_000, ttl=TTL_CACHE_S, tablas=('productos',)),
+    }
+
+def sincronizar_caches():
+    # Una lectura de version_datos por rerun decide si alguna caché quedó obsoleta
+    with obtener_gestor().conexion() as conn:
+        versiones = leer_versiones(conn)
+    for cache in obtener_caches().values():
+        cache.sincronizar(versiones)
+
+def cargar_rate_book():
+    # La instantánea de instantanea.py evita leer y compactar las tablas; si está desactualizada se lee SQLite
+    with obtener_gestor().conexion() as conn:
+        return cargar_instantanea(conn, ruta_instantanea(DB_PATH)) or RateBook.from_connection(conn)
+
+def obtener_rate_book():
+    # Cobertura, tarifas y descuentos se cargan una vez y se comparten entre sesiones
+    return obtener_caches()['rate_book'].obtener('rate_book', cargar_rate_book)
+
+@st.cache_resource
+def obtener_contexto_materializacion():
+    # Parámetros y perfiles de opciones_materializadas; cotizar_materializado lo recarga tras cada refresco
+    contexto = ContextoMaterializacion()
+    with obtener_gestor().conexion() as conn:
+        contexto.cargar(conn)
+    return contexto
+
+@st.cache_resource
+def obtener_auditoria():
+    # Un hilo por proceso escribe quotes_log por lotes; registrar no espera a SQLite
+    return RegistroCotizaciones(DB_PATH)
+
+@st.cache_resource
+def iniciar_registro_tiempos():
+    # Una línea JSON por cotización en tiempos_cotizacion.log (resumen: python perfilado.py)
+    configurar_registro()
 
 def authenticate():
     st.sidebar.header("🔑 Acceso")
@@ -50,14 +118,60 @@ def authenticate():
         else:
             st.sidebar.error("Nombre de usuario o contraseña incorrectos.")
 
-def main_app():
-    df_skus = ejecutar_sql("SELECT ID_PRODUCTO FROM productos")
-    lista_skus = df_skus['ID_PRODUCTO'].dropna().unique().tolist()
-    
+def cargar_pagina_skus(prefijo, despues_de):
+    with obtener_gestor().conexion() as conn:
+        return buscar_skus(conn, prefijo, TAMANO_PAGINA, despues_de)
+
+def selector_sku():
+    # Búsqueda por prefijo con paginación en el servidor; nunca se carga el catálogo completo
+    prefijo = st.text_input("Buscar SKU", placeholder="Escribe el inicio del SKU").strip()
+    if st.session_state.get('sku_prefijo') != prefijo:
+        st.session_state.sku_prefijo = prefijo
+        # Primer SKU excluido de cada página visitada (None = desde el inicio)
+        st.session_state.sku_paginas = [None]
+    despues_de = st.session_state.sku_paginas[-1]
+    skus, hay_mas = obtener_caches()['skus'].obtener(
+        (prefijo, despues_de), lambda: cargar_pagina_skus(prefijo, despues_de)
+    )
+
+    col_anterior, col_siguiente = st.columns(2)
+    if col_anterior.button("◀ Anterior", disabled=len(st.session_state.sku_paginas) == 1):
+        st.session_state.sku_paginas.pop()
+        st.rerun()
+    if col_siguiente.button("Siguiente ▶", disabled=not hay_mas):
+        st.session_state.sku_paginas.append(skus[-1])
+        st.rerun()
+    return st.selectbox(
+        f"Selecciona un SKU (página {len(st.session_state.sku_paginas)})", options=[""] + skus
+    )
+
+def registrar_mostrada(opciones, datos_envio):
+    # Una fila por cotización distinta: los reruns con los mismos datos no vuelven a registrarla
+    firma = tuple(datos_envio.values())
+    cotizacion = st.session_state.get('cotizacion_registrada')
+    if cotizacion is None or cotizacion[0] != firma:
+        cotizacion = (firma, nueva_cotizacion())
+        st.session_state.cotizacion_registrada = cotizacion
+        obtener_auditoria().registrar_mostrada(cotizacion[1], opciones, **datos_envio)
+    return cotizacion[1]
+
+def selector_eleccion(id_cotizacion, opciones, datos_envio):
+    indice = st.selectbox(
+        "Proveedor elegido", range(len(opciones)),
+        format_func=lambda i: f"{opciones[i].proveedor} / zona {opciones[i].zona} / {opciones[i].tipo_tarifa}: ${opciones[i].precio_envio:,.2f}",
+    )
+    if st.button("✅ Elegir proveedor"):
+        obtener_auditoria().registrar_elegida(id_cotizacion, opciones[indice], **datos_envio)
+        st.success(f"Elección registrada: {opciones[indice].proveedor}")
+
+def pantalla_cotizacion(medidor):
+    # Devuelve el contexto de la cotización para el registro de tiempos, o None si no se cotizó
     with st.sidebar:
         st.header(f"¡Hola, {st.session_state.username}!")
         st.header("📦 Productos disponibles")
-        sku_seleccionado = st.selectbox("Selecciona un SKU", options=[""] + lista_skus)
+        with medidor.etapa('carga_skus'):
+            sku_seleccionado = selector_sku()
+        motor = st.radio("Motor de cálculo", ["En memoria", "SQL", "Materializado"], horizontal=True)
         st.title("Asignador de Proveedores de Envío")
         if st.button("Cerrar Sesión"):
             st.session_state.authenticated = False
@@ -71,10 +185,11 @@ def main_app():
     
     if opcion == "Por ID de producto":
         ID_PRODUCTO = sku_seleccionado
-        CP_DESTINO = st.text_input("Código Postal de destino").zfill(5)
+        CP_DESTINO = normalizar_cp(st.text_input("Código Postal de destino"))
         if ID_PRODUCTO and CP_DESTINO:
             query_producto = "SELECT * FROM productos WHERE ID_PRODUCTO = ?"
-            df_producto = ejecutar_sql(query_producto, params=(ID_PRODUCTO,))
+            with medidor.etapa('producto'):
+                df_producto = consultar_cacheado('productos', ID_PRODUCTO, query_producto, params=(ID_PRODUCTO,))
             if not df_producto.empty:
                 producto = df_producto.iloc[0]
                 largo = float(producto['LARGO_CM'])
@@ -85,19 +200,49 @@ def main_app():
             else:
                 st.warning("❌ Producto no encontrado.")
     elif opcion == "Manual":
-        CP_DESTINO = st.text_input("Código Postal de destino").zfill(5)
+        CP_DESTINO = normalizar_cp(st.text_input("Código Postal de destino"))
         largo = st.number_input("Largo (cm)", min_value=0.0, format="%.2f")
         ancho = st.number_input("Ancho (cm)", min_value=0.0, format="%.2f")
         alto = st.number_input("Alto (cm)", min_value=0.0, format="%.2f")
         peso_real = st.number_input("Peso real (kg)", min_value=0.0, format="%.2f")
         m3 = (largo * ancho * alto) / 1_000_000 if all([largo, ancho, alto]) else None
 
-    if all([CP_DESTINO, largo, ancho, alto, peso_real, m3]):
-        peso_vol = (largo * ancho * alto) / 5000
-        
-        # Redondeamos el peso_max al siguiente entero.
-        peso_max = math.ceil(max(peso_real, peso_vol))
+    if not all([CP_DESTINO, largo, ancho, alto, peso_real, m3]):
+        return None
+
+    peso_vol, peso_max = calcular_pesos(largo, ancho, alto, peso_real)
 
+    # --- CÁLCULO DE COSTO ---
+    opciones = None
+    if motor == "SQL":
+        # Una sola sentencia: SQLite aplica tramos, m3, descuentos y devuelve las opciones finales
+        with medidor.etapa('consulta_sql'), obtener_gestor().conexion() as conn:
+            opciones = cotizar_sql(conn, CP_DESTINO, largo, ancho, alto, peso_real, st.session_state.user_id, m3=m3)
+    elif motor == "Materializado":
+        # Opciones precalculadas por materializacion.py; None fuera del dominio o con cambios sin refrescar,
+        # y entonces cotiza el motor en memoria
+        with medidor.etapa('consulta_materializada'), obtener_gestor().conexion() as conn:
+            opciones = cotizar_materializado(conn, CP_DESTINO, largo, ancho, alto, peso_real,
+                                             st.session_state.user_id, m3=m3,
+                                             contexto=obtener_contexto_materializacion())
+    if opciones is None:
+        with medidor.etapa('carga_rate_book'):
+            rate_book = obtener_rate_book()
+        # quote() separa cobertura, tarifas volumétricas, selección m3 y descuentos; los envíos repetidos
+        # (mismo CP, peso_max, coberturas que aceptan las medidas y usuario) salen de la caché
+        opciones = rate_book.quote(
+            CP_DESTINO, largo, ancho, alto, peso_real, st.session_state.user_id, m3=m3, medidor=medidor,
+            cache=obtener_caches()['cotizaciones'],
+        )
+
+    datos_envio = {
+        'id_usuario': st.session_state.user_id, 'id_producto': ID_PRODUCTO, 'cp': CP_DESTINO,
+        'peso_max': peso_max, 'm3': m3, 'motor': motor,
+    }
+    with medidor.etapa('auditoria'):
+        id_cotizacion = registrar_mostrada(opciones, datos_envio)
+
+    with medidor.etapa('render'):
         st.markdown(f"""
         ### 📦 Datos del envío
         - **Dimensiones**: {largo}x{ancho}x{alto} cm
@@ -106,138 +251,60 @@ def main_app():
         - **Peso a considerar (redondeado)**: {peso_max:.2f} kg
         - **Volumen (m³)**: {m3:.3f}
         """)
-        
-        query_cobertura_tarifas = """
-        SELECT
-            c.proveedor,
-            c.zona,
-            c.periodicidad,
-            t.tipo_tarifa,
-            t.rango_peso_min,
-            t.rango_peso_max,
-            t.m3_amparado,
-            t.precio_base,
-            t.umbral_kg_adicional,
-            t.costo_kg_adicional
-        FROM cobertura_transportistas AS c
-        JOIN tarifas_envio AS t
-            ON c.proveedor = t.proveedor
-            AND c.zona = t.zona
-        WHERE
-            c.cp = ?
-            AND (c.validacion_tipo = 'DIMENSIONES' OR c.validacion_tipo IS NULL)
-            AND c.largo_max_cm >= ?
-            AND c.ancho_max_cm >= ?
-            AND c.alto_max_cm >= ?
-            AND c.peso_max_kg >= ?
-        """
-        params_dimensiones = (CP_DESTINO, largo, ancho, alto, peso_real)
-        df_opciones_dimensiones = ejecutar_sql(query_cobertura_tarifas, params=params_dimensiones)
-
-        query_cobertura_volumen = """
-        SELECT
-            c.proveedor,
-            c.zona,
-            c.periodicidad,
-            t.tipo_tarifa,
-            t.rango_peso_min,
-            t.rango_peso_max,
-            t.m3_amparado,
-            t.precio_base,
-            t.umbral_kg_adicional,
-            t.costo_kg_adicional
-        FROM cobertura_transportistas AS c
-        JOIN tarifas_envio AS t
-            ON c.proveedor = t.proveedor
-            AND c.zona = t.zona
-        WHERE
-            c.cp = ?
-            AND c.validacion_tipo = 'VOLUMEN'
-            AND c.peso_max_kg >= ?
-            AND c.volumen_max_m3 >= ?
-        """
-        params_volumen = (CP_DESTINO, peso_real, m3)
-        df_opciones_volumen = ejecutar_sql(query_cobertura_volumen, params=params_volumen)
-        
-        df_cobertura_tarifas = pd.concat([df_opciones_dimensiones, df_opciones_volumen], ignore_index=True)
-        if df_cobertura_tarifas.empty:
+        if not opciones:
             st.error("❌ No se encontraron opciones de envío viables con tarifas aplicables.")
-            return
-
-        # --- LÓGICA DE CÁLCULO DE COSTO Y MERGE ---
-        
-        df_filtrado = df_cobertura_tarifas.copy()
-        df_filtrado['rango_peso_min'] = pd.to_numeric(df_filtrado['rango_peso_min'], errors='coerce')
-        df_filtrado['rango_peso_max'] = pd.to_numeric(df_filtrado['rango_peso_max'], errors='coerce')
-        df_filtrado['m3_amparado'] = pd.to_numeric(df_filtrado['m3_amparado'], errors='coerce')
-        df_filtrado['precio_calculado'] = 0.0
-
-        # Tarifa volumétrica
-        volumetrico_cond = (df_filtrado['tipo_tarifa'] == 'volumetrico') & (df_filtrado['rango_peso_min'] <= peso_max) & (df_filtrado['rango_peso_max'] >= peso_max)
-        df_volumetrico = df_filtrado[volumetrico_cond].copy()
-        if not df_volumetrico.empty:
-            df_volumetrico['precio_calculado'] = df_volumetrico['precio_base']
-            cond_adicional = (peso_max > df_volumetrico['umbral_kg_adicional']) & pd.notna(df_volumetrico['umbral_kg_adicional'])
-            if cond_adicional.any():
-                df_volumetrico.loc[cond_adicional, 'precio_calculado'] += (peso_max - df_volumetrico['umbral_kg_adicional']) * df_volumetrico['costo_kg_adicional']
-        
-        # Tarifa m3
-        m3_base = df_filtrado[df_filtrado['tipo_tarifa'] == 'm3'].copy()
-        m3_base = m3_base.sort_values(by=['rango_peso_min'])
-        
-        m3_valid_cond = (m3_base['rango_peso_min'] <= peso_real) & (m3_base['rango_peso_max'] >= peso_real) & (m3_base['m3_amparado'] >= m3)
-        
-        df_m3 = pd.DataFrame()
-        if m3_valid_cond.any():
-            primer_match_idx = m3_valid_cond.idxmax()
-            df_m3 = m3_base.loc[[primer_match_idx]].copy()
-            df_m3['precio_calculado'] = df_m3['precio_base']
-
-        # Unir las tarifas calculadas
-        df_tarifas_calculadas = pd.concat([df_volumetrico, df_m3], ignore_index=True)
-
-        if df_tarifas_calculadas.empty:
-            st.error("❌ No se encontraron opciones de envío viables con tarifas aplicables.")
-            return
-        
-        df_tarifas_calculadas = df_tarifas_calculadas.dropna(subset=['precio_calculado'])
-
-        # Normalizar las columnas para el merge final
-        df_tarifas_calculadas['proveedor'] = df_tarifas_calculadas['proveedor'].astype(str).str.strip().str.upper().str.replace(' ', '')
-        df_tarifas_calculadas['zona'] = df_tarifas_calculadas['zona'].astype(str)
-
-        # Obtener y normalizar los descuentos
-        df_descuentos = get_discounts(st.session_state.user_id)
-        df_descuentos['proveedor'] = df_descuentos['proveedor'].astype(str).str.strip().str.upper().str.replace(' ', '')
-        df_descuentos['zona'] = df_descuentos['zona'].astype(str)
-
-        # --- LÍNEAS DE DEPURACIÓN AGREGADAS ---
-        st.write("---")
-        st.write("### 🐛 Depuración de Descuentos")
-        st.write(f"ID de Usuario: **{st.session_state.user_id}**")
-        if df_descuentos.empty:
-            st.warning("⚠️ El DataFrame de descuentos está vacío. El ID de usuario podría no tener descuentos.")
         else:
-            st.write("DataFrame de descuentos (antes del merge):")
-            st.dataframe(df_descuentos)
-        st.write("---")
-        # --- FIN DE LAS LÍNEAS DE DEPURACIÓN ---
-
-        # Realizar el merge (unir) los dataframes
-        df_final = pd.merge(df_tarifas_calculadas, df_descuentos, on=['proveedor', 'zona'], how='left')
-
-        # Aplicar el descuento
-        df_final['descuento_aplicado'] = df_final['descuento_porcentaje'].apply(lambda x: 'Sí' if pd.notna(x) else 'No')
-        df_final['descuento_porcentaje'] = df_final['descuento_porcentaje'].fillna(0)
-        df_final['precio_envio'] = df_final['precio_calculado'] * (1 - df_final['descuento_porcentaje'])
-
-        # Formatear y mostrar el resultado
-        df_opciones = df_final[['proveedor', 'zona', 'tipo_tarifa', 'precio_envio', 'periodicidad', 'descuento_aplicado']]
-        df_opciones['precio_envio'] = df_opciones['precio_envio'].round(2)
-        df_opciones = df_opciones.sort_values('precio_envio').reset_index(drop=True)
-
-        st.success("✅ Opciones viables ordenadas por precio:")
-        st.dataframe(df_opciones)
+            # El DataFrame solo se construye para mostrar el resultado
+            df_opciones = pd.DataFrame(opciones, columns=OpcionEnvio._fields)
+            st.success("✅ Opciones viables ordenadas por precio:")
+            st.dataframe(df_opciones)
+            selector_eleccion(id_cotizacion, opciones, datos_envio)
+
+    return {
+        'usuario': st.session_state.user_id, 'motor': motor, 'cp': CP_DESTINO,
+        'sku': ID_PRODUCTO, 'peso_max': peso_max, 'opciones': len(opciones),
+    }
+
+def panel_perfilado():
+    # Solo para el administrador: tiempos por etapa de la última cotización y captura de cProfile
+    with st.expander("⏱️ Perfilado"):
+        tiempos = st.session_state.get('ultimos_tiempos')
+        if tiempos:
+            st.write(f"Última cotización ({tiempos['motor']}, CP {tiempos['cp']}): **{tiempos['total_ms']:.2f} ms**")
+            st.dataframe(pd.DataFrame({'ms': tiempos['etapas_ms']}))
+        else:
+            st.info("Todavía no hay cotizaciones medidas en esta sesión.")
+        st.write("Cachés de datos:")
+        st.dataframe(pd.DataFrame({nombre: cache.estadisticas() for nombre, cache in obtener_caches().items()}).T)
+        st.write("Registro de cotizaciones (quotes_log):")
+        st.dataframe(pd.DataFrame([obtener_auditoria().estadisticas()]))
+
+        if st.button("📸 Capturar cProfile de la próxima cotización"):
+            st.session_state.perfilar_siguiente = True
+            st.rerun()
+        perfil = st.session_state.get('ultimo_perfil')
+        if perfil:
+            st.caption(f"Volcado: {perfil['ruta']}")
+            st.code(perfil['texto'], language='text')
+            with open(perfil['ruta'], 'rb') as f:
+                st.download_button("Descargar .prof", f.read(), file_name=os.path.basename(perfil['ruta']))
+
+def main_app():
+    iniciar_registro_tiempos()
+    medidor = Medidor()
+    es_admin = st.session_state.username == USUARIO_ADMIN
+    perfilar = es_admin and st.session_state.pop('perfilar_siguiente', False)
+
+    sincronizar_caches()
+    with capturar_perfil(perfilar) as perfil:
+        contexto = pantalla_cotizacion(medidor)
+    if contexto is not None:
+        st.session_state.ultimos_tiempos = medidor.emitir(**contexto)
+    if perfil is not None:
+        st.session_state.ultimo_perfil = perfil
+
+    if es_admin:
+        panel_perfilado()
 
 # --- Flujo principal de la aplicación ---
 if not st.session_state.authenticated:
@@ -0,0 +1,438 @@
+import argparse
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no se puede renombrar un archivo que otro proceso tiene abierto, así que basta con os.replace
+    fcntl = None
+
+from motor_cotizacion import DB_PATH
+
+MAX_PENDIENTES = 10_000
+TAMANO_LOTE = 500
+# Tiempo máximo que un registro espera en la cola antes de escribirse
+INTERVALO_ESCRITURA_S = 1.0
+ESPERA_BLOQUEO_S = 5.0
+REINTENTOS = 3
+# Cada cuánto se reintenta volcar el archivo de respaldo en quotes_log
+INTERVALO_RESPALDO_S = 30.0
+INTERVALO_AVISOS_S = 60.0
+ESPERA_CIERRE_S = 10.0
+
+COLUMNAS = (
+    'ts', 'evento', 'id_cotizacion', 'id_usuario', 'id_producto', 'cp', 'peso_max', 'm3', 'motor',
+    'n_opciones', 'opciones', 'proveedor', 'zona', 'tipo_tarifa', 'precio',
+)
+# Con UNIQUE (id_cotizacion, evento, ts) volver a insertar un respaldo ya volcado no duplica filas
+INSERTAR = f"INSERT OR IGNORE INTO quotes_log ({', '.join(COLUMNAS)}) VALUES ({', '.join('?' * len(COLUMNAS))})"
+
+registro = logging.getLogger('cotizacion.auditoria')
+
+
+def nueva_cotizacion():
+    return uuid.uuid4().hex
+
+def ruta_respaldo(db_path):
+    return db_path + '.quotes_log.pendientes'
+
+def _bloquear(f, esperar=True):
+    # Bloqueo exclusivo entre procesos sobre el archivo abierto; False si está tomado y no se espera
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if esperar else fcntl.LOCK_NB))
+    except BlockingIOError:
+        return False
+    return True
+
+def _sigue_en_ruta(f, ruta):
+    # False si otro proceso renombró el archivo para volcarlo entre open y el bloqueo
+    try:
+        return os.path.samestat(os.fstat(f.fileno()), os.stat(ruta))
+    except FileNotFoundError:
+        return False
+
+def _opcion(opcion):
+    # OpcionEnvio o fila equivalente -> (proveedor, zona, tipo_tarifa, precio)
+    return opcion[0], opcion[1], opcion[2], opcion[3]
+
+def _fila_sql(fila):
+    # Las opciones se pasan a JSON aquí, fuera del hilo que cotiza
+    posicion = COLUMNAS.index('opciones')
+    return (*fila[:posicion], json.dumps(fila[posicion], ensure_ascii=False), *fila[posicion + 1:])
+
+
+class RegistroCotizaciones:
+    """Escritura diferida en quotes_log: registrar solo encola y un hilo inserta por lotes.
+
+    Cada lote (hasta TAMANO_LOTE filas o INTERVALO_ESCRITURA_S de espera) va en una transacción.
+    registrar nunca espera ni toca el disco, y ninguna fila se pierde por defecto:
+    - Con MAX_PENDIENTES filas en cola, la fila pasa a una lista de desborde en memoria que el hilo
+      escribe en el archivo de respaldo (ruta_respaldo). Con descartar=True se descarta y se cuenta
+      en 'descartados'.
+    - Un lote que no se puede insertar tras REINTENTOS intentos también va al respaldo, que el hilo
+      vuelve a volcar en quotes_log cada INTERVALO_RESPALDO_S y al arrancar.
+    - Al terminar el proceso se escribe lo pendiente; lo que no llegue a insertarse queda en el respaldo.
+    """
+
+    _FIN = object()
+
+    def __init__(self, db_path=DB_PATH, max_pendientes=MAX_PENDIENTES, tamano_lote=TAMANO_LOTE,
+                 intervalo_s=INTERVALO_ESCRITURA_S, descartar=False, respaldo=None):
+        self.db_path = db_path
+        self.tamano_lote = tamano_lote
+        self.intervalo_s = intervalo_s
+        self.descartar = descartar
+        self.respaldo = respaldo or ruta_respaldo(db_path)
+        self._cola = queue.Queue(maxsize=max_pendientes)
+        self._desborde = []
+        self._lock = threading.Lock()
+        self._lock_respaldo = threading.Lock()
+        self._deteniendo = False
+        self._avisado = {}
+        self.encolados = 0
+        self.descartados = 0
+        self.desbordados = 0
+        self.escritos = 0
+        self.lotes = 0
+        self.respaldados = 0
+        self.perdidos = 0
+        self._hilo = threading.Thread(target=self._escribir_en_bucle, name='auditoria', daemon=True)
+        self._hilo.start()
+        atexit.register(self.cerrar)
+
+    def _avisar(self, contador, mensaje, *args):
+        # Un warning por contador como mucho cada INTERVALO_AVISOS_S, con el total acumulado
+        ahora = time.monotonic()
+        if ahora - self._avisado.get(contador, -INTERVALO_AVISOS_S) >= INTERVALO_AVISOS_S:
+            self._avisado[contador] = ahora
+            registro.warning(mensaje + " (%s acumulados: %d)", *args, contador, getattr(self, contador))
+
+    # --- ENCOLADO ---
+
+    def _encolar(self, fila):
+        # Nunca bloquea: con la cola llena la fila queda en el desborde y el hilo la pasa al respaldo
+        try:
+            self._cola.put_nowait(fila)
+        except queue.Full:
+            if self.descartar:
+                with self._lock:
+                    self.descartados += 1
+                self._avisar('descartados', "Cola de quotes_log llena: registro descartado")
+                return False
+            with self._lock:
+                self._desborde.append(fila)
+                self.desbordados += 1
+            self._avisar('desbordados', "Cola de quotes_log llena: el registro irá al archivo de respaldo")
+            return True
+        with self._lock:
+            self.encolados += 1
+        return True
+
+    def registrar_mostrada(self, id_cotizacion, opciones, id_usuario=None, id_producto=None, cp=None,
+                           peso_max=None, m3=None, motor=None):
+        # opciones: OpcionEnvio ordenadas por precio; la primera es la más barata
+        mas_barata = _opcion(opciones[0]) if opciones else (None, None, None, None)
+        return self._encolar((
+            time.time(), 'mostrada', id_cotizacion, id_usuario, id_producto, cp, peso_max, m3, motor,
+            len(opciones), opciones, *mas_barata,
+        ))
+
+    def registrar_elegida(self, id_cotizacion, opcion, id_usuario=None, id_producto=None, cp=None,
+                          peso_max=None, m3=None, motor=None):
+        return self._encolar((
+            time.time(), 'elegida', id_cotizacion, id_usuario, id_producto, cp, peso_max, m3, motor,
+            None, opcion, *_opcion(opcion),
+        ))
+
+    # --- RESPALDO EN DISCO ---
+
+    def _respaldar(self, filas):
+        # Una línea JSON por fila, con las opciones ya en JSON; devuelve False si tampoco se pudo escribir
+        try:
+            lineas = ''.join(json.dumps(_fila_sql(f), ensure_ascii=False) + '\n' for f in filas)
+            with self._lock_respaldo:
+                while True:
+                    with open(self.respaldo, 'a', encoding='utf-8') as f:
+                        _bloquear(f)
+                        # Si otro proceso se llevó el archivo para volcarlo, se escribe en uno nuevo
+                        if not _sigue_en_ruta(f, self.respaldo):
+                            continue
+                        f.write(lineas)
+                        f.flush()
+                        os.fsync(f.fileno())
+                        break
+        except (OSError, TypeError, ValueError):
+            with self._lock:
+                self.perdidos += len(filas)
+            registro.exception("No se pudieron guardar %d registros de cotización en %s", len(filas), self.respaldo)
+            return False
+        with self._lock:
+            self.respaldados += len(filas)
+        self._avisar('respaldados', "%d registros de cotización guardados en %s", len(filas), self.respaldo)
+        return True
+
+    def _respaldar_desborde(self):
+        with self._lock:
+            filas, self._desborde = self._desborde, []
+        if filas:
+            self._respaldar(filas)
+
+    def _volcar_respaldo(self, conn):
+        """Inserta en quotes_log el archivo de respaldo y los que dejó un volcado interrumpido.
+
+        El archivo se renombra a un nombre único antes de leerlo: lo que otros procesos agreguen
+        después va a un archivo nuevo. Insertar es idempotente (INSERT OR IGNORE sobre
+        id_cotizacion, evento, ts), así que un archivo que quedó tras una caída entre COMMIT y
+        borrarlo se vuelve a volcar sin duplicar filas.
+        """
+        with self._lock_respaldo:
+            try:
+                os.replace(self.respaldo, f"{self.respaldo}.{uuid.uuid4().hex}.procesando")
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Windows: otro proceso lo tiene abierto; se reintenta en el próximo volcado
+                pass
+        for ruta in glob.glob(glob.escape(self.respaldo) + '.*.procesando'):
+            self._volcar_archivo(conn, ruta)
+
+    def _volcar_archivo(self, conn, ruta):
+        try:
+            f = open(ruta, encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with f:
+            # Otro proceso lo está volcando, o un escritor que lo abrió antes del renombre aún no termina
+            if not _bloquear(f, esperar=False):
+                return
+            filas = []
+            for numero, linea in enumerate(f, 1):
+                try:
+                    filas.append(tuple(json.loads(linea)))
+                except ValueError:
+                    # Línea cortada por una caída a mitad de escritura
+                    registro.warning("Línea %d inválida en %s, se omite", numero, ruta)
+            if filas and not self._transaccion(conn, filas):
+                return
+            try:
+                os.remove(ruta)
+            except OSError:
+                # Ya lo borró otro proceso, o (Windows) sigue abierto: volver a volcarlo no duplica filas
+                pass
+        if filas:
+            with self._lock:
+                self.escritos += len(filas)
+                self.lotes += 1
+            registro.warning("%d registros de cotización recuperados de %s", len(filas), ruta)
+
+    # --- ESCRITURA ---
+
+    def _siguiente_lote(self, timeout=None):
+        # Bloquea hasta el primer elemento (o timeout) y junta más hasta llenar el lote o cumplir el intervalo.
+        # Devuelve (filas, avisos, fin): avisos son Event de vaciar() a marcar tras escribir.
+        filas, avisos = [], []
+        try:
+            elemento = self._cola.get(timeout=timeout)
+        except queue.Empty:
+            return filas, avisos, False
+        limite = time.monotonic() + self.intervalo_s
+        while True:
+            if elemento is self._FIN:
+                return filas, avisos, True
+            if isinstance(elemento, threading.Event):
+                avisos.append(elemento)
+                return filas, avisos, False
+            filas.append(elemento)
+            if len(filas) >= self.tamano_lote:
+                return filas, avisos, False
+            restante = limite - time.monotonic()
+            try:
+                elemento = self._cola.get(timeout=restante) if restante > 0 else self._cola.get_nowait()
+            except queue.Empty:
+                return filas, avisos, False
+
+    def _transaccion(self, conn, filas):
+        # True si el lote quedó escrito; los bloqueos se reintentan salvo al cerrar el proceso
+        for intento in range(REINTENTOS):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.executemany(INSERTAR, filas)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                return True
+            except sqlite3.OperationalError:
+                if intento == REINTENTOS - 1 or self._deteniendo:
+                    registro.exception("No se pudieron escribir %d registros de cotización", len(filas))
+                    return False
+                time.sleep(0.1 * 2 ** intento)
+            except sqlite3.Error:
+                registro.exception("No se pudieron escribir %d registros de cotización", len(filas))
+                return False
+        return False
+
+    def _insertar(self, conn, filas):
+        if self._transaccion(conn, [_fila_sql(f) for f in filas]):
+            with self._lock:
+                self.escritos += len(filas)
+                self.lotes += 1
+        else:
+            self._respaldar(filas)
+
+    def _escribir_en_bucle(self):
+        conn = sqlite3.connect(self.db_path, timeout=ESPERA_BLOQUEO_S, isolation_level=None)
+        try:
+            self._volcar_respaldo(conn)
+            ultimo_volcado = time.monotonic()
+            fin = False
+            while not fin:
+                filas, avisos, fin = self._siguiente_lote(timeout=INTERVALO_RESPALDO_S)
+                if filas:
+                    self._insertar(conn, filas)
+                self._respaldar_desborde()
+                if time.monotonic() - ultimo_volcado >= INTERVALO_RESPALDO_S:
+                    self._volcar_respaldo(conn)
+                    ultimo_volcado = time.monotonic()
+                for aviso in avisos:
+                    aviso.set()
+        finally:
+            conn.close()
+
+    def vaciar(self, timeout=ESPERA_CIERRE_S):
+        # Espera a que se escriba todo lo encolado hasta ahora
+        if not self._hilo.is_alive():
+            return False
+        aviso = threading.Event()
+        self._cola.put(aviso)
+        return aviso.wait(timeout)
+
+    def cerrar(self, timeout=ESPERA_CIERRE_S):
+        # Escribe lo pendiente y detiene el hilo; se llama solo al terminar el proceso.
+        # Si el hilo no termina a tiempo, lo que sigue en cola pasa al respaldo en disco.
+        if not self._hilo.is_alive():
+            return
+        try:
+            self._cola.put(self._FIN, timeout=timeout)
+        except queue.Full:
+            pass
+        self._hilo.join(timeout)
+        if not self._hilo.is_alive():
+            # Lo que llegó al desborde después del último lote del hilo
+            self._respaldar_desborde()
+            return
+        self._deteniendo = True
+        pendientes = []
+        while True:
+            try:
+                elemento = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            if elemento is not self._FIN and not isinstance(elemento, threading.Event):
+                pendientes.append(elemento)
+        with self._lock:
+            pendientes += self._desborde
+            self._desborde = []
+        if pendientes:
+            self._respaldar(pendientes)
+        # El lote en curso termina o, sin reintentos, pasa al respaldo desde el propio hilo
+        self._cola.put(self._FIN)
+        self._hilo.join(ESPERA_BLOQUEO_S + 1)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'pendientes': self._cola.qsize() + len(self._desborde),
+                'encolados': self.encolados,
+                'desbordados': self.desbordados,
+                'escritos': self.escritos,
+                'lotes': self.lotes,
+                'respaldados': self.respaldados,
+                'descartados': self.descartados,
+                'perdidos': self.perdidos,
+            }
+
+
+# --- CONSULTAS ---
+
+def _marca(fecha):
+    # 'AAAA-MM-DD' (o fecha y hora ISO) -> segundos epoch; None sin límite
+    return None if fecha is None else datetime.fromisoformat(str(fecha)).timestamp()
+
+def estadisticas_proveedores(conn, desde=None, hasta=None):
+    """Por (proveedor, zona): veces que fue la opción más barata, veces elegido y precio medio de cada caso.
+
+    Usa el índice (evento, ts, proveedor, zona, precio): no lee las opciones guardadas en JSON.
+    """
+    desde = _marca(desde) or 0.0
+    hasta = _marca(hasta) or float('inf')
+    query = """
+        SELECT proveedor, zona, COUNT(*) AS veces, AVG(precio) AS precio_medio, SUM(precio) AS importe
+        FROM quotes_log
+        WHERE evento = ? AND ts >= ? AND ts < ? AND proveedor IS NOT NULL
+        GROUP BY proveedor, zona
+    """
+    mas_barata = pd.read_sql_query(query, conn, params=('mostrada', desde, hasta))
+    elegida = pd.read_sql_query(query, conn, params=('elegida', desde, hasta))
+    df = mas_barata.merge(elegida, on=['proveedor', 'zona'], how='outer', suffixes=('_mas_barata', '_elegida'))
+    df = df.rename(columns={'veces_mas_barata': 'mas_barata', 'veces_elegida': 'elegida'})
+    for columna in ('mas_barata', 'elegida'):
+        df[columna] = df[columna].fillna(0).astype(int)
+    df = df.drop(columns=['importe_mas_barata'])
+    df['cuota_eleccion'] = df['elegida'] / max(df['elegida'].sum(), 1)
+    return df.sort_values(['elegida', 'mas_barata'], ascending=False).reset_index(drop=True)
+
+def resumen_registro(conn, desde=None, hasta=None):
+    # Cotizaciones mostradas, sin opciones y elegidas en el periodo
+    desde = _marca(desde) or 0.0
+    hasta = _marca(hasta) or float('inf')
+    conteos = dict(conn.execute("""
+        SELECT evento, COUNT(*) FROM quotes_log WHERE evento IN ('mostrada', 'elegida') AND ts >= ? AND ts < ?
+        GROUP BY evento
+    """, (desde, hasta)))
+    sin_opciones = conn.execute("""
+        SELECT COUNT(*) FROM quotes_log WHERE evento = 'mostrada' AND ts >= ? AND ts < ? AND proveedor IS NULL
+    """, (desde, hasta)).fetchone()[0]
+    return {'mostradas': conteos.get('mostrada', 0), 'sin_opciones': sin_opciones, 'elegidas': conteos.get('elegida', 0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estadísticas de selección de proveedores a partir de quotes_log.")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--desde', default=None, help="Fecha inicial (AAAA-MM-DD), incluida")
+    parser.add_argument('--hasta', default=None, help="Fecha final (AAAA-MM-DD), excluida")
+    parser.add_argument('--salida', default=None, help="CSV donde guardar las estadísticas")
+    args = parser.parse_args()
+
+    from migraciones import verificar_esquema
+    verificar_esquema(args.db)
+    conn = sqlite3.connect(args.db)
+    try:
+        resumen = resumen_registro(conn, args.desde, args.hasta)
+        df = estadisticas_proveedores(conn, args.desde, args.hasta)
+    finally:
+        conn.close()
+    print(f"Cotizaciones mostradas: {resumen['mostradas']} (sin opciones: {resumen['sin_opciones']})   "
+          f"elegidas: {resumen['elegidas']}")
+    print(df.to_string(index=False) if not df.empty else "Sin registros en el periodo.")
+    if args.salida:
+        df.to_csv(args.salida, index=False)
+        print(f"✅ Estadísticas guardadas en {args.salida}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+import argparse
+import os
+import random
+import sqlite3
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from motor_cotizacion import RateBook, calcular_m3
+
+DB_BENCHMARK = 'benchmark.db'
+
+Envio = namedtuple('Envio', ['cp', 'largo', 'ancho', 'alto', 'peso_real', 'm3', 'id_usuario'])
+
+
+def generar_envios(conn, n, semilla=7, proporcion_sin_cobertura=0.05, proporcion_repetidos=0.0):
+    # proporcion_repetidos: parte de los envíos que repite uno anterior (mismo producto al mismo CP)
+    r = random.Random(semilla)
+    cps = [fila[0] for fila in conn.execute("SELECT DISTINCT cp FROM cobertura_transportistas")]
+    usuarios = [fila[0] for fila in conn.execute("SELECT id_usuario FROM usuarios")] or [None]
+    envios = []
+    for _ in range(n):
+        if envios and proporcion_repetidos and r.random() < proporcion_repetidos:
+            envios.append(r.choice(envios))
+            continue
+        cp = f"{r.randint(90000, 99999):05d}" if r.random() < proporcion_sin_cobertura else r.choice(cps)
+        largo, ancho, alto = (round(r.uniform(5, 120), 1) for _ in range(3))
+        envios.append(Envio(cp, largo, ancho, alto, round(r.uniform(0.2, 60), 2), calcular_m3(largo, ancho, alto), r.choice(usuarios)))
+    return envios
+
+
+# --- ESCENARIOS ---
+# Cada escenario prepara su estado y devuelve una función que cotiza un envío.
+
+def escenario_app(db_path):
+    # Ruta de main_app: motor en memoria
+    rate_book = RateBook.load(db_path)
+    return lambda e: rate_book.quote(e.cp, e.largo, e.ancho, e.alto, e.peso_real, e.id_usuario, m3=e.m3)
+
+def escenario_app_cache(db_path):
+    # Igual que 'app' con la caché de cotizaciones de main_app
+    from cache_datos import CacheLRU
+    rate_book = RateBook.load(db_path)
+    cache = CacheLRU(maxsize=20_000)
+
+    def cotizar(e):
+        return rate_book.quote(e.cp, e.largo, e.ancho, e.alto, e.peso_real, e.id_usuario, m3=e.m3, cache=cache)
+    cotizar.cache = cache
+    return cotizar
+
+def escenario_legado(db_path):
+    # Ruta de main() en streamlit_app.py: consultas por envío y bucles con iterrows
+    from conexion_db import GestorConexiones
+    import streamlit_app
+    gestor = GestorConexiones(db_path)
+    return lambda e: streamlit_app.calcular_opciones_envio(e.cp, e.largo, e.ancho, e.alto, e.peso_real, e.m3, ejecutar=gestor.consultar)
+
+def escenario_sql(db_path):
+    # Modo SQL de main_app: una sentencia por cotización
+    from conexion_db import GestorConexiones
+    from cotizacion_sql import cotizar_sql
+    gestor = GestorConexiones(db_path)
+
+    def cotizar(e):
+        with gestor.conexion() as conn:
+            return cotizar_sql(conn, e.cp, e.largo, e.ancho, e.alto, e.peso_real, e.id_usuario, m3=e.m3)
+    return cotizar
+
+def escenario_materializada(db_path):
+    # Una sentencia sobre opciones_materializadas; fuera del dominio o con cambios pendientes, motor en memoria
+    from conexion_db import GestorConexiones
+    from materializacion import ContextoMaterializacion, cotizar_materializado, refrescar
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        refrescar(conn)
+    finally:
+        conn.close()
+    gestor = GestorConexiones(db_path)
+    rate_book = RateBook.load(db_path)
+    contexto = ContextoMaterializacion()
+    with gestor.conexion() as conn:
+        contexto.cargar(conn)
+
+    def cotizar(e):
+        with gestor.conexion() as conn:
+            opciones = cotizar_materializado(conn, e.cp, e.largo, e.ancho, e.alto, e.peso_real, e.id_usuario,
+                                             m3=e.m3, contexto=contexto)
+        if opciones is None:
+            return rate_book.quote(e.cp, e.largo, e.ancho, e.alto, e.peso_real, e.id_usuario, m3=e.m3)
+        return opciones
+    return cotizar
+
+ESCENARIOS = {
+    'app': escenario_app,
+    'app_cache': escenario_app_cache,
+    'sql': escenario_sql,
+    'materializada': escenario_materializada,
+    'legado': escenario_legado,
+}
+
+
+def medir(funcion, envios, calentamiento=20):
+    for envio in envios[:calentamiento]:
+        funcion(envio)
+    tiempos = np.empty(len(envios))
+    inicio_total = time.perf_counter()
+    for i, envio in enumerate(envios):
+        inicio = time.perf_counter()
+        funcion(envio)
+        tiempos[i] = time.perf_counter() - inicio
+    total = time.perf_counter() - inicio_total
+    return {
+        'envios': len(envios),
+        'p50_ms': float(np.percentile(tiempos, 50) * 1000),
+        'p99_ms': float(np.percentile(tiempos, 99) * 1000),
+        'cotizaciones_s': len(envios) / total if total else float('inf'),
+    }
+
+def _pedidos(envios):
+    return pd.DataFrame({
+        'cp': [e.cp for e in envios], 'LARGO_CM': [e.largo for e in envios], 'ANCHO_CM': [e.ancho for e in envios],
+        'ALTO_CM': [e.alto for e in envios], 'PESO_KG': [e.peso_real for e in envios], 'M3': [e.m3 for e in envios],
+        'id_usuario': [e.id_usuario for e in envios],
+    })
+
+def medir_lote(db_path, envios):
+    from cotizador_lote import cargar_tablas, cotizar_lote
+    conn = sqlite3.connect(db_path)
+    try:
+        tablas = cargar_tablas(conn)
+    finally:
+        conn.close()
+    df = _pedidos(envios)
+    inicio = time.perf_counter()
+    cotizar_lote(tablas, df)
+    total = time.perf_counter() - inicio
+    return {'envios': len(envios), 'p50_ms': float('nan'), 'p99_ms': float('nan'), 'cotizaciones_s': len(envios) / total}
+
+def medir_escalado(db_path, envios, max_procesos=None, tamano_bloque=10_000):
+    """Pedidos/s de cotizador_lote con 1..max_procesos procesos.
+
+    Con 1 proceso se cotiza en el proceso actual, sin pool; con más, cotizar_en_procesos. El tiempo
+    incluye publicar las tablas en memoria compartida y arrancar el pool.
+    """
+    from cotizador_lote import cargar_tablas, cotizar_en_procesos, cotizar_lote, preparar_pedidos
+    conn = sqlite3.connect(db_path)
+    try:
+        tablas = cargar_tablas(conn)
+        df = _pedidos(envios)
+        bloques = [df.iloc[i:i + tamano_bloque] for i in range(0, len(df), tamano_bloque)]
+        resultados = []
+        for procesos in range(1, (max_procesos or os.cpu_count()) + 1):
+            inicio = time.perf_counter()
+            if procesos == 1:
+                for bloque in bloques:
+                    cotizar_lote(tablas, preparar_pedidos(conn, bloque))
+            else:
+                for _ in cotizar_en_procesos(tablas, bloques, db_path, procesos=procesos):
+                    pass
+            total = time.perf_counter() - inicio
+            resultados.append({'procesos': procesos, 'segundos': total, 'pedidos_s': len(df) / total})
+    finally:
+        conn.close()
+    base = resultados[0]['pedidos_s']
+    for r in resultados:
+        r['aceleracion'] = r['pedidos_s'] / base
+        r['eficiencia'] = r['aceleracion'] / r['procesos']
+    return resultados
+
+def ejecutar_benchmark(db_path, n_envios=2000, n_envios_legado=200, escenarios=None, lote=True, semilla=7,
+                       proporcion_repetidos=0.0):
+    conn = sqlite3.connect(db_path)
+    try:
+        envios = generar_envios(conn, n_envios, semilla, proporcion_repetidos=proporcion_repetidos)
+    finally:
+        conn.close()
+
+    resultados = {}
+    for nombre in escenarios or ESCENARIOS:
+        inicio = time.perf_counter()
+        funcion = ESCENARIOS[nombre](db_path)
+        preparacion = time.perf_counter() - inicio
+        muestra = envios[:n_envios_legado] if nombre == 'legado' else envios
+        resultados[nombre] = dict(medir(funcion, muestra), preparacion_s=preparacion)
+        if hasattr(funcion, 'cache'):
+            resultados[nombre]['cache'] = funcion.cache.estadisticas()
+    if lote:
+        resultados['lote'] = dict(medir_lote(db_path, envios), preparacion_s=float('nan'))
+    return resultados
+
+def imprimir_resultados(resultados):
+    print(f"{'escenario':<15}{'envíos':>8}{'prep. (s)':>11}{'p50 (ms)':>11}{'p99 (ms)':>11}{'cotiz./s':>12}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:<15}{r['envios']:>8}{r['preparacion_s']:>11.3f}{r['p50_ms']:>11.3f}{r['p99_ms']:>11.3f}{r['cotizaciones_s']:>12.0f}")
+    for nombre, r in resultados.items():
+        if 'cache' in r:
+            c = r['cache']
+            print(f"Caché de {nombre}: {c['entradas']} entradas, {c['aciertos']} aciertos, {c['fallos']} fallos "
+                  f"({c['tasa_aciertos']:.1%}), {c['desalojos']} desalojos")
+
+
+def imprimir_escalado(resultados):
+    print(f"{'procesos':>9}{'seg.':>9}{'pedidos/s':>12}{'aceleración':>13}{'eficiencia':>12}")
+    for r in resultados:
+        print(f"{r['procesos']:>9}{r['segundos']:>9.2f}{r['pedidos_s']:>12.0f}{r['aceleracion']:>12.2f}x{r['eficiencia']:>11.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide latencia (p50/p99) y cotizaciones por segundo de cada ruta de cálculo.")
+    parser.add_argument('--db', default=DB_BENCHMARK)
+    parser.add_argument('--generar', action='store_true', help="Regenera la base sintética antes de medir")
+    parser.add_argument('--cps', type=int, default=10_000)
+    parser.add_argument('--proveedores', type=int, default=8)
+    parser.add_argument('--tramos', type=int, default=10)
+    parser.add_argument('--envios', type=int, default=2000)
+    parser.add_argument('--envios-legado', type=int, default=200, help="La ruta legada es lenta; se mide con menos envíos")
+    parser.add_argument('--escenarios', default=','.join(ESCENARIOS), help=f"Lista separada por comas: {', '.join(ESCENARIOS)}")
+    parser.add_argument('--sin-lote', action='store_true')
+    parser.add_argument('--repetidos', type=float, default=0.0,
+                        help="Proporción de envíos que repiten uno anterior (para medir la caché de cotizaciones)")
+    parser.add_argument('--escalado', type=int, default=None, metavar='N',
+                        help="Solo mide cotizador_lote con 1..N procesos (0 = todos los núcleos)")
+    parser.add_argument('--tamano-bloque', type=int, default=10_000, help="Pedidos por bloque en --escalado")
+    args = parser.parse_args()
+
+    if args.generar or not os.path.exists(args.db):
+        from generar_datos import generar
+        if os.path.exists(args.db):
+            os.remove(args.db)
+        generar(args.db, n_cps=args.cps, n_proveedores=args.proveedores, n_tramos=args.tramos)
+
+    if args.escalado is not None:
+        conn = sqlite3.connect(args.db)
+        try:
+            envios = generar_envios(conn, args.envios)
+        finally:
+            conn.close()
+        print(f"Núcleos disponibles: {os.cpu_count()}   pedidos: {len(envios)}")
+        imprimir_escalado(medir_escalado(args.db, envios, args.escalado or None, args.tamano_bloque))
+        return
+
+    resultados = ejecutar_benchmark(
+        args.db, args.envios, args.envios_legado, [e for e in args.escenarios.split(',') if e], not args.sin_lote,
+        proporcion_repetidos=args.repetidos,
+    )
+    imprimir_resultados(resultados)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+TAMANO_PAGINA = 50
+
+
+def limite_superior_prefijo(prefijo):
+    # Menor cadena mayor que todas las que empiezan con el prefijo: 'AB' -> 'AC'
+    return prefijo[:-1] + chr(ord(prefijo[-1]) + 1)
+
+def buscar_skus(conn, prefijo='', limite=TAMANO_PAGINA, despues_de=None):
+    # Búsqueda por rango sobre idx_productos_id: el costo depende de la página, no del catálogo.
+    # La paginación es por clave (despues_de = último SKU de la página anterior), sin OFFSET.
+    condiciones = ["ID_PRODUCTO IS NOT NULL"]
+    params = []
+    if prefijo:
+        condiciones.append("ID_PRODUCTO >= ? AND ID_PRODUCTO < ?")
+        params += [prefijo, limite_superior_prefijo(prefijo)]
+    if despues_de is not None:
+        condiciones.append("ID_PRODUCTO > ?")
+        params.append(despues_de)
+    filas = conn.execute(f"""
+        SELECT DISTINCT ID_PRODUCTO FROM productos
+        WHERE {' AND '.join(condiciones)}
+        ORDER BY ID_PRODUCTO
+        LIMIT ?
+    """, params + [limite + 1]).fetchall()
+    skus = [fila[0] for fila in filas[:limite]]
+    return skus, len(filas) > limite
@@ -0,0 +1,86 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from migraciones import TABLAS_VERSIONADAS
+
+
+def leer_versiones(conn):
+    # {tabla: version}; None si la base aún no tiene la migración de version_datos
+    try:
+        return dict(conn.execute("SELECT tabla, version FROM version_datos"))
+    except sqlite3.OperationalError:
+        return None
+
+
+class CacheLRU:
+    """Caché LRU con TTL opcional que se vacía cuando cambia la versión de sus tablas.
+
+    Los valores se comparten entre sesiones: quien los recibe no debe modificarlos.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, tablas=TABLAS_VERSIONADAS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.tablas = tuple(tablas)
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.expirados = 0
+        self.invalidaciones = 0
+
+    def sincronizar(self, versiones):
+        version = tuple(versiones.get(tabla) for tabla in self.tablas) if versiones else None
+        with self._lock:
+            if version != self._version:
+                if self._datos:
+                    self.invalidaciones += 1
+                self._datos.clear()
+                self._version = version
+
+    def obtener(self, clave, calcular):
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None:
+                if self.ttl is None or ahora - entrada[1] < self.ttl:
+                    self._datos.move_to_end(clave)
+                    self.aciertos += 1
+                    return entrada[0]
+                del self._datos[clave]
+                self.expirados += 1
+            self.fallos += 1
+            version = self._version
+
+        valor = calcular()
+
+        with self._lock:
+            # Si la versión cambió mientras se calculaba, el valor ya no se guarda
+            if version == self._version:
+                self._datos[clave] = (valor, ahora)
+                self._datos.move_to_end(clave)
+                while len(self._datos) > self.maxsize:
+                    self._datos.popitem(last=False)
+                    self.desalojos += 1
+        return valor
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._datos),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': self.aciertos / consultas if consultas else 0.0,
+                'desalojos': self.desalojos,
+                'expirados': self.expirados,
+                'invalidaciones': self.invalidaciones,
+            }
@@ -0,0 +1,88 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+from motor_cotizacion import DB_PATH
+
+MAX_CONEXIONES = 8
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 64 * 1024
+# Sentencias preparadas que sqlite3 conserva por conexión (clave: texto de la consulta)
+SENTENCIAS_EN_CACHE = 256
+ESPERA_BLOQUEO_S = 5.0
+
+
+class GestorConexiones:
+    """Pool de conexiones de lectura a SQLite en modo WAL, reutilizadas entre consultas y reruns."""
+
+    def __init__(self, db_path=DB_PATH, max_conexiones=MAX_CONEXIONES, mmap_size=MMAP_SIZE,
+                 cache_size_kib=CACHE_SIZE_KIB):
+        self.db_path = db_path
+        self.max_conexiones = max_conexiones
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self._libres = queue.LifoQueue()
+        self._abiertas = []
+        self._lock = threading.Lock()
+        self._wal_configurado = False
+
+    def _abrir(self):
+        # check_same_thread=False: el pool garantiza que cada conexión la usa un solo hilo a la vez
+        conn = sqlite3.connect(
+            self.db_path, timeout=ESPERA_BLOQUEO_S, check_same_thread=False,
+            cached_statements=SENTENCIAS_EN_CACHE,
+        )
+        with self._lock:
+            if not self._wal_configurado:
+                # El modo WAL queda guardado en el archivo: lectores y escritor no se bloquean entre sí
+                try:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                except sqlite3.OperationalError:
+                    pass
+                self._wal_configurado = True
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    @contextmanager
+    def conexion(self):
+        try:
+            conn = self._libres.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                crear = len(self._abiertas) < self.max_conexiones
+                if crear:
+                    # Se reserva el lugar antes de abrir para no pasar del límite
+                    self._abiertas.append(None)
+            if crear:
+                try:
+                    conn = self._abrir()
+                except Exception:
+                    with self._lock:
+                        self._abiertas.remove(None)
+                    raise
+                with self._lock:
+                    self._abiertas[self._abiertas.index(None)] = conn
+            else:
+                conn = self._libres.get()
+        try:
+            yield conn
+        finally:
+            self._libres.put(conn)
+
+    def consultar(self, query, params=()):
+        with self.conexion() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    def cerrar(self):
+        with self._lock:
+            abiertas, self._abiertas = self._abiertas, []
+        for conn in abiertas:
+            if conn is not None:
+                conn.close()
+        self._libres = queue.LifoQueue()
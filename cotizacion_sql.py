@@ -0,0 +1,108 @@
+from motor_cotizacion import OpcionEnvio, calcular_m3, calcular_pesos, normalizar_cp
+
+# Toda la cotización en una sentencia: cobertura de ambos tipos de validación, tramo volumétrico con
+# kg adicional, primera tarifa m3 (ROW_NUMBER) y descuento del usuario. Solo vuelven las opciones finales.
+# Cobertura, tarifas y descuentos se cruzan por id_proveedor; el nombre normalizado sale de proveedores.
+CONSULTA_COTIZACION = """
+WITH cobertura AS (
+    SELECT rowid AS orden, id_proveedor, zona, periodicidad
+    FROM cobertura_transportistas
+    WHERE cp = :cp
+      AND (validacion_tipo = 'DIMENSIONES' OR validacion_tipo IS NULL)
+      AND largo_max_cm >= :largo
+      AND ancho_max_cm >= :ancho
+      AND alto_max_cm >= :alto
+      AND peso_max_kg >= :peso_real
+    UNION ALL
+    SELECT rowid AS orden, id_proveedor, zona, periodicidad
+    FROM cobertura_transportistas
+    WHERE cp = :cp
+      AND validacion_tipo = 'VOLUMEN'
+      AND peso_max_kg >= :peso_real
+      AND volumen_max_m3 >= :m3
+),
+volumetricas AS (
+    SELECT
+        c.id_proveedor,
+        c.zona,
+        c.periodicidad,
+        'volumetrico' AS tipo_tarifa,
+        t.precio_base + CASE
+            WHEN t.umbral_kg_adicional IS NOT NULL AND :peso_max > t.umbral_kg_adicional
+            THEN (:peso_max - t.umbral_kg_adicional) * t.costo_kg_adicional
+            ELSE 0
+        END AS precio_calculado
+    FROM cobertura AS c
+    JOIN tarifas_envio AS t
+        ON t.id_proveedor = c.id_proveedor
+        AND t.zona = c.zona
+    WHERE t.tipo_tarifa = 'volumetrico'
+      AND t.rango_peso_min <= :peso_max
+      AND t.rango_peso_max >= :peso_max
+),
+tramos_m3 AS (
+    SELECT
+        c.id_proveedor,
+        c.zona,
+        c.periodicidad,
+        'm3' AS tipo_tarifa,
+        t.precio_base AS precio_calculado,
+        ROW_NUMBER() OVER (ORDER BY t.rango_peso_min, c.orden, t.rowid) AS posicion
+    FROM cobertura AS c
+    JOIN tarifas_envio AS t
+        ON t.id_proveedor = c.id_proveedor
+        AND t.zona = c.zona
+    WHERE t.tipo_tarifa = 'm3'
+      AND t.rango_peso_min <= :peso_real
+      AND t.rango_peso_max >= :peso_real
+      AND t.m3_amparado >= :m3
+),
+calculadas AS (
+    SELECT id_proveedor, zona, periodicidad, tipo_tarifa, precio_calculado FROM volumetricas
+    UNION ALL
+    SELECT id_proveedor, zona, periodicidad, tipo_tarifa, precio_calculado FROM tramos_m3 WHERE posicion = 1
+),
+descuentos AS (
+    SELECT
+        id_proveedor,
+        CAST(zona AS TEXT) AS zona,
+        descuento_porcentaje,
+        ROW_NUMBER() OVER (PARTITION BY id_proveedor, CAST(zona AS TEXT) ORDER BY rowid) AS posicion
+    FROM descuentos_usuario
+    WHERE id_usuario = :id_usuario
+)
+SELECT
+    p.nombre AS proveedor,
+    CAST(k.zona AS TEXT) AS zona,
+    k.tipo_tarifa,
+    k.precio_calculado * (1 - COALESCE(d.descuento_porcentaje, 0)) AS precio_envio,
+    k.periodicidad,
+    CASE WHEN d.descuento_porcentaje IS NULL THEN 'No' ELSE 'Sí' END AS descuento_aplicado
+FROM calculadas AS k
+JOIN proveedores AS p ON p.id_proveedor = k.id_proveedor
+LEFT JOIN descuentos AS d
+    ON d.id_proveedor = k.id_proveedor
+    AND d.zona = CAST(k.zona AS TEXT)
+    AND d.posicion = 1
+WHERE k.precio_calculado IS NOT NULL
+ORDER BY precio_envio
+"""
+
+
+def parametros_cotizacion(cp, largo, ancho, alto, peso_real, user_id=None, m3=None):
+    if m3 is None:
+        m3 = calcular_m3(largo, ancho, alto)
+    _, peso_max = calcular_pesos(largo, ancho, alto, peso_real)
+    return {
+        'cp': normalizar_cp(cp), 'largo': largo, 'ancho': ancho, 'alto': alto,
+        'peso_real': peso_real, 'm3': m3, 'peso_max': peso_max, 'id_usuario': user_id,
+    }
+
+def cotizar_sql(conn, cp, largo, ancho, alto, peso_real, user_id=None, m3=None):
+    # Mismo contrato que RateBook.quote, calculado por SQLite
+    params = parametros_cotizacion(cp, largo, ancho, alto, peso_real, user_id, m3)
+    # El redondeo se hace en Python: ROUND de SQLite difiere de round() en los casos .xx5
+    return [
+        OpcionEnvio(proveedor, zona, tipo_tarifa, round(precio, 2), periodicidad, descuento)
+        for proveedor, zona, tipo_tarifa, precio, periodicidad, descuento in conn.execute(CONSULTA_COTIZACION, params)
+    ]
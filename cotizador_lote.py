@@ -0,0 +1,479 @@
+import argparse
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from migraciones import verificar_esquema
+from motor_cotizacion import DB_PATH, DIVISOR_VOLUMETRICO, normalizar_zona
+
+COLUMNAS_PRODUCTO = ['LARGO_CM', 'ANCHO_CM', 'ALTO_CM', 'PESO_KG', 'M3']
+COLUMNAS_SALIDA = [
+    'proveedor', 'zona', 'tipo_tarifa', 'precio_envio', 'periodicidad', 'descuento_aplicado'
+]
+TAMANO_BLOQUE = 50_000
+# SQLite limita la cantidad de parámetros por consulta
+MAX_PARAMETROS = 500
+
+# Códigos de validación de la cobertura
+VALIDA_DIMENSIONES = 0
+VALIDA_VOLUMEN = 1
+VALIDA_OTRA = 2
+
+
+# --- CARGA DE TABLAS EN ARREGLOS ---
+
+def _columna(df, nombre):
+    return pd.to_numeric(df[nombre], errors='coerce').to_numpy(dtype=float)
+
+def _offsets(codigos_ordenados, n):
+    # Para códigos 0..n-1 ya ordenados, devuelve inicio/fin de cada código
+    inicios = np.searchsorted(codigos_ordenados, np.arange(n), side='left')
+    fines = np.searchsorted(codigos_ordenados, np.arange(n), side='right')
+    return inicios, fines
+
+def _expandir(inicios, conteos):
+    # Expande rangos [inicio, inicio + conteo) sin bucles: devuelve (índice del padre, índice del hijo)
+    padre = np.repeat(np.arange(len(conteos)), conteos)
+    desplazamiento = np.arange(len(padre)) - np.repeat(np.cumsum(conteos) - conteos, conteos)
+    return padre, np.repeat(inicios, conteos) + desplazamiento
+
+def leer_tarifas(conn, tabla='tarifas_envio'):
+    return pd.read_sql_query(f"""
+        SELECT rowid AS orden, id_proveedor, zona, tipo_tarifa, rango_peso_min, rango_peso_max,
+               m3_amparado, precio_base, umbral_kg_adicional, costo_kg_adicional
+        FROM {tabla}
+        WHERE id_proveedor IS NOT NULL AND zona IS NOT NULL AND tipo_tarifa IN ('volumetrico', 'm3')
+    """, conn)
+
+def cargar_tablas(conn, tabla_tarifas='tarifas_envio'):
+    # Cobertura, tarifas y descuentos se cruzan por id_proveedor (-1 si la fila no tiene proveedor).
+    # tabla_tarifas permite cotizar con otra versión de las tarifas con el mismo esquema.
+    df_cob = pd.read_sql_query("""
+        SELECT rowid AS orden, cp, COALESCE(id_proveedor, -1) AS id_proveedor, zona, periodicidad, validacion_tipo,
+               largo_max_cm, ancho_max_cm, alto_max_cm, peso_max_kg, volumen_max_m3
+        FROM cobertura_transportistas
+    """, conn)
+    df_tar = leer_tarifas(conn, tabla_tarifas)
+    df_desc = pd.read_sql_query("""
+        SELECT id_usuario, id_proveedor, zona, descuento_porcentaje
+        FROM descuentos_usuario
+        WHERE id_proveedor IS NOT NULL
+        ORDER BY rowid
+    """, conn)
+    nombres = dict(conn.execute("SELECT id_proveedor, nombre FROM proveedores"))
+
+    # Cada (id_proveedor, zona) de tarifas recibe un código entero
+    df_tar['tramo'] = df_tar.groupby(['id_proveedor', 'zona'], sort=False).ngroup()
+    tramos = df_tar.drop_duplicates('tramo').sort_values('tramo')
+    df_cob = df_cob.merge(tramos[['id_proveedor', 'zona', 'tramo']], on=['id_proveedor', 'zona'], how='left')
+    df_cob['tramo'] = df_cob['tramo'].fillna(-1).astype(int)
+
+    # Clave (id_proveedor, zona) usada por los descuentos
+    claves = pd.Series(list(zip(tramos['id_proveedor'], tramos['zona'].map(normalizar_zona))))
+    codigo_clave, claves_unicas = pd.factorize(claves)
+
+    # Cobertura ordenada por CP
+    df_cob['cp'] = df_cob['cp'].astype(str).str.strip().str.zfill(5)
+    df_cob = df_cob.sort_values(['cp', 'orden'], kind='stable').reset_index(drop=True)
+    cps, cob_cp = np.unique(df_cob['cp'].to_numpy(dtype=str), return_inverse=True)
+    cp_ini, cp_fin = _offsets(cob_cp, len(cps))
+    validacion = np.full(len(df_cob), VALIDA_OTRA)
+    validacion[(df_cob['validacion_tipo'] == 'DIMENSIONES') | df_cob['validacion_tipo'].isna()] = VALIDA_DIMENSIONES
+    validacion[df_cob['validacion_tipo'] == 'VOLUMEN'] = VALIDA_VOLUMEN
+    # Periodicidad como código entero; el código -1 (sin periodicidad) apunta al None del final
+    codigo_periodicidad, periodicidades = pd.factorize(df_cob['periodicidad'])
+
+    n_tramos = len(tramos)
+    tablas = {
+        'cps': cps,
+        'cp_ini': cp_ini,
+        'cp_fin': cp_fin,
+        'cob_orden': df_cob['orden'].to_numpy(),
+        'cob_tramo': df_cob['tramo'].to_numpy(),
+        'cob_validacion': validacion,
+        'cob_largo': _columna(df_cob, 'largo_max_cm'),
+        'cob_ancho': _columna(df_cob, 'ancho_max_cm'),
+        'cob_alto': _columna(df_cob, 'alto_max_cm'),
+        'cob_peso': _columna(df_cob, 'peso_max_kg'),
+        'cob_volumen': _columna(df_cob, 'volumen_max_m3'),
+        'cob_periodicidad': codigo_periodicidad,
+        'periodicidades': np.array([*periodicidades, None], dtype=object),
+        'tramo_proveedor': np.array([nombres[c[0]] for c in claves_unicas], dtype=object)[codigo_clave],
+        'tramo_zona': np.array([c[1] for c in claves_unicas], dtype=object)[codigo_clave],
+        'tramo_clave': codigo_clave,
+    }
+
+    for tipo, prefijo in (('volumetrico', 'vol'), ('m3', 'm3')):
+        df = df_tar[df_tar['tipo_tarifa'] == tipo].copy()
+        for col in ('rango_peso_min', 'rango_peso_max', 'm3_amparado'):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        requeridas = ['rango_peso_min', 'rango_peso_max'] + (['m3_amparado'] if tipo == 'm3' else [])
+        df = df.dropna(subset=requeridas).sort_values(['tramo', 'rango_peso_min', 'orden'], kind='stable')
+        inicios, fines = _offsets(df['tramo'].to_numpy(), n_tramos)
+        tablas.update({
+            f'{prefijo}_ini': inicios,
+            f'{prefijo}_fin': fines,
+            f'{prefijo}_tramo': df['tramo'].to_numpy(),
+            f'{prefijo}_orden': df['orden'].to_numpy(),
+            f'{prefijo}_min': df['rango_peso_min'].to_numpy(dtype=float),
+            f'{prefijo}_max': df['rango_peso_max'].to_numpy(dtype=float),
+            f'{prefijo}_m3': df['m3_amparado'].to_numpy(dtype=float),
+            f'{prefijo}_precio': _columna(df, 'precio_base'),
+            f'{prefijo}_umbral': _columna(df, 'umbral_kg_adicional'),
+            f'{prefijo}_costo': _columna(df, 'costo_kg_adicional'),
+        })
+
+    # Búsqueda binaria de tramos volumétricos sobre una sola clave: tramo * escala + rango_peso_min
+    valores = np.concatenate([tablas['vol_min'], tablas['vol_max'], [0.0]])
+    piso, techo = float(valores.min()), float(valores.max()) + 1
+    escala = techo - piso + 1
+    tablas['vol_techo'] = techo
+    tablas['vol_piso'] = piso
+    tablas['vol_escala'] = escala
+    tablas['vol_clave'] = tablas['vol_tramo'] * escala + (tablas['vol_min'] - piso)
+
+    # Tramos solapados (p. ej. 0-5 y 5-10 con extremos inclusivos): la profundidad es
+    # cuántos tramos anteriores pueden seguir vigentes al caer en cada tramo
+    max_acumulado = pd.Series(tablas['vol_max']).groupby(tablas['vol_tramo']).cummax().to_numpy()
+    clave_acumulada = tablas['vol_tramo'] * escala + (max_acumulado - piso)
+    primero_vigente = np.searchsorted(clave_acumulada, tablas['vol_clave'], side='left')
+    profundidad = np.arange(len(primero_vigente)) - primero_vigente + 1
+    tablas['vol_profundidad'] = int(profundidad.max()) if len(profundidad) else 0
+
+    # Descuentos: clave compuesta id_usuario * n_claves + clave (primer registro gana)
+    n_claves = max(len(claves_unicas), 1)
+    df_claves = pd.DataFrame({
+        'id_proveedor': [c[0] for c in claves_unicas],
+        'zona': [c[1] for c in claves_unicas],
+        'clave': np.arange(len(claves_unicas)),
+    })
+    df_desc = df_desc.merge(df_claves, on=['id_proveedor', 'zona'], how='inner', sort=False)
+    df_desc = df_desc[df_desc['id_usuario'].notna()]
+    compuesta = df_desc['id_usuario'].astype('int64').to_numpy() * n_claves + df_desc['clave'].to_numpy()
+    compuesta, primeros = np.unique(compuesta, return_index=True)
+    tablas['n_claves'] = n_claves
+    tablas['desc_clave'] = compuesta
+    tablas['desc_porcentaje'] = df_desc['descuento_porcentaje'].to_numpy(dtype=float)[primeros]
+    return tablas
+
+
+# --- COTIZACIÓN VECTORIZADA ---
+
+def preparar_pedidos(conn, df_pedidos, id_usuario=None):
+    # Completa dimensiones desde 'productos' cuando el pedido trae ID_PRODUCTO
+    df = df_pedidos.copy()
+    for col in COLUMNAS_PRODUCTO:
+        if col not in df.columns:
+            df[col] = np.nan
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    if 'ID_PRODUCTO' in df.columns:
+        skus = df['ID_PRODUCTO'].dropna().astype(str).unique().tolist()
+        partes = []
+        for i in range(0, len(skus), MAX_PARAMETROS):
+            bloque = skus[i:i + MAX_PARAMETROS]
+            partes.append(pd.read_sql_query(
+                f"SELECT ID_PRODUCTO, {', '.join(COLUMNAS_PRODUCTO)} FROM productos "
+                f"WHERE ID_PRODUCTO IN ({','.join('?' * len(bloque))})",
+                conn, params=bloque,
+            ))
+        if partes:
+            df_productos = pd.concat(partes, ignore_index=True)
+            df_productos['ID_PRODUCTO'] = df_productos['ID_PRODUCTO'].astype(str)
+            df_productos = df_productos.drop_duplicates('ID_PRODUCTO').set_index('ID_PRODUCTO')
+            sku = df['ID_PRODUCTO'].astype(str)
+            for col in COLUMNAS_PRODUCTO:
+                desde_producto = pd.to_numeric(sku.map(df_productos[col]), errors='coerce')
+                df[col] = desde_producto.where(df['ID_PRODUCTO'].notna(), np.nan).fillna(df[col])
+
+    sin_m3 = df['M3'].isna()
+    df.loc[sin_m3, 'M3'] = df['LARGO_CM'] * df['ANCHO_CM'] * df['ALTO_CM'] / 1_000_000
+
+    if 'id_usuario' not in df.columns:
+        df['id_usuario'] = id_usuario
+    df['cp'] = df['cp'].astype(str).str.strip().str.zfill(5)
+    return df
+
+def _redondear_precios(precios):
+    # Igual que round(precio, 2) de RateBook: np.round redondea sobre precio * 100 y en los casos .xx5
+    # puede diferir en un centavo. Solo esos casos pasan por round() de Python.
+    redondeados = np.round(precios, 2)
+    escalados = precios * 100
+    with np.errstate(invalid='ignore'):
+        dudosos = np.flatnonzero(np.abs(escalados - np.floor(escalados) - 0.5) < 1e-6)
+    for i in dudosos:
+        redondeados[i] = round(float(precios[i]), 2)
+    return redondeados
+
+def opciones_lote(tablas, df_pedidos):
+    # Devuelve todas las opciones viables de cada pedido (formato largo, índice 'pedido')
+    cp = df_pedidos['cp'].to_numpy(dtype=str)
+    largo = df_pedidos['LARGO_CM'].to_numpy(dtype=float)
+    ancho = df_pedidos['ANCHO_CM'].to_numpy(dtype=float)
+    alto = df_pedidos['ALTO_CM'].to_numpy(dtype=float)
+    peso_real = df_pedidos['PESO_KG'].to_numpy(dtype=float)
+    m3 = df_pedidos['M3'].to_numpy(dtype=float)
+    usuario = pd.to_numeric(df_pedidos['id_usuario'], errors='coerce').to_numpy(dtype=float)
+
+    peso_vol = largo * ancho * alto / DIVISOR_VOLUMETRICO
+    peso_max = np.ceil(np.fmax(peso_real, peso_vol))
+
+    # Pedidos × coberturas de su CP
+    cps = tablas['cps']
+    if len(cps) == 0:
+        return pd.DataFrame(columns=['pedido'] + COLUMNAS_SALIDA)
+    pos = np.minimum(np.searchsorted(cps, cp), len(cps) - 1)
+    validos = (cps[pos] == cp) & np.all([largo > 0, ancho > 0, alto > 0, peso_real > 0, m3 > 0], axis=0)
+    conteos = np.where(validos, tablas['cp_fin'][pos] - tablas['cp_ini'][pos], 0)
+    pedido, cob = _expandir(tablas['cp_ini'][pos], conteos)
+
+    tipo = tablas['cob_validacion'][cob]
+    p_real = peso_real[pedido]
+    p_m3 = m3[pedido]
+    with np.errstate(invalid='ignore'):
+        acepta_dim = (
+            (tipo == VALIDA_DIMENSIONES) & (tablas['cob_largo'][cob] >= largo[pedido])
+            & (tablas['cob_ancho'][cob] >= ancho[pedido]) & (tablas['cob_alto'][cob] >= alto[pedido])
+            & (tablas['cob_peso'][cob] >= p_real)
+        )
+        acepta_vol = (tipo == VALIDA_VOLUMEN) & (tablas['cob_peso'][cob] >= p_real) & (tablas['cob_volumen'][cob] >= p_m3)
+    aceptada = (acepta_dim | acepta_vol) & (tablas['cob_tramo'][cob] >= 0)
+    pedido, cob = pedido[aceptada], cob[aceptada]
+    tramo = tablas['cob_tramo'][cob]
+
+    # Tarifa volumétrica: búsqueda binaria del último tramo con rango_peso_min <= peso_max
+    # y revisión hacia atrás hasta la profundidad de solapamiento de la tabla
+    p_max_pares = peso_max[pedido]
+    consulta = tramo * tablas['vol_escala'] + (np.minimum(p_max_pares, tablas['vol_techo']) - tablas['vol_piso'])
+    ultimo = np.searchsorted(tablas['vol_clave'], consulta, side='right') - 1
+    partes = []
+    for atras in range(tablas['vol_profundidad']):
+        idx = ultimo - atras
+        idx_valido = np.maximum(idx, 0)
+        en_tramo = (idx >= 0) & (tablas['vol_tramo'][idx_valido] == tramo) & (tablas['vol_max'][idx_valido] >= p_max_pares)
+        partes.append((np.flatnonzero(en_tramo), idx[en_tramo]))
+    v_par = np.concatenate([p for p, _ in partes] + [np.zeros(0, int)])
+    v_tar = np.concatenate([t for _, t in partes] + [np.zeros(0, int)])
+    v_pedido, v_cob, p_max = pedido[v_par], cob[v_par], p_max_pares[v_par]
+    umbral = tablas['vol_umbral'][v_tar]
+    excedente = np.where(
+        ~np.isnan(umbral) & (p_max > umbral),
+        (p_max - umbral) * tablas['vol_costo'][v_tar],
+        0.0,
+    )
+    v_precio = tablas['vol_precio'][v_tar] + excedente
+
+    # Tarifa m3: primer tramo válido (menor rango_peso_min) entre todos los proveedores del pedido
+    conteos_m3 = tablas['m3_fin'][tramo] - tablas['m3_ini'][tramo]
+    par, m_tar = _expandir(tablas['m3_ini'][tramo], conteos_m3)
+    m_pedido = pedido[par]
+    valido = (
+        (tablas['m3_min'][m_tar] <= peso_real[m_pedido]) & (tablas['m3_max'][m_tar] >= peso_real[m_pedido])
+        & (tablas['m3_m3'][m_tar] >= m3[m_pedido])
+    )
+    par, m_tar, m_pedido = par[valido], m_tar[valido], m_pedido[valido]
+    orden = np.lexsort((tablas['m3_orden'][m_tar], tablas['cob_orden'][cob[par]], tablas['m3_min'][m_tar], m_pedido))
+    par, m_tar, m_pedido = par[orden], m_tar[orden], m_pedido[orden]
+    primero = np.ones(len(m_pedido), bool)
+    primero[1:] = m_pedido[1:] != m_pedido[:-1]
+    par, m_tar, m_pedido = par[primero], m_tar[primero], m_pedido[primero]
+
+    o_pedido = np.concatenate([v_pedido, m_pedido])
+    o_cob = np.concatenate([v_cob, cob[par]])
+    o_precio = np.concatenate([v_precio, tablas['m3_precio'][m_tar]])
+    o_tipo = np.concatenate([np.full(len(v_pedido), 'volumetrico', dtype=object), np.full(len(m_pedido), 'm3', dtype=object)])
+    conservar = ~np.isnan(o_precio)
+    o_pedido, o_cob, o_precio, o_tipo = o_pedido[conservar], o_cob[conservar], o_precio[conservar], o_tipo[conservar]
+    o_tramo = tablas['cob_tramo'][o_cob]
+
+    # Descuentos por (usuario, id_proveedor, zona)
+    o_usuario = usuario[o_pedido]
+    con_usuario = ~np.isnan(o_usuario)
+    compuesta = np.where(con_usuario, np.nan_to_num(o_usuario).astype('int64') * tablas['n_claves'] + tablas['tramo_clave'][o_tramo], -1)
+    con_descuento = np.zeros(len(o_pedido), bool)
+    porcentaje = np.zeros(len(o_pedido))
+    if len(tablas['desc_clave']):
+        pos = np.minimum(np.searchsorted(tablas['desc_clave'], compuesta), len(tablas['desc_clave']) - 1)
+        con_descuento = con_usuario & (tablas['desc_clave'][pos] == compuesta)
+        porcentaje = np.where(con_descuento, tablas['desc_porcentaje'][pos], 0.0)
+
+    return pd.DataFrame({
+        'pedido': o_pedido,
+        'proveedor': tablas['tramo_proveedor'][o_tramo],
+        'zona': tablas['tramo_zona'][o_tramo],
+        'tipo_tarifa': o_tipo,
+        'precio_envio': _redondear_precios(o_precio * (1 - porcentaje)),
+        'periodicidad': tablas['periodicidades'][tablas['cob_periodicidad'][o_cob]],
+        'descuento_aplicado': np.where(con_descuento, 'Sí', 'No'),
+    })
+
+def cotizar_lote(tablas, df_pedidos):
+    # Agrega a cada pedido sus pesos, m3 y la opción más barata
+    largo, ancho, alto = (df_pedidos[c].to_numpy(dtype=float) for c in ('LARGO_CM', 'ANCHO_CM', 'ALTO_CM'))
+    df = df_pedidos.reset_index(drop=True).copy()
+    df['peso_volumetrico'] = largo * ancho * alto / DIVISOR_VOLUMETRICO
+    df['peso_max'] = np.ceil(np.fmax(df['PESO_KG'].to_numpy(dtype=float), df['peso_volumetrico'].to_numpy()))
+
+    opciones = opciones_lote(tablas, df)
+    mas_baratas = opciones.sort_values(['pedido', 'precio_envio'], kind='stable').drop_duplicates('pedido')
+    mas_baratas = mas_baratas.set_index('pedido').reindex(np.arange(len(df)))
+    for col in COLUMNAS_SALIDA:
+        df[col] = mas_baratas[col].to_numpy()
+    completos = df[COLUMNAS_PRODUCTO].gt(0).all(axis=1)
+    df['estado'] = np.select(
+        [df['precio_envio'].notna(), ~completos], ['ok', 'sin_datos'], default='sin_opciones'
+    )
+    return df
+
+
+# --- COTIZACIÓN EN VARIOS PROCESOS ---
+# Los arreglos de las tablas se publican una sola vez en memoria compartida: cada proceso los adjunta
+# sin copiarlos y solo recibe por pickle los bloques de pedidos y unos pocos valores sueltos.
+
+ALINEACION = 64
+# Bloques en vuelo por proceso: acota la memoria sin dejar procesos esperando
+BLOQUES_POR_PROCESO = 2
+
+_proceso = {}
+
+def publicar_tablas(tablas):
+    """Copia los arreglos numéricos de 'tablas' a un bloque de memoria compartida.
+
+    Devuelve (SharedMemory, descriptor); el descriptor es lo que se envía a cada proceso. El llamador
+    cierra y libera el bloque (close + unlink) al terminar.
+    """
+    arreglos = {k: v for k, v in tablas.items() if isinstance(v, np.ndarray) and v.dtype != object}
+    ubicaciones = {}
+    tamano = 0
+    for nombre, arreglo in arreglos.items():
+        tamano = -(-tamano // ALINEACION) * ALINEACION
+        ubicaciones[nombre] = (arreglo.dtype.str, arreglo.shape, tamano)
+        tamano += arreglo.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(tamano, 1))
+    for nombre, arreglo in arreglos.items():
+        dtype, forma, inicio = ubicaciones[nombre]
+        np.ndarray(forma, dtype, buffer=shm.buf, offset=inicio)[...] = arreglo
+    resto = {k: v for k, v in tablas.items() if k not in arreglos}
+    return shm, {'nombre': shm.name, 'tamano': tamano, 'ubicaciones': ubicaciones, 'resto': resto}
+
+def adjuntar_tablas(descriptor):
+    # Vistas de solo lectura sobre el bloque publicado; el SharedMemory debe seguir vivo mientras se usen
+    shm = shared_memory.SharedMemory(name=descriptor['nombre'])
+    tablas = dict(descriptor['resto'])
+    for nombre, (dtype, forma, inicio) in descriptor['ubicaciones'].items():
+        arreglo = np.ndarray(forma, dtype, buffer=shm.buf, offset=inicio)
+        arreglo.flags.writeable = False
+        tablas[nombre] = arreglo
+    return shm, tablas
+
+def _iniciar_proceso(descriptor, db_path):
+    shm, tablas = adjuntar_tablas(descriptor)
+    _proceso.update(shm=shm, tablas=tablas, conn=sqlite3.connect(db_path))
+
+def _cotizar_bloque(bloque, id_usuario):
+    return cotizar_lote(_proceso['tablas'], preparar_pedidos(_proceso['conn'], bloque, id_usuario))
+
+def cotizar_en_procesos(tablas, bloques, db_path=DB_PATH, id_usuario=None, procesos=None):
+    """Cotiza los bloques en un pool de procesos y entrega los resultados en el orden de entrada.
+
+    Cada proceso abre su propia conexión para completar medidas desde 'productos'.
+    """
+    procesos = procesos or os.cpu_count()
+    shm, descriptor = publicar_tablas(tablas)
+    try:
+        with ProcessPoolExecutor(procesos, initializer=_iniciar_proceso, initargs=(descriptor, db_path)) as pool:
+            pendientes = deque()
+            for bloque in bloques:
+                pendientes.append(pool.submit(_cotizar_bloque, bloque, id_usuario))
+                if len(pendientes) >= procesos * BLOQUES_POR_PROCESO:
+                    yield pendientes.popleft().result()
+            while pendientes:
+                yield pendientes.popleft().result()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+# --- LECTURA Y ESCRITURA POR BLOQUES ---
+
+def leer_por_bloques(ruta, tamano_bloque=TAMANO_BLOQUE):
+    tipos = {'cp': str, 'ID_PRODUCTO': str}
+    if ruta.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for lote in pq.ParquetFile(ruta).iter_batches(batch_size=tamano_bloque):
+            yield lote.to_pandas().astype({c: str for c in tipos if c in lote.schema.names})
+    else:
+        yield from pd.read_csv(ruta, dtype=tipos, chunksize=tamano_bloque)
+
+class EscritorSalida:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.parquet = ruta.endswith('.parquet')
+        self.escritor = None
+        self.primero = True
+
+    def escribir(self, df):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            tabla = pa.Table.from_pandas(df, preserve_index=False)
+            if self.escritor is None:
+                self.escritor = pq.ParquetWriter(self.ruta, tabla.schema)
+            self.escritor.write_table(tabla.cast(self.escritor.schema))
+        else:
+            df.to_csv(self.ruta, mode='w' if self.primero else 'a', header=self.primero, index=False)
+        self.primero = False
+
+    def cerrar(self):
+        if self.escritor is not None:
+            self.escritor.close()
+
+def procesar_archivo(ruta_entrada, ruta_salida, db_path=DB_PATH, id_usuario=None, tamano_bloque=TAMANO_BLOQUE,
+                     procesos=1):
+    verificar_esquema(db_path)
+    conn = sqlite3.connect(db_path)
+    inicio = time.perf_counter()
+    total = 0
+    try:
+        tablas = cargar_tablas(conn)
+        print(f"Tablas de tarifas cargadas en {time.perf_counter() - inicio:.2f} s")
+        bloques = leer_por_bloques(ruta_entrada, tamano_bloque)
+        if procesos == 1:
+            resultados = (cotizar_lote(tablas, preparar_pedidos(conn, bloque, id_usuario)) for bloque in bloques)
+        else:
+            resultados = cotizar_en_procesos(tablas, bloques, db_path, id_usuario, procesos)
+        escritor = EscritorSalida(ruta_salida)
+        try:
+            for df in resultados:
+                escritor.escribir(df)
+                total += len(df)
+                print(f"  {total} pedidos cotizados...")
+        finally:
+            escritor.cerrar()
+    finally:
+        conn.close()
+    duracion = time.perf_counter() - inicio
+    print(f"✅ {total} pedidos cotizados en {duracion:.2f} s ({total / duracion if duracion else 0:.0f} pedidos/s) -> {ruta_salida}")
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Cotiza un archivo de pedidos (CSV o Parquet) por lotes.")
+    parser.add_argument('entrada', help="Archivo de pedidos con columna 'cp' y 'ID_PRODUCTO' o LARGO_CM/ANCHO_CM/ALTO_CM/PESO_KG")
+    parser.add_argument('salida', help="Archivo de resultados (.csv o .parquet)")
+    parser.add_argument('--db', default=DB_PATH, help="Ruta de la base de datos SQLite")
+    parser.add_argument('--usuario', type=int, default=None, help="id_usuario para aplicar descuentos si el archivo no trae la columna")
+    parser.add_argument('--tamano-bloque', type=int, default=TAMANO_BLOQUE)
+    parser.add_argument('--procesos', type=int, default=1, help="Procesos que cotizan en paralelo (0 = todos los núcleos)")
+    args = parser.parse_args()
+    if not os.path.exists(args.entrada):
+        parser.error(f"No existe el archivo de entrada: {args.entrada}")
+    procesar_archivo(args.entrada, args.salida, args.db, args.usuario, args.tamano_bloque, args.procesos or os.cpu_count())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import math
+import os
+import sqlite3
+import time
+from collections import Counter
+
+from benchmark import generar_envios
+from motor_cotizacion import (
+    RateBook, a_numero, calcular_pesos, cobertura_acepta, normalizar_cp, normalizar_proveedor,
+    normalizar_zona, precio_volumetrico,
+)
+
+DB_DIFERENCIAL = 'diferencial.db'
+MAX_EJEMPLOS = 5
+
+# Cada diferencia de comportamiento entre la ruta legada y el motor, en el orden en que se aplican
+CAUSAS = [
+    ('redondeo_peso', "peso_max se redondea al siguiente entero antes de buscar el tramo volumétrico"),
+    ('seleccion_m3', "una sola tarifa m3 entre todos los proveedores, con rango_peso_min <= peso_real"),
+    ('descuentos', "se aplican los descuentos del usuario por (proveedor, zona)"),
+]
+
+
+# --- MODELO DE REFERENCIA ---
+
+def cotizar_referencia(rate_book, envio, redondear_peso=True, m3_global=True, descuentos=True):
+    """Cotiza con las reglas del motor o, desactivando cada regla, con las de la ruta legada.
+
+    Con todo en False reproduce calcular_opciones_envio de streamlit_app.py sobre los mismos datos;
+    con todo en True, RateBook.quote. Activar las reglas una a una permite atribuir cada diferencia.
+    """
+    e = envio
+    peso_vol, peso_max = calcular_pesos(e.largo, e.ancho, e.alto, e.peso_real)
+    peso = peso_max if redondear_peso else max(e.peso_real, peso_vol)
+
+    calculadas = []
+    mejor_m3 = None
+    for cob in rate_book.coberturas.get(normalizar_cp(e.cp), ()):
+        if not cobertura_acepta(cob, e.largo, e.ancho, e.alto, e.peso_real, e.m3):
+            continue
+        tarifas_zona = rate_book.tarifas.get((cob.proveedor, cob.zona))
+        if tarifas_zona is None:
+            continue
+        for tarifa in tarifas_zona.tramos_volumetricos(peso):
+            calculadas.append((cob, 'volumetrico', precio_volumetrico(tarifa, peso)))
+
+        if m3_global:
+            tarifa = tarifas_zona.primer_tramo_m3(e.peso_real, e.m3)
+            if tarifa is not None:
+                clave = (tarifa.rango_peso_min, cob.orden, tarifa.orden)
+                if mejor_m3 is None or clave < mejor_m3[0]:
+                    mejor_m3 = (clave, cob, tarifa)
+        else:
+            # Legado: por cada cobertura, el primer tramo que no excede peso ni m3 (sin mirar el mínimo)
+            for tarifa in tarifas_zona.m3:
+                if not (e.peso_real > tarifa.rango_peso_max or e.m3 > tarifa.m3_amparado):
+                    calculadas.append((cob, 'm3', a_numero(tarifa.precio_base)))
+                    break
+    if mejor_m3 is not None:
+        _, cob, tarifa = mejor_m3
+        calculadas.append((cob, 'm3', a_numero(tarifa.precio_base)))
+
+    descuentos_usuario = rate_book.descuentos.get(e.id_usuario, {}) if descuentos else {}
+    opciones = []
+    for cob, tipo_tarifa, precio in calculadas:
+        clave = (normalizar_proveedor(cob.proveedor), normalizar_zona(cob.zona))
+        opciones.append((*clave, tipo_tarifa, precio * (1 - (descuentos_usuario.get(clave) or 0))))
+    return comparable(opciones)
+
+def comparable(opciones):
+    # Multiconjunto ordenado de (proveedor, zona, tipo_tarifa, precio) sin diferencias de forma:
+    # proveedor normalizado, precio a 2 decimales y sin precios NaN
+    return sorted(
+        (normalizar_proveedor(p), normalizar_zona(z), t, round(float(precio), 2))
+        for p, z, t, precio in opciones
+        if not math.isnan(a_numero(precio))
+    )
+
+def opciones_legado(df):
+    if df is None or df.empty:
+        return []
+    return comparable(df[['proveedor', 'zona', 'tipo_tarifa', 'precio_envio']].itertuples(index=False))
+
+def opciones_motor(opciones):
+    return comparable((o.proveedor, o.zona, o.tipo_tarifa, o.precio_envio) for o in opciones)
+
+
+# --- COMPARACIÓN ---
+
+def clasificar(rate_book, envio, legado, motor):
+    """Causas que explican la diferencia entre legado y motor para un envío.
+
+    'sin_explicar' indica que ninguna de las reglas conocidas la explica (p. ej. datos que las dos
+    rutas leen distinto).
+    """
+    causas = []
+    anterior = cotizar_referencia(rate_book, envio, False, False, False)
+    if anterior != legado:
+        causas.append('sin_explicar')
+    banderas = [False, False, False]
+    for i, (causa, _) in enumerate(CAUSAS):
+        banderas[i] = True
+        actual = cotizar_referencia(rate_book, envio, *banderas)
+        if actual != anterior:
+            causas.append(causa)
+        anterior = actual
+    if anterior != motor and 'sin_explicar' not in causas:
+        causas.append('sin_explicar')
+    return causas
+
+def comparar(db_path, n_envios=1000, semilla=7):
+    from conexion_db import GestorConexiones
+    import streamlit_app
+
+    conn = sqlite3.connect(db_path)
+    try:
+        envios = generar_envios(conn, n_envios, semilla)
+    finally:
+        conn.close()
+
+    inicio = time.perf_counter()
+    rate_book = RateBook.load(db_path)
+    carga_s = time.perf_counter() - inicio
+    gestor = GestorConexiones(db_path)
+
+    tiempo_legado = tiempo_motor = 0.0
+    divergencias = []
+    conteo = Counter()
+    try:
+        for e in envios:
+            cp = normalizar_cp(e.cp)
+            inicio = time.perf_counter()
+            df = streamlit_app.calcular_opciones_envio(cp, e.largo, e.ancho, e.alto, e.peso_real, e.m3, ejecutar=gestor.consultar)
+            tiempo_legado += time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            opciones = rate_book.quote(cp, e.largo, e.ancho, e.alto, e.peso_real, e.id_usuario, m3=e.m3)
+            tiempo_motor += time.perf_counter() - inicio
+
+            legado, motor = opciones_legado(df), opciones_motor(opciones)
+            if legado == motor:
+                continue
+            causas = clasificar(rate_book, e, legado, motor)
+            conteo.update(causas)
+            divergencias.append({
+                'envio': e,
+                'causas': causas,
+                'solo_legado': sorted((Counter(legado) - Counter(motor)).elements()),
+                'solo_motor': sorted((Counter(motor) - Counter(legado)).elements()),
+            })
+    finally:
+        gestor.cerrar()
+
+    return {
+        'envios': len(envios),
+        'divergencias': divergencias,
+        'por_causa': conteo,
+        'carga_motor_s': carga_s,
+        'legado_ms': tiempo_legado / len(envios) * 1000,
+        'motor_ms': tiempo_motor / len(envios) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara la ruta legada (iterrows) con el motor en memoria sobre envíos aleatorios.")
+    parser.add_argument('--db', default=DB_DIFERENCIAL, help="Base de prueba; se genera si no existe")
+    parser.add_argument('--generar', action='store_true', help="Regenera la base de prueba")
+    parser.add_argument('--cps', type=int, default=2_000)
+    parser.add_argument('--envios', type=int, default=1000)
+    parser.add_argument('--semilla', type=int, default=7)
+    parser.add_argument('--ejemplos', type=int, default=MAX_EJEMPLOS, help="Divergencias a mostrar por causa")
+    args = parser.parse_args()
+
+    if args.generar or not os.path.exists(args.db):
+        from generar_datos import generar
+        if os.path.exists(args.db):
+            os.remove(args.db)
+        generar(args.db, n_cps=args.cps)
+
+    r = comparar(args.db, args.envios, args.semilla)
+    print(f"Envíos comparados: {r['envios']}   con diferencias: {len(r['divergencias'])}")
+    descripciones = dict(CAUSAS, sin_explicar="ninguna regla conocida explica la diferencia")
+    for causa, n in r['por_causa'].most_common():
+        print(f"\n{'❌' if causa == 'sin_explicar' else '⚠️'} {causa} ({n} envíos): {descripciones[causa]}")
+        for d in [d for d in r['divergencias'] if causa in d['causas']][:args.ejemplos]:
+            print(f"   {d['envio']}")
+            print(f"      solo legado: {d['solo_legado']}")
+            print(f"      solo motor:  {d['solo_motor']}")
+
+    print(f"\nLegado: {r['legado_ms']:.3f} ms/envío   Motor: {r['motor_ms']:.3f} ms/envío "
+          f"(carga {r['carga_motor_s']:.2f} s)   Aceleración: {r['legado_ms'] / r['motor_ms']:.0f}x")
+    if 'sin_explicar' in r['por_causa']:
+        print("❌ Hay diferencias sin explicar: revisar antes de retirar la ruta legada.")
+    else:
+        print("✅ Todas las diferencias se explican por los cambios de reglas conocidos.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import time
+
+from migraciones import migrar
+from motor_cotizacion import DB_PATH
+
+PERIODICIDADES = ['DIARIA', 'L-M-V', 'MA-J', 'L-V']
+TAMANO_REGION = 100
+LOTE_INSERCION = 10_000
+ANCHO_TRAMO_KG = 5
+
+
+def _hash(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def _insertar(conn, query, filas):
+    lote = []
+    for fila in filas:
+        lote.append(fila)
+        if len(lote) >= LOTE_INSERCION:
+            conn.executemany(query, lote)
+            lote = []
+    if lote:
+        conn.executemany(query, lote)
+
+def _filas_cobertura(r, n_cps, proveedores, n_zonas, cobertura):
+    # Cada proveedor cubre regiones completas de CPs contiguos con los mismos límites,
+    # como llegan los archivos de los transportistas
+    perfiles = {}
+    for i, proveedor in enumerate(proveedores):
+        validacion = ['DIMENSIONES', 'VOLUMEN', None][i % 3]
+        perfiles[proveedor] = (
+            validacion,
+            r.choice([60, 100, 150]), r.choice([60, 80, 100]), r.choice([60, 80, 100]),
+            r.choice([30, 50, 70]), r.choice([0.2, 0.5, 1.0]),
+        )
+    n_regiones = (n_cps + TAMANO_REGION - 1) // TAMANO_REGION
+    regiones = {}
+    for proveedor in proveedores:
+        for region in range(n_regiones):
+            if r.random() < cobertura:
+                regiones[(proveedor, region)] = (str(r.randint(1, n_zonas)), r.choice(PERIODICIDADES))
+
+    for i in range(n_cps):
+        cp = f"{1000 + i:05d}"
+        region = i // TAMANO_REGION
+        for proveedor in proveedores:
+            datos = regiones.get((proveedor, region))
+            if datos is None:
+                continue
+            zona, periodicidad = datos
+            validacion, largo, ancho, alto, peso, volumen = perfiles[proveedor]
+            yield (cp, proveedor, zona, periodicidad, validacion, largo, ancho, alto, peso, volumen)
+
+def _filas_tarifas(r, proveedores, n_zonas, n_tramos):
+    for proveedor in proveedores:
+        for zona in range(1, n_zonas + 1):
+            precio = r.uniform(80, 150)
+            for k in range(n_tramos):
+                # Tramos contiguos con extremos inclusivos (0-5, 5-10, ...); el último cobra kg adicional
+                minimo = k * ANCHO_TRAMO_KG
+                ultimo = k == n_tramos - 1
+                maximo = 999 if ultimo else (k + 1) * ANCHO_TRAMO_KG
+                umbral = minimo + ANCHO_TRAMO_KG if ultimo else None
+                costo = round(r.uniform(5, 15), 2) if ultimo else None
+                yield (proveedor, str(zona), 'volumetrico', minimo, maximo, None, round(precio, 2), umbral, costo)
+                precio += r.uniform(15, 40)
+            precio = r.uniform(100, 200)
+            for k in range(n_tramos):
+                yield (proveedor, str(zona), 'm3', k * ANCHO_TRAMO_KG, (k + 2) * ANCHO_TRAMO_KG,
+                       round(0.05 * (k + 1), 3), round(precio, 2), None, None)
+                precio += r.uniform(20, 50)
+
+def generar(db_path=DB_PATH, n_cps=10_000, n_proveedores=8, n_tramos=10, n_zonas=5, n_usuarios=20,
+            n_productos=10_000, cobertura=0.8, semilla=42):
+    r = random.Random(semilla)
+    proveedores = [f"PROVEEDOR {i}" for i in range(1, n_proveedores + 1)]
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA synchronous=OFF")
+        # Primero las tablas (migraciones 001-002); los índices se crean al final, ya con los datos cargados
+        migrar(conn, hasta=2)
+
+        conn.execute("BEGIN")
+        _insertar(conn, """
+            INSERT INTO cobertura_transportistas (cp, proveedor, zona, periodicidad, validacion_tipo,
+                largo_max_cm, ancho_max_cm, alto_max_cm, peso_max_kg, volumen_max_m3)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, _filas_cobertura(r, n_cps, proveedores, n_zonas, cobertura))
+        _insertar(conn, """
+            INSERT INTO tarifas_envio (proveedor, zona, tipo_tarifa, rango_peso_min, rango_peso_max,
+                m3_amparado, precio_base, umbral_kg_adicional, costo_kg_adicional)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, _filas_tarifas(r, proveedores, n_zonas, n_tramos))
+
+        usuarios = [('testuser', _hash('testpass')), ('admin', _hash('adminpass'))]
+        usuarios += [(f"usuario{i}", _hash(f"clave{i}")) for i in range(3, n_usuarios + 1)]
+        conn.executemany("INSERT OR IGNORE INTO usuarios (nombre_usuario, password_hash) VALUES (?, ?)", usuarios)
+        ids = [fila[0] for fila in conn.execute("SELECT id_usuario FROM usuarios")]
+        descuentos = []
+        for id_usuario in ids:
+            for proveedor in r.sample(proveedores, k=max(1, len(proveedores) // 2)):
+                zona = str(r.randint(1, n_zonas))
+                descuentos.append((id_usuario, proveedor, round(r.choice([0.05, 0.10, 0.15, 0.20, 0.25]), 2), zona))
+        conn.executemany("""
+            INSERT INTO descuentos_usuario (id_usuario, proveedor, descuento_porcentaje, zona)
+            VALUES (?, ?, ?, ?)
+        """, descuentos)
+
+        def productos():
+            for i in range(1, n_productos + 1):
+                largo, ancho, alto = (round(r.uniform(5, 120), 1) for _ in range(3))
+                yield (f"SKU-{i:06d}", largo, ancho, alto, round(r.uniform(0.2, 60), 2), largo * ancho * alto / 1_000_000)
+        _insertar(conn, """
+            INSERT INTO productos (ID_PRODUCTO, LARGO_CM, ANCHO_CM, ALTO_CM, PESO_KG, M3)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, productos())
+        conn.execute("COMMIT")
+
+        migrar(conn)
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera una base de datos sintética compatible con db_envios.db.db.")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--cps', type=int, default=10_000, help="Cantidad de códigos postales")
+    parser.add_argument('--proveedores', type=int, default=8)
+    parser.add_argument('--tramos', type=int, default=10, help="Tramos de peso por (proveedor, zona) y tipo de tarifa")
+    parser.add_argument('--zonas', type=int, default=5)
+    parser.add_argument('--usuarios', type=int, default=20)
+    parser.add_argument('--productos', type=int, default=10_000)
+    parser.add_argument('--cobertura', type=float, default=0.8, help="Probabilidad de que un proveedor cubra una región")
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--sobrescribir', action='store_true')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.sobrescribir:
+            parser.error(f"{args.db} ya existe; usa --sobrescribir para reemplazarlo")
+        os.remove(args.db)
+
+    inicio = time.perf_counter()
+    generar(args.db, args.cps, args.proveedores, args.tramos, args.zonas, args.usuarios,
+            args.productos, args.cobertura, args.semilla)
+    print(f"✅ Base de datos sintética generada en {args.db} ({time.perf_counter() - inicio:.1f} s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+import argparse
+import re
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from migraciones import ASIGNAR_ID_PROVEEDOR, migrar
+from motor_cotizacion import DB_PATH, PROVEEDOR_NORMALIZADO_SQL, normalizar_proveedor
+
+TAMANO_BLOQUE = 50_000
+MAX_ERRORES_REPORTADOS = 20
+
+# Columnas de cada destino: (columna, tipo, obligatoria)
+DESTINOS = {
+    'cobertura': ('cobertura_transportistas', [
+        ('cp', 'cp', True),
+        ('proveedor', 'texto', True),
+        ('zona', 'texto', True),
+        ('periodicidad', 'texto', False),
+        ('validacion_tipo', 'texto', False),
+        ('largo_max_cm', 'real', False),
+        ('ancho_max_cm', 'real', False),
+        ('alto_max_cm', 'real', False),
+        ('peso_max_kg', 'real', False),
+        ('volumen_max_m3', 'real', False),
+    ]),
+    'tarifas': ('tarifas_envio', [
+        ('proveedor', 'texto', True),
+        ('zona', 'texto', True),
+        ('tipo_tarifa', 'texto', True),
+        ('rango_peso_min', 'real', True),
+        ('rango_peso_max', 'real', True),
+        ('m3_amparado', 'real', False),
+        ('precio_base', 'real', True),
+        ('umbral_kg_adicional', 'real', False),
+        ('costo_kg_adicional', 'real', False),
+    ]),
+    'descuentos': ('descuentos_usuario', [
+        ('id_usuario', 'entero', True),
+        ('proveedor', 'texto', True),
+        ('descuento_porcentaje', 'real', True),
+        ('zona', 'texto', False),
+    ]),
+}
+
+
+class ErrorImportacion(Exception):
+    def __init__(self, mensaje, errores=()):
+        super().__init__(mensaje)
+        self.errores = list(errores)
+
+
+# --- VALIDACIÓN POR BLOQUE ---
+
+def _reglas_de_fila(tipo, df):
+    # [(máscara de filas inválidas, mensaje)] propias de cada destino
+    if tipo == 'cobertura':
+        return [(df['validacion_tipo'].notna() & ~df['validacion_tipo'].isin(['DIMENSIONES', 'VOLUMEN']),
+                 "validacion_tipo debe ser DIMENSIONES, VOLUMEN o vacío")]
+    if tipo == 'tarifas':
+        return [
+            (~df['tipo_tarifa'].isin(['volumetrico', 'm3']), "tipo_tarifa debe ser 'volumetrico' o 'm3'"),
+            (df['rango_peso_min'] > df['rango_peso_max'], "rango_peso_min mayor que rango_peso_max"),
+            ((df['tipo_tarifa'] == 'm3') & df['m3_amparado'].isna(), "las tarifas m3 necesitan m3_amparado"),
+            (df['umbral_kg_adicional'].notna() & df['costo_kg_adicional'].isna(),
+             "umbral_kg_adicional sin costo_kg_adicional"),
+        ]
+    return [(df['descuento_porcentaje'] > 1, "descuento_porcentaje debe estar entre 0 y 1")]
+
+def validar_bloque(tipo, bloque, primera_linea):
+    """Convierte tipos y aplica las reglas; devuelve (DataFrame válido, [(línea, mensaje)])."""
+    _, columnas = DESTINOS[tipo]
+    df = pd.DataFrame(index=bloque.index)
+    invalidas = pd.Series('', index=bloque.index)
+
+    def marcar(mascara, mensaje):
+        invalidas[mascara & (invalidas == '')] = mensaje
+
+    for columna, tipo_columna, obligatoria in columnas:
+        crudo = bloque[columna].str.strip() if columna in bloque else pd.Series('', index=bloque.index)
+        vacio = crudo == ''
+        if tipo_columna in ('texto', 'cp'):
+            valores = crudo.where(~vacio, None)
+            if tipo_columna == 'cp':
+                valores = valores.str.zfill(5)
+        else:
+            valores = pd.to_numeric(crudo.where(~vacio), errors='coerce')
+            marcar(~vacio & valores.isna(), f"{columna} no es numérico")
+            marcar(valores < 0, f"{columna} no puede ser negativo")
+            if tipo_columna == 'entero':
+                marcar(valores.notna() & (valores % 1 != 0), f"{columna} debe ser entero")
+        if obligatoria:
+            marcar(vacio, f"falta {columna}")
+        df[columna] = valores
+
+    for mascara, mensaje in _reglas_de_fila(tipo, df):
+        marcar(mascara.fillna(False).astype(bool), mensaje)
+
+    malas = invalidas != ''
+    errores = [(primera_linea + i, mensaje) for i, mensaje in zip(np.flatnonzero(malas.to_numpy()), invalidas[malas])]
+    return df[~malas], errores
+
+def bloques_validados(tipo, ruta, tamano_bloque=TAMANO_BLOQUE, separador=','):
+    """Lee el CSV por bloques y entrega (filas leídas, DataFrame válido, [(línea, mensaje)]) por bloque."""
+    _, especificacion = DESTINOS[tipo]
+    leidas = 0
+    lector = pd.read_csv(ruta, sep=separador, dtype=str, keep_default_na=False, chunksize=tamano_bloque,
+                         encoding='utf-8-sig')
+    for bloque in lector:
+        bloque.columns = [str(c).strip().lower() for c in bloque.columns]
+        faltantes = [c for c, _, obligatoria in especificacion if obligatoria and c not in bloque.columns]
+        if faltantes:
+            raise ErrorImportacion(f"Faltan columnas obligatorias: {', '.join(faltantes)}")
+
+        # Línea 1 es el encabezado
+        validas, errores = validar_bloque(tipo, bloque, leidas + 2)
+        leidas += len(bloque)
+        yield len(bloque), validas, errores
+
+def filas_sql(df):
+    # NaN -> NULL; la afinidad INTEGER de la columna guarda 3.0 como 3
+    df = df.astype(object).where(df.notna(), None)
+    return df.itertuples(index=False, name=None)
+
+
+# --- VALIDACIÓN SOBRE LA TABLA COMPLETA ---
+
+def validaciones_finales(tipo, tabla):
+    if tipo == 'tarifas':
+        # Dos tramos del mismo (proveedor, zona, tipo_tarifa, m3_amparado) no se solapan; sí pueden compartir extremo
+        return [f"""
+            SELECT 'tramo solapado: ' || proveedor || ' / zona ' || zona || ' / ' || tipo_tarifa
+                   || ' [' || rango_peso_min || ', ' || rango_peso_max || ']'
+            FROM (
+                SELECT proveedor, zona, tipo_tarifa, rango_peso_min, rango_peso_max,
+                       MAX(rango_peso_max) OVER (
+                           PARTITION BY id_proveedor, zona, tipo_tarifa, m3_amparado
+                           ORDER BY rango_peso_min, rowid
+                           ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                       ) AS max_anterior
+                FROM {tabla}
+            )
+            WHERE rango_peso_min < max_anterior
+            LIMIT {MAX_ERRORES_REPORTADOS}
+        """]
+    if tipo == 'descuentos':
+        return [f"""
+            SELECT 'id_usuario inexistente: ' || d.id_usuario
+            FROM (SELECT DISTINCT id_usuario FROM {tabla}) AS d
+            LEFT JOIN usuarios AS u ON u.id_usuario = d.id_usuario
+            WHERE u.id_usuario IS NULL
+            LIMIT {MAX_ERRORES_REPORTADOS}
+        """]
+    return []
+
+
+# --- IMPORTACIÓN ---
+
+def _crear_tabla_importacion(conn, tabla, importacion):
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)).fetchone()[0]
+    sql = re.sub(r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?("?)\w+\2', f'CREATE TABLE {importacion}', sql, count=1)
+    conn.execute(f"DROP TABLE IF EXISTS {importacion}")
+    conn.execute(sql)
+
+def _intercambiar(conn, tipo, tabla, importacion, columnas, proveedores_reemplazados):
+    """Reemplaza la tabla por la de importación en una sola transacción; devuelve filas conservadas."""
+    lista = ', '.join(columnas)
+    conservadas = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if proveedores_reemplazados is not None:
+            # Un proveedor se reemplaza con todas sus grafías: la comparación es por nombre normalizado
+            nombres = sorted({normalizar_proveedor(p) for p in proveedores_reemplazados})
+            marcadores = ', '.join('?' * len(nombres))
+            conservadas = conn.execute(f"""
+                INSERT INTO {importacion} ({lista})
+                SELECT {lista} FROM {tabla}
+                WHERE id_proveedor IS NULL
+                   OR id_proveedor NOT IN (SELECT id_proveedor FROM proveedores WHERE nombre IN ({marcadores}))
+                ORDER BY rowid
+            """, nombres).rowcount
+
+        # La tabla de importación no tiene triggers: id_proveedor se asigna aquí
+        conn.execute(f"""
+            INSERT OR IGNORE INTO proveedores (nombre)
+            SELECT DISTINCT {PROVEEDOR_NORMALIZADO_SQL.format('proveedor')} FROM {importacion}
+            WHERE proveedor IS NOT NULL
+            ORDER BY 1
+        """)
+        conn.execute(f"UPDATE {importacion} SET {ASIGNAR_ID_PROVEEDOR.format('proveedor')}")
+
+        errores = [fila[0] for query in validaciones_finales(tipo, importacion) for fila in conn.execute(query)]
+        if errores:
+            raise ErrorImportacion(f"{len(errores)} errores de validación en la tabla importada", errores)
+
+        # Índices y triggers se vuelven a crear con el mismo SQL sobre la tabla nueva
+        dependientes = [fila[0] for fila in conn.execute("""
+            SELECT sql FROM sqlite_master
+            WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL
+            ORDER BY type, name
+        """, (tabla,))]
+        materializada = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cambios_materializacion'"
+        ).fetchone() and tipo in ('cobertura', 'tarifas')
+        if materializada:
+            conn.execute(f"INSERT OR IGNORE INTO cambios_materializacion SELECT DISTINCT proveedor, zona FROM {tabla}")
+
+        conn.execute(f"DROP TABLE {tabla}")
+        conn.execute(f"ALTER TABLE {importacion} RENAME TO {tabla}")
+        for sql in dependientes:
+            conn.execute(sql)
+
+        if materializada:
+            conn.execute(f"INSERT OR IGNORE INTO cambios_materializacion SELECT DISTINCT proveedor, zona FROM {tabla}")
+        # Los triggers de version_datos no vieron las filas nuevas: se avisa a las cachés aquí
+        conn.execute("UPDATE version_datos SET version = version + 1 WHERE tabla = ?", (tabla,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return conservadas
+
+def importar(conn, tipo, ruta, tamano_bloque=TAMANO_BLOQUE, por_proveedor=False, omitir_invalidas=False,
+             separador=','):
+    """Carga un CSV en una tabla de importación por bloques y la intercambia por la tabla destino.
+
+    La conexión debe estar en modo autocommit (isolation_level=None).
+    """
+    tabla, especificacion = DESTINOS[tipo]
+    columnas = [columna for columna, _, _ in especificacion]
+    importacion = f"{tabla}_importacion"
+    migrar(conn)
+
+    inicio = time.perf_counter()
+    _crear_tabla_importacion(conn, tabla, importacion)
+    insertar = f"INSERT INTO {importacion} ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))})"
+
+    leidas = importadas = invalidas = 0
+    errores = []
+    proveedores = set()
+    try:
+        for leidas_bloque, validas, errores_bloque in bloques_validados(tipo, ruta, tamano_bloque, separador):
+            leidas += leidas_bloque
+            invalidas += len(errores_bloque)
+            errores.extend(errores_bloque[:MAX_ERRORES_REPORTADOS - len(errores)])
+            if errores_bloque and not omitir_invalidas:
+                continue
+            if por_proveedor:
+                proveedores.update(validas['proveedor'].unique())
+
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(insertar, filas_sql(validas))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            importadas += len(validas)
+        carga = time.perf_counter() - inicio
+
+        if invalidas and not omitir_invalidas:
+            raise ErrorImportacion(f"{invalidas} filas inválidas; no se modificó {tabla}",
+                                   [f"línea {linea}: {mensaje}" for linea, mensaje in errores])
+        conservadas = _intercambiar(conn, tipo, tabla, importacion, columnas, proveedores if por_proveedor else None)
+    except Exception:
+        conn.execute(f"DROP TABLE IF EXISTS {importacion}")
+        raise
+    conn.execute(f"ANALYZE {tabla}")
+
+    total = time.perf_counter() - inicio
+    return {
+        'tabla': tabla,
+        'filas_leidas': leidas,
+        'filas_importadas': importadas,
+        'filas_invalidas': invalidas,
+        'filas_conservadas': conservadas,
+        'errores': [f"línea {linea}: {mensaje}" for linea, mensaje in errores],
+        'segundos_carga': carga,
+        'segundos': total,
+        'filas_s': leidas / carga if carga else float('inf'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa archivos CSV de cobertura, tarifas o descuentos.")
+    parser.add_argument('tipo', choices=sorted(DESTINOS))
+    parser.add_argument('archivo')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--tamano-bloque', type=int, default=TAMANO_BLOQUE)
+    parser.add_argument('--separador', default=',')
+    parser.add_argument('--por-proveedor', action='store_true',
+                        help="Reemplaza solo los proveedores presentes en el archivo; el resto se conserva")
+    parser.add_argument('--omitir-invalidas', action='store_true', help="Descarta las filas inválidas en vez de abortar")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        r = importar(conn, args.tipo, args.archivo, args.tamano_bloque, args.por_proveedor,
+                     args.omitir_invalidas, args.separador)
+    except ErrorImportacion as e:
+        print(f"❌ {e}")
+        for error in e.errores:
+            print(f"    {error}")
+        raise SystemExit(1)
+    finally:
+        conn.close()
+
+    print(f"✅ {r['tabla']}: {r['filas_importadas']} filas importadas"
+          f" ({r['filas_conservadas']} conservadas, {r['filas_invalidas']} inválidas descartadas)")
+    for error in r['errores']:
+        print(f"    {error}")
+    print(f"⏱️ {r['filas_s']:.0f} filas/s en la carga; {r['segundos']:.1f} s en total con validación e intercambio")
+
+if __name__ == '__main__':
+    main()
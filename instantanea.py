@@ -0,0 +1,402 @@
+import argparse
+import json
+import math
+import mmap
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from array import array
+from collections.abc import Mapping
+
+from motor_cotizacion import (
+    DB_PATH, Cobertura, IndiceRangosCP, RateBook, TablaTarifas, TarifasZona, normalizar_proveedor, normalizar_zona,
+)
+
+MAGIA = b'TARIFAS\x00'
+FORMATO = 1
+ALINEACION = 8
+TABLAS_INSTANTANEA = ('cobertura_transportistas', 'tarifas_envio', 'descuentos_usuario')
+# Tipos de la tabla de valores: el texto se convierte de vuelta con el tipo original de SQLite
+TIPOS_VALOR = (type(None), str, int, float)
+USUARIO_NULO = -2 ** 63
+LIMITES = ('largo_max_cm', 'ancho_max_cm', 'alto_max_cm', 'peso_max_kg', 'volumen_max_m3')
+REPETICIONES_ARRANQUE = 5
+
+
+class ErrorInstantanea(Exception):
+    pass
+
+
+def ruta_instantanea(db_path):
+    return db_path + '.tarifas'
+
+def firma_datos(conn):
+    """Datos que cubre una instantánea: versión del esquema y, por tabla, version_datos y último rowid.
+
+    El rowid distingue una base regenerada, cuyas versiones vuelven a empezar desde 0.
+    """
+    versiones = dict(conn.execute("SELECT tabla, version FROM version_datos"))
+    return {
+        'esquema': conn.execute("PRAGMA user_version").fetchone()[0],
+        'tablas': {
+            tabla: [versiones.get(tabla), conn.execute(f"SELECT MAX(rowid) FROM {tabla}").fetchone()[0]]
+            for tabla in TABLAS_INSTANTANEA
+        },
+    }
+
+
+# --- ESCRITURA ---
+
+class _Valores:
+    # Tabla de valores sueltos (proveedores, zonas, periodicidades...) referenciados por índice
+
+    def __init__(self):
+        self.indices = {}
+        self.valores = []
+
+    def indice(self, valor):
+        if type(valor) not in TIPOS_VALOR:
+            raise ErrorInstantanea(f"Valor no soportado en la instantánea: {valor!r}")
+        clave = (type(valor), valor)
+        i = self.indices.get(clave)
+        if i is None:
+            i = self.indices[clave] = len(self.valores)
+            self.valores.append(valor)
+        return i
+
+    def secciones(self):
+        tipos, inicios, texto = array('B'), array('q', [0]), bytearray()
+        for valor in self.valores:
+            tipos.append(TIPOS_VALOR.index(type(valor)))
+            texto += b'' if valor is None else (valor if isinstance(valor, str) else repr(valor)).encode('utf-8')
+            inicios.append(len(texto))
+        return {'valores_tipo': tipos, 'valores_inicio': inicios, 'valores_texto': texto}
+
+def _numero(valor):
+    return math.nan if valor is None else float(valor)
+
+def serializar(rate_book):
+    """Arreglos de ancho fijo con el contenido de un RateBook: {nombre: array o bytes}."""
+    valores = _Valores()
+    indice = rate_book.coberturas
+    coberturas = {}
+    columnas_cob = {'cob_orden': array('q'), 'cob_proveedor': array('i'), 'cob_zona': array('i'),
+                    'cob_periodicidad': array('i'), 'cob_validacion': array('i')}
+    columnas_cob.update({f"cob_{limite}": array('d') for limite in LIMITES})
+
+    def indice_cobertura(cob):
+        i = coberturas.get(cob.orden)
+        if i is None:
+            i = coberturas[cob.orden] = len(columnas_cob['cob_orden'])
+            columnas_cob['cob_orden'].append(cob.orden)
+            for columna in ('proveedor', 'zona', 'periodicidad'):
+                columnas_cob[f"cob_{columna}"].append(valores.indice(getattr(cob, columna)))
+            columnas_cob['cob_validacion'].append(valores.indice(cob.validacion_tipo))
+            for limite in LIMITES:
+                columnas_cob[f"cob_{limite}"].append(_numero(getattr(cob, limite)))
+        return i
+
+    # Segmentos únicos (varios inicios comparten la misma tupla) como listas de índices de cobertura
+    unicos = {}
+    seg_inicio, seg_cob, rango_segmento = array('q', [0]), array('i'), array('i')
+    for segmento in indice.segmentos:
+        j = unicos.get(id(segmento))
+        if j is None:
+            j = unicos[id(segmento)] = len(seg_inicio) - 1
+            seg_cob.extend(indice_cobertura(cob) for cob in segmento)
+            seg_inicio.append(len(seg_cob))
+        rango_segmento.append(j)
+    exa_cp, exa_inicio, exa_cob = array('i'), array('q', [0]), array('i')
+    for cp, cobs in indice.exactos.items():
+        exa_cp.append(valores.indice(cp))
+        exa_cob.extend(indice_cobertura(cob) for cob in cobs)
+        exa_inicio.append(len(exa_cob))
+
+    secciones = {
+        'rango_inicio': array('q', indice.inicios), 'rango_segmento': rango_segmento,
+        'seg_inicio': seg_inicio, 'seg_cob': seg_cob,
+        'exa_cp': exa_cp, 'exa_inicio': exa_inicio, 'exa_cob': exa_cob,
+        **columnas_cob,
+    }
+
+    # Todas las TarifasZona comparten una TablaTarifas: se copian sus columnas tal cual
+    zonas = list(rate_book.tarifas.items())
+    tabla = zonas[0][1].tabla if zonas else TablaTarifas()
+    secciones.update({f"tarifa_{columna}": getattr(tabla, columna) for columna in TablaTarifas.__slots__})
+    secciones['tz_proveedor'] = array('i', (valores.indice(proveedor) for (proveedor, _), _ in zonas))
+    secciones['tz_zona'] = array('i', (valores.indice(zona) for (_, zona), _ in zonas))
+    for columna in ('codigo', 'vol_ini', 'vol_fin', 'm3_fin'):
+        secciones[f"tz_{columna}"] = array('q', (getattr(tz, columna) for _, tz in zonas))
+
+    # Descuentos agrupados por usuario
+    desc_usuario, desc_inicio = array('q'), array('q', [0])
+    desc_proveedor, desc_zona, desc_porcentaje = array('i'), array('i'), array('d')
+    for id_usuario, por_clave in rate_book.descuentos.items():
+        desc_usuario.append(USUARIO_NULO if id_usuario is None else id_usuario)
+        for (proveedor, zona), porcentaje in por_clave.items():
+            desc_proveedor.append(valores.indice(proveedor))
+            desc_zona.append(valores.indice(zona))
+            desc_porcentaje.append(_numero(porcentaje))
+        desc_inicio.append(len(desc_porcentaje))
+    secciones.update({'desc_usuario': desc_usuario, 'desc_inicio': desc_inicio, 'desc_proveedor': desc_proveedor,
+                      'desc_zona': desc_zona, 'desc_porcentaje': desc_porcentaje})
+    secciones.update(valores.secciones())
+    return secciones, {'n_rangos': indice.n_rangos}
+
+def _alinear(n):
+    return -(-n // ALINEACION) * ALINEACION
+
+def escribir(ruta, firma, secciones, metadatos):
+    """Cabecera JSON (formato, firma y directorio de secciones) seguida de los arreglos alineados.
+
+    Se escribe en un archivo temporal y se reemplaza al final: quien ya tenga la anterior mapeada la sigue leyendo.
+    """
+    directorio = {}
+    desplazamiento = 0
+    for nombre, datos in secciones.items():
+        tipo = datos.typecode if isinstance(datos, array) else 'B'
+        tamano = len(datos) * (datos.itemsize if isinstance(datos, array) else 1)
+        directorio[nombre] = [tipo, desplazamiento, tamano]
+        desplazamiento = _alinear(desplazamiento + tamano)
+    cabecera = json.dumps({'formato': FORMATO, 'firma': firma, 'creada': time.time(), **metadatos,
+                           'secciones': directorio}).encode('utf-8')
+    inicio_datos = _alinear(len(MAGIA) + 4 + len(cabecera))
+
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    try:
+        with open(temporal, 'wb') as f:
+            f.write(MAGIA + len(cabecera).to_bytes(4, 'little') + cabecera)
+            for nombre, datos in secciones.items():
+                f.seek(inicio_datos + directorio[nombre][1])
+                f.write(datos.tobytes() if isinstance(datos, array) else bytes(datos))
+            f.truncate(inicio_datos + desplazamiento)
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return inicio_datos + desplazamiento
+
+def exportar(conn, ruta):
+    """Escribe la instantánea de cobertura, tarifas y descuentos. La conexión debe estar en autocommit."""
+    # Firma y datos en la misma transacción de lectura
+    conn.execute("BEGIN")
+    try:
+        firma = firma_datos(conn)
+        rate_book = RateBook.from_connection(conn)
+    finally:
+        conn.execute("COMMIT")
+    secciones, metadatos = serializar(rate_book)
+    return {'bytes': escribir(ruta, firma, secciones, metadatos), 'firma': firma}
+
+
+# --- LECTURA ---
+
+class _Segmentos:
+    # Tuplas de coberturas por segmento de CP, construidas al primer uso y compartidas entre segmentos iguales
+
+    __slots__ = ('indices', 'inicio', 'cobs', 'coberturas', 'hechos')
+
+    def __init__(self, indices, inicio, cobs, coberturas):
+        self.indices, self.inicio, self.cobs, self.coberturas = indices, inicio, cobs, coberturas
+        self.hechos = {}
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        j = self.indices[i]
+        segmento = self.hechos.get(j)
+        if segmento is None:
+            segmento = tuple(self.coberturas[k] for k in self.cobs[self.inicio[j]:self.inicio[j + 1]])
+            self.hechos[j] = segmento
+        return segmento
+
+class _Descuentos(Mapping):
+    # {id_usuario: {(proveedor, zona): porcentaje}}; el dict de cada usuario se arma al primer uso
+
+    def __init__(self, s, valores, claves):
+        self.s, self.valores, self.claves = s, valores, claves
+        self.posiciones = {None if u == USUARIO_NULO else u: j for j, u in enumerate(s['desc_usuario'])}
+        self.hechos = {}
+
+    def __len__(self):
+        return len(self.posiciones)
+
+    def __iter__(self):
+        return iter(self.posiciones)
+
+    def __getitem__(self, id_usuario):
+        j = self.posiciones[id_usuario]
+        por_clave = self.hechos.get(j)
+        if por_clave is None:
+            s, valores = self.s, self.valores
+            por_clave = {}
+            for k in range(s['desc_inicio'][j], s['desc_inicio'][j + 1]):
+                clave = (valores[s['desc_proveedor'][k]], valores[s['desc_zona'][k]])
+                porcentaje = s['desc_porcentaje'][k]
+                por_clave[self.claves.get(clave, clave)] = None if math.isnan(porcentaje) else porcentaje
+            self.hechos[j] = por_clave
+        return por_clave
+
+class Instantanea:
+    """Instantánea abierta con mmap: los arreglos son vistas de solo lectura sobre el archivo, sin copias."""
+
+    def __init__(self, ruta):
+        with open(ruta, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:
+                raise ErrorInstantanea(f"{ruta} está vacío") from e
+        vista = memoryview(self._mmap)
+        try:
+            if bytes(vista[:len(MAGIA)]) != MAGIA:
+                raise ErrorInstantanea(f"{ruta} no es una instantánea de tarifas")
+            largo = int.from_bytes(vista[len(MAGIA):len(MAGIA) + 4], 'little')
+            cabecera = json.loads(bytes(vista[len(MAGIA) + 4:len(MAGIA) + 4 + largo]))
+            if cabecera.get('formato') != FORMATO:
+                raise ErrorInstantanea(f"{ruta} tiene el formato {cabecera.get('formato')}; se espera {FORMATO}")
+            inicio_datos = _alinear(len(MAGIA) + 4 + largo)
+            if any(inicio_datos + desde + tamano > len(vista) for _, desde, tamano in cabecera['secciones'].values()):
+                raise ErrorInstantanea(f"{ruta} está incompleta")
+            self.secciones = {
+                nombre: vista[inicio_datos + desde:inicio_datos + desde + tamano].cast(tipo)
+                for nombre, (tipo, desde, tamano) in cabecera['secciones'].items()
+            }
+        except (ValueError, KeyError, TypeError) as e:
+            raise ErrorInstantanea(f"{ruta} está dañada: {e}") from e
+        self.firma = cabecera['firma']
+        self.n_rangos = cabecera['n_rangos']
+        self.creada = cabecera['creada']
+
+    def _valores(self):
+        s = self.secciones
+        texto = s['valores_texto'].tobytes()
+        inicios = s['valores_inicio']
+        valores = []
+        for i, tipo in enumerate(s['valores_tipo']):
+            crudo = texto[inicios[i]:inicios[i + 1]].decode('utf-8')
+            valores.append(None if tipo == 0 else TIPOS_VALOR[tipo](crudo))
+        return valores
+
+    def rate_book(self):
+        s = self.secciones
+        valores = self._valores()
+
+        limites = [s[f"cob_{limite}"] for limite in LIMITES]
+        coberturas = [
+            Cobertura(orden, valores[s['cob_proveedor'][i]], valores[s['cob_zona'][i]],
+                      valores[s['cob_periodicidad'][i]], valores[s['cob_validacion'][i]],
+                      *(None if math.isnan(columna[i]) else columna[i] for columna in limites))
+            for i, orden in enumerate(s['cob_orden'])
+        ]
+        exactos = {
+            valores[cp]: tuple(coberturas[k] for k in s['exa_cob'][s['exa_inicio'][j]:s['exa_inicio'][j + 1]])
+            for j, cp in enumerate(s['exa_cp'])
+        }
+        segmentos = _Segmentos(s['rango_segmento'], s['seg_inicio'], s['seg_cob'], coberturas)
+        indice = IndiceRangosCP.construido(s['rango_inicio'], segmentos, exactos, self.n_rangos)
+
+        tabla = TablaTarifas.construida({columna: s[f"tarifa_{columna}"] for columna in TablaTarifas.__slots__})
+        claves = {}
+        tarifas = {}
+        for j in range(len(s['tz_codigo'])):
+            proveedor, zona = valores[s['tz_proveedor'][j]], valores[s['tz_zona'][j]]
+            clave = (normalizar_proveedor(proveedor), normalizar_zona(zona))
+            clave = claves.setdefault(clave, clave)
+            tarifas[(proveedor, zona)] = TarifasZona(tabla, s['tz_codigo'][j], clave, s['tz_vol_ini'][j],
+                                                     s['tz_vol_fin'][j], s['tz_m3_fin'][j])
+        return RateBook.construido(indice, tarifas, _Descuentos(s, valores, claves))
+
+def cargar_instantanea(conn, ruta):
+    """RateBook desde la instantánea si existe y corresponde a los datos actuales de conn; si no, None."""
+    if not ruta or not os.path.exists(ruta):
+        return None
+    try:
+        instantanea = Instantanea(ruta)
+    except ErrorInstantanea:
+        return None
+    if instantanea.firma != firma_datos(conn):
+        return None
+    return instantanea.rate_book()
+
+
+# --- TIEMPO HASTA LA PRIMERA COTIZACIÓN ---
+
+def _primera_cotizacion(db_path, ruta, modo, cp):
+    # Corre en un proceso nuevo: carga (instantánea o SQLite) y una cotización
+    inicio = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    try:
+        rate_book = cargar_instantanea(conn, ruta) if modo == 'instantanea' else RateBook.from_connection(conn)
+    finally:
+        conn.close()
+    if rate_book is None:
+        raise SystemExit("La instantánea no existe o está desactualizada")
+    carga = time.perf_counter()
+    rate_book.quote(cp, 30, 20, 10, 2.5)
+    fin = time.perf_counter()
+    print(json.dumps({'carga_s': carga - inicio, 'cotizacion_s': fin - carga}))
+
+def medir_arranque(db_path, ruta, repeticiones=REPETICIONES_ARRANQUE):
+    """Mediana por modo del tiempo hasta la primera cotización en procesos nuevos.
+
+    'proceso_s' incluye arrancar el intérprete e importar los módulos.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        cp = conn.execute("SELECT cp FROM cobertura_transportistas LIMIT 1").fetchone()[0]
+    finally:
+        conn.close()
+    resultados = {}
+    for modo in ('sqlite', 'instantanea'):
+        muestras = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            salida = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--db', db_path, '--salida', ruta,
+                 '--primera-cotizacion', modo, '--cp', str(cp)],
+                capture_output=True, text=True, check=True,
+            )
+            muestra = json.loads(salida.stdout)
+            muestra['proceso_s'] = time.perf_counter() - inicio
+            muestras.append(muestra)
+        resultados[modo] = {campo: statistics.median(m[campo] for m in muestras) for campo in muestras[0]}
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta cobertura, tarifas y descuentos a una instantánea binaria para arrancar sin leer SQLite.")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--salida', default=None, help="Ruta de la instantánea (por defecto, la base + '.tarifas')")
+    parser.add_argument('--medir', action='store_true', help="Compara el tiempo hasta la primera cotización con y sin instantánea")
+    parser.add_argument('--repeticiones', type=int, default=REPETICIONES_ARRANQUE)
+    parser.add_argument('--primera-cotizacion', choices=('sqlite', 'instantanea'), help=argparse.SUPPRESS)
+    parser.add_argument('--cp', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    ruta = args.salida or ruta_instantanea(args.db)
+
+    if args.primera_cotizacion:
+        _primera_cotizacion(args.db, ruta, args.primera_cotizacion, args.cp)
+        return
+
+    from migraciones import verificar_esquema
+    verificar_esquema(args.db)
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        inicio = time.perf_counter()
+        r = exportar(conn, ruta)
+    finally:
+        conn.close()
+    print(f"✅ Instantánea escrita en {ruta}: {r['bytes'] / 1024:,.0f} KB en {time.perf_counter() - inicio:.2f} s")
+
+    if args.medir:
+        resultados = medir_arranque(args.db, ruta, args.repeticiones)
+        print(f"{'origen':<13}{'proceso (s)':>13}{'carga (ms)':>12}{'1ª cotiz. (ms)':>16}")
+        for modo, r in resultados.items():
+            print(f"{modo:<13}{r['proceso_s']:>13.3f}{r['carga_s'] * 1000:>12.1f}{r['cotizacion_s'] * 1000:>16.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+import argparse
+import json
+import math
+import sqlite3
+import time
+from collections import namedtuple
+
+from motor_cotizacion import (
+    DB_PATH, PROVEEDOR_NORMALIZADO_SQL, Cobertura, OpcionEnvio, Tarifa, a_numero, calcular_m3, calcular_pesos,
+    cobertura_acepta, construir_tarifas, normalizar_cp, normalizar_zona, precio_volumetrico,
+)
+
+# Dominio materializado: peso_max enteros 1..PESO_MAX_KG y m3 en TRAMOS_M3 tramos de PASO_M3.
+# Fuera del dominio la cotización vuelve al motor en memoria o a SQL.
+PESO_MAX_KG = 30
+PASO_M3 = 0.05
+TRAMOS_M3 = 10
+
+Parametros = namedtuple('Parametros', ['peso_max_kg', 'paso_m3', 'tramos_m3'])
+
+# Límites de una cobertura según su tipo de validación; las filas materializadas se agrupan por perfil
+Perfil = namedtuple('Perfil', [
+    'validacion_tipo', 'largo_max_cm', 'ancho_max_cm', 'alto_max_cm', 'peso_max_kg', 'volumen_max_m3'
+])
+
+_INSERTAR_OPCION = """
+INSERT INTO opciones_materializadas (
+    cp, peso_max, m3_tramo, rango_peso_min, orden_cobertura, orden_tarifa, perfil, precio, id_proveedor,
+    nombre, proveedor, zona, tipo_tarifa, periodicidad, rango_peso_max, m3_amparado
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_COLUMNAS_OPCION = """o.nombre, o.zona, o.tipo_tarifa, o.precio, o.periodicidad,
+           (SELECT d.descuento_porcentaje FROM descuentos_usuario AS d
+            WHERE d.id_usuario = :id_usuario AND d.id_proveedor = o.id_proveedor
+              AND CAST(d.zona AS TEXT) = CAST(o.zona AS TEXT)
+            ORDER BY d.rowid LIMIT 1),
+           o.orden_cobertura, o.rango_peso_min, o.orden_tarifa"""
+
+# Una sola sentencia (una sola lectura consistente): la primera fila es el estado de la tabla
+# (generación en 'precio', cambios pendientes en 'descuento'), después las opciones volumétricas del
+# peso_max y la primera tarifa m3 del tramo, solo de los perfiles que aceptan el paquete y con el
+# descuento del usuario (gana la primera fila, como en RateBook).
+CONSULTA_OPCIONES = f"""
+SELECT 0, NULL, NULL, NULL,
+       (SELECT valor FROM parametros_materializacion WHERE clave = 'generacion'),
+       NULL,
+       EXISTS (SELECT 1 FROM cambios_materializacion),
+       NULL, NULL, NULL
+UNION ALL
+SELECT 1, {_COLUMNAS_OPCION}
+FROM opciones_materializadas AS o
+WHERE o.cp = :cp AND o.peso_max = :peso_max AND o.m3_tramo = 0
+  AND o.perfil IN (SELECT value FROM json_each(:perfiles))
+UNION ALL
+SELECT * FROM (
+    SELECT 2, {_COLUMNAS_OPCION}
+    FROM opciones_materializadas AS o
+    WHERE o.cp = :cp AND o.peso_max = 0 AND o.m3_tramo = :m3_tramo
+      AND o.perfil IN (SELECT value FROM json_each(:perfiles))
+      AND o.rango_peso_min <= :peso_real AND o.rango_peso_max >= :peso_real AND o.m3_amparado >= :m3
+    ORDER BY o.rango_peso_min, o.orden_cobertura, o.orden_tarifa
+    LIMIT 1
+)
+ORDER BY 1, 8, 9, 10
+"""
+
+
+def tramo_m3(m3, paso_m3):
+    # Tramo b cubre [paso * (b - 1), paso * b); se corrige el redondeo para que el piso nunca supere m3
+    tramo = int(m3 // paso_m3) + 1
+    while tramo > 1 and (tramo - 1) * paso_m3 > m3:
+        tramo -= 1
+    return tramo
+
+def perfil_cobertura(cob):
+    # Solo cuentan los límites que revisa su tipo de validación; None si la cobertura nunca acepta
+    if cob.validacion_tipo in (None, 'DIMENSIONES'):
+        return Perfil(cob.validacion_tipo, cob.largo_max_cm, cob.ancho_max_cm, cob.alto_max_cm, cob.peso_max_kg, None)
+    if cob.validacion_tipo == 'VOLUMEN':
+        return Perfil(cob.validacion_tipo, None, None, None, cob.peso_max_kg, cob.volumen_max_m3)
+    return None
+
+def leer_parametros(conn):
+    valores = dict(conn.execute("SELECT clave, valor FROM parametros_materializacion"))
+    if not valores:
+        return None
+    return Parametros(int(valores['peso_max_kg']), valores['paso_m3'], int(valores['tramos_m3']))
+
+def leer_perfiles(conn):
+    return {Perfil(*fila[1:]): fila[0] for fila in conn.execute("""
+        SELECT perfil, validacion_tipo, largo_max_cm, ancho_max_cm, alto_max_cm, peso_max_kg, volumen_max_m3
+        FROM perfiles_materializacion
+    """)}
+
+def tramos_pendientes(conn):
+    # Un cambio de tarifas alcanza a toda la cobertura con el mismo id_proveedor, aunque el nombre se escriba distinto
+    return conn.execute(f"""
+        SELECT proveedor, zona FROM cambios_materializacion
+        UNION
+        SELECT c.proveedor, c.zona
+        FROM cambios_materializacion AS m
+        JOIN proveedores AS p ON p.nombre = {PROVEEDOR_NORMALIZADO_SQL.format('m.proveedor')}
+        JOIN cobertura_transportistas AS c ON c.id_proveedor = p.id_proveedor AND c.zona = m.zona
+    """).fetchall()
+
+
+# --- CÁLCULO DE UN (PROVEEDOR, ZONA) ---
+
+def _filas_tramo(coberturas, tarifas_zona, parametros, perfil_de):
+    # Filas con el precio final sin descuento; la cobertura solo aporta su perfil
+    volumetricas = []
+    for peso in range(1, parametros.peso_max_kg + 1):
+        for tarifa in tarifas_zona.tramos_volumetricos(peso):
+            precio = precio_volumetrico(tarifa, peso)
+            # Una tarifa volumétrica sin precio se descarta siempre; no hace falta guardarla
+            if not math.isnan(precio):
+                volumetricas.append((peso, tarifa, precio))
+
+    for cp, cob, id_proveedor, nombre in coberturas:
+        perfil = perfil_cobertura(cob)
+        if perfil is None:
+            continue
+        id_perfil = perfil_de(perfil)
+        comunes = (id_perfil, id_proveedor, nombre, cob.proveedor, cob.zona)
+        for peso, t, precio in volumetricas:
+            yield (cp, peso, 0, t.rango_peso_min, cob.orden, t.orden, *comunes[:1], precio, *comunes[1:],
+                   'volumetrico', cob.periodicidad, t.rango_peso_max, t.m3_amparado)
+
+        # Las tarifas m3 sin precio sí se guardan: pueden ganar la selección de la primera tarifa m3
+        for tramo in range(1, parametros.tramos_m3 + 1):
+            piso = (tramo - 1) * parametros.paso_m3
+            if cob.validacion_tipo == 'VOLUMEN' and not (cob.volumen_max_m3 is not None and cob.volumen_max_m3 >= piso):
+                break
+            for t in tarifas_zona.m3:
+                if t.m3_amparado >= piso:
+                    precio = None if math.isnan(a_numero(t.precio_base)) else a_numero(t.precio_base)
+                    yield (cp, 0, tramo, t.rango_peso_min, cob.orden, t.orden, *comunes[:1], precio, *comunes[1:],
+                           'm3', cob.periodicidad, t.rango_peso_max, t.m3_amparado)
+
+def _cargar_coberturas(conn, tramos):
+    coberturas = {tramo: [] for tramo in tramos}
+    for fila in conn.execute("""
+        SELECT c.rowid, c.cp, c.proveedor, c.zona, c.periodicidad, c.validacion_tipo,
+               c.largo_max_cm, c.ancho_max_cm, c.alto_max_cm, c.peso_max_kg, c.volumen_max_m3,
+               c.id_proveedor, p.nombre
+        FROM cobertura_transportistas AS c
+        LEFT JOIN proveedores AS p ON p.id_proveedor = c.id_proveedor
+    """):
+        filas = coberturas.get((fila[2], fila[3]))
+        if filas is not None and fila[12] is not None:
+            filas.append((normalizar_cp(fila[1]), Cobertura(fila[0], *fila[2:11]), fila[11], fila[12]))
+    return coberturas
+
+def _cargar_tarifas(conn, proveedor, zona):
+    tipos = {'volumetrico': [], 'm3': []}
+    for fila in conn.execute(f"""
+        SELECT rowid, tipo_tarifa, rango_peso_min, rango_peso_max,
+               m3_amparado, precio_base, umbral_kg_adicional, costo_kg_adicional
+        FROM tarifas_envio
+        WHERE id_proveedor = (SELECT id_proveedor FROM proveedores WHERE nombre = {PROVEEDOR_NORMALIZADO_SQL.format('?')})
+          AND zona = ?
+    """, (proveedor, zona)):
+        if fila[1] in tipos:
+            tipos[fila[1]].append(Tarifa(fila[0], a_numero(fila[2]), a_numero(fila[3]), a_numero(fila[4]), *fila[5:]))
+    return construir_tarifas({(proveedor, zona): tipos})[(proveedor, zona)]
+
+
+# --- REFRESCO ---
+
+def refrescar(conn, completo=False, parametros=None):
+    """Recalcula las opciones de los (proveedor, zona) con cambios pendientes, o de todos si completo.
+
+    La conexión debe estar en modo autocommit (isolation_level=None); todo el refresco es una transacción.
+    Cada refresco incrementa la generación con la que las cotizaciones detectan perfiles nuevos.
+    """
+    actuales = leer_parametros(conn)
+    parametros = parametros or actuales or Parametros(PESO_MAX_KG, PASO_M3, TRAMOS_M3)
+    # Cambiar el dominio invalida todas las filas
+    completo = completo or parametros != actuales
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        generacion = conn.execute(
+            "SELECT valor FROM parametros_materializacion WHERE clave = 'generacion'").fetchone()
+        generacion = int(generacion[0]) + 1 if generacion else 1
+        if completo:
+            conn.execute("DELETE FROM opciones_materializadas")
+            conn.execute("DELETE FROM perfiles_materializacion")
+            conn.execute("DELETE FROM cambios_materializacion")
+            conn.execute("DELETE FROM parametros_materializacion")
+            conn.executemany("INSERT INTO parametros_materializacion (clave, valor) VALUES (?, ?)",
+                             parametros._asdict().items())
+            tramos = conn.execute("SELECT DISTINCT proveedor, zona FROM cobertura_transportistas").fetchall()
+        else:
+            tramos = tramos_pendientes(conn)
+
+        # Los perfiles existentes conservan su número: solo se agregan los nuevos
+        perfiles = leer_perfiles(conn)
+        nuevos = []
+
+        def perfil_de(perfil):
+            numero = perfiles.get(perfil)
+            if numero is None:
+                numero = perfiles[perfil] = len(perfiles) + 1
+                nuevos.append((numero, *perfil))
+            return numero
+
+        filas = 0
+        coberturas = _cargar_coberturas(conn, tramos) if tramos else {}
+        for proveedor, zona in tramos:
+            conn.execute("DELETE FROM opciones_materializadas WHERE proveedor = ? AND zona = ?", (proveedor, zona))
+            conn.execute("DELETE FROM cambios_materializacion WHERE proveedor IS ? AND zona IS ?", (proveedor, zona))
+            if proveedor is None or zona is None or not coberturas[(proveedor, zona)]:
+                continue
+            tarifas_zona = _cargar_tarifas(conn, proveedor, zona)
+            cursor = conn.executemany(_INSERTAR_OPCION, _filas_tramo(coberturas[(proveedor, zona)], tarifas_zona,
+                                                                     parametros, perfil_de))
+            filas += cursor.rowcount
+        conn.executemany("""
+            INSERT INTO perfiles_materializacion (perfil, validacion_tipo, largo_max_cm, ancho_max_cm, alto_max_cm,
+                                                  peso_max_kg, volumen_max_m3)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, nuevos)
+        conn.execute("INSERT OR REPLACE INTO parametros_materializacion (clave, valor) VALUES ('generacion', ?)",
+                     (generacion,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if completo:
+        conn.execute("ANALYZE opciones_materializadas")
+    return {'completo': completo, 'tramos': len(tramos), 'filas': filas, 'perfiles': len(perfiles)}
+
+
+# --- LECTURA ---
+
+class ContextoMaterializacion:
+    """Parámetros y perfiles de la generación materializada vigente, compartidos entre cotizaciones.
+
+    Se recargan solo cuando la consulta de opciones informa otra generación (después de un refresco).
+    """
+
+    def __init__(self):
+        self._estado = (None, None, ())
+
+    def cargar(self, conn):
+        # Primero la generación: si un refresco se cuela antes de leer los perfiles, la siguiente
+        # consulta informa una generación distinta y se vuelve a cargar
+        valores = dict(conn.execute("SELECT clave, valor FROM parametros_materializacion"))
+        perfiles = tuple((numero, perfil) for perfil, numero in leer_perfiles(conn).items())
+        parametros = (Parametros(int(valores['peso_max_kg']), valores['paso_m3'], int(valores['tramos_m3']))
+                      if 'peso_max_kg' in valores else None)
+        self._estado = (valores.get('generacion'), parametros, perfiles)
+
+    @property
+    def generacion(self):
+        return self._estado[0]
+
+    @property
+    def parametros(self):
+        return self._estado[1]
+
+    def encaje(self, largo, ancho, alto, peso_real, m3):
+        # Clase de encaje del paquete: números de los perfiles que lo aceptan, sin mirar la cobertura del CP
+        return [numero for numero, perfil in self._estado[2] if cobertura_acepta(perfil, largo, ancho, alto, peso_real, m3)]
+
+def cotizar_materializado(conn, cp, largo, ancho, alto, peso_real, user_id=None, m3=None, contexto=None):
+    """Mismo contrato que RateBook.quote, con una lectura de opciones_materializadas.
+
+    Devuelve None si el envío cae fuera del dominio materializado, si la tabla no se refrescó nunca o si
+    hay cambios de cobertura o tarifas sin refrescar: en esos casos hay que cotizar con otro motor.
+    """
+    if m3 is None:
+        m3 = calcular_m3(largo, ancho, alto)
+    _, peso_max = calcular_pesos(largo, ancho, alto, peso_real)
+    if contexto is None:
+        contexto = ContextoMaterializacion()
+        contexto.cargar(conn)
+
+    for _ in range(2):
+        parametros = contexto.parametros
+        if parametros is None or not 1 <= peso_max <= parametros.peso_max_kg or not m3 >= 0:
+            return None
+        tramo = tramo_m3(m3, parametros.paso_m3)
+        if tramo > parametros.tramos_m3:
+            return None
+        filas = conn.execute(CONSULTA_OPCIONES, {
+            'cp': normalizar_cp(cp), 'peso_max': peso_max, 'm3_tramo': tramo, 'peso_real': peso_real, 'm3': m3,
+            'perfiles': json.dumps(contexto.encaje(largo, ancho, alto, peso_real, m3)), 'id_usuario': user_id,
+        }).fetchall()
+        _, _, _, _, generacion, _, pendientes, *_ = filas[0]
+        if pendientes:
+            return None
+        if generacion == contexto.generacion:
+            break
+        contexto.cargar(conn)
+    else:
+        return None
+
+    opciones = []
+    # Las filas llegan en el orden previo de RateBook.quote, así el ordenamiento estable por precio coincide
+    for _, nombre, zona, tipo_tarifa, precio, periodicidad, descuento, *_ in filas[1:]:
+        if precio is None:
+            continue
+        opciones.append(OpcionEnvio(
+            nombre, normalizar_zona(zona), tipo_tarifa, round(precio * (1 - (descuento or 0)), 2), periodicidad,
+            'Sí' if descuento is not None else 'No',
+        ))
+    opciones.sort(key=lambda o: o.precio_envio)
+    return opciones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresca la tabla de opciones materializadas.")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--completo', action='store_true', help="Recalcula todos los (proveedor, zona)")
+    parser.add_argument('--peso-max', type=int, help=f"Mayor peso_max materializado (por defecto {PESO_MAX_KG})")
+    parser.add_argument('--paso-m3', type=float, help=f"Ancho de cada tramo de m3 (por defecto {PASO_M3})")
+    parser.add_argument('--tramos-m3', type=int, help=f"Número de tramos de m3 (por defecto {TRAMOS_M3})")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        actuales = leer_parametros(conn) or Parametros(PESO_MAX_KG, PASO_M3, TRAMOS_M3)
+        parametros = Parametros(
+            args.peso_max or actuales.peso_max_kg,
+            args.paso_m3 or actuales.paso_m3,
+            args.tramos_m3 or actuales.tramos_m3,
+        )
+        inicio = time.perf_counter()
+        resultado = refrescar(conn, args.completo, parametros)
+        duracion = time.perf_counter() - inicio
+    finally:
+        conn.close()
+    tipo = "completo" if resultado['completo'] else "incremental"
+    print(f"✅ Refresco {tipo}: {resultado['tramos']} (proveedor, zona), {resultado['filas']} filas, "
+          f"{resultado['perfiles']} perfiles en {duracion:.1f} s")
+
+if __name__ == '__main__':
+    main()
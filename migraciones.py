@@ -0,0 +1,553 @@
+import argparse
+import os
+import sqlite3
+
+from motor_cotizacion import DB_PATH, PROVEEDOR_NORMALIZADO_SQL
+
+# --- MIGRACIONES ---
+# Cada migración se aplica una sola vez; la versión aplicada se guarda en PRAGMA user_version.
+
+def _columnas(conn, tabla):
+    return {fila[1] for fila in conn.execute(f"PRAGMA table_info({tabla})")}
+
+def m001_esquema_base(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS productos (
+            ID_PRODUCTO TEXT,
+            LARGO_CM REAL,
+            ANCHO_CM REAL,
+            ALTO_CM REAL,
+            PESO_KG REAL,
+            M3 REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cobertura_transportistas (
+            cp TEXT,
+            proveedor TEXT,
+            zona TEXT,
+            periodicidad TEXT,
+            validacion_tipo TEXT,
+            largo_max_cm REAL,
+            ancho_max_cm REAL,
+            alto_max_cm REAL,
+            peso_max_kg REAL,
+            volumen_max_m3 REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tarifas_envio (
+            proveedor TEXT,
+            zona TEXT,
+            tipo_tarifa TEXT,
+            rango_peso_min REAL,
+            rango_peso_max REAL,
+            m3_amparado REAL,
+            precio_base REAL,
+            umbral_kg_adicional REAL,
+            costo_kg_adicional REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id_usuario INTEGER PRIMARY KEY,
+            nombre_usuario TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS descuentos_usuario (
+            id_descuento INTEGER PRIMARY KEY,
+            id_usuario INTEGER,
+            proveedor TEXT,
+            descuento_porcentaje REAL NOT NULL,
+            zona TEXT,
+            FOREIGN KEY (id_usuario) REFERENCES usuarios(id_usuario)
+        )
+    """)
+
+def m002_zona_descuentos(conn):
+    # add_users_and_discounts.py crea la tabla sin 'zona'; add_zone_column.py asume que ya existe
+    if 'zona' not in _columnas(conn, 'descuentos_usuario'):
+        conn.execute("ALTER TABLE descuentos_usuario ADD COLUMN zona TEXT")
+
+def m003_indices_consultas_calientes(conn):
+    # Índices de cobertura: las consultas de cotización se resuelven sin tocar la tabla
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_cobertura_cp ON cobertura_transportistas (
+            cp, validacion_tipo, proveedor, zona, peso_max_kg,
+            largo_max_cm, ancho_max_cm, alto_max_cm, volumen_max_m3, periodicidad
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tarifas_proveedor_zona ON tarifas_envio (
+            proveedor, zona, tipo_tarifa, rango_peso_min, rango_peso_max,
+            m3_amparado, precio_base, umbral_kg_adicional, costo_kg_adicional
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_descuentos_usuario ON descuentos_usuario (
+            id_usuario, proveedor, zona, descuento_porcentaje
+        )
+    """)
+
+TABLAS_VERSIONADAS = ('productos', 'cobertura_transportistas', 'tarifas_envio', 'descuentos_usuario')
+
+def m004_version_datos(conn):
+    # Un contador por tabla que los triggers incrementan en cada cambio; las cachés lo comparan
+    # para invalidarse sin depender de la conexión (PRAGMA data_version es por conexión)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS version_datos (
+            tabla TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    conn.executemany("INSERT OR IGNORE INTO version_datos (tabla, version) VALUES (?, 0)",
+                     [(tabla,) for tabla in TABLAS_VERSIONADAS])
+    for tabla in TABLAS_VERSIONADAS:
+        for evento in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_version_{tabla}_{evento.lower()}
+                AFTER {evento} ON {tabla}
+                BEGIN
+                    UPDATE version_datos SET version = version + 1 WHERE tabla = '{tabla}';
+                END
+            """)
+
+def m005_indice_productos(conn):
+    # Búsqueda de SKUs por prefijo (rango sobre ID_PRODUCTO) y lectura del producto seleccionado
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_productos_id ON productos (ID_PRODUCTO)")
+
+def m006_opciones_materializadas(conn):
+    # Opciones precalculadas por (cp, peso_max) para tarifas volumétricas (m3_tramo = 0) y por
+    # (cp, m3_tramo) para tarifas m3 (peso_max = 0); las refresca materializacion.py.
+    # Sin rowid, las filas de una misma clave quedan contiguas y en el orden en que se elige la tarifa m3
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS opciones_materializadas (
+            cp TEXT NOT NULL,
+            peso_max INTEGER NOT NULL,
+            m3_tramo INTEGER NOT NULL,
+            validacion_tipo TEXT,
+            precio REAL,
+            proveedor TEXT NOT NULL,
+            zona TEXT NOT NULL,
+            tipo_tarifa TEXT NOT NULL,
+            periodicidad TEXT,
+            orden_cobertura INTEGER NOT NULL,
+            orden_tarifa INTEGER NOT NULL,
+            rango_peso_min REAL NOT NULL,
+            rango_peso_max REAL,
+            m3_amparado REAL,
+            largo_max_cm REAL,
+            ancho_max_cm REAL,
+            alto_max_cm REAL,
+            peso_max_kg REAL,
+            volumen_max_m3 REAL,
+            PRIMARY KEY (cp, peso_max, m3_tramo, rango_peso_min, orden_cobertura, orden_tarifa)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_opciones_materializadas_tramo
+        ON opciones_materializadas (proveedor, zona)
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS parametros_materializacion (
+            clave TEXT PRIMARY KEY,
+            valor REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    # (proveedor, zona) cuyas opciones materializadas quedaron desactualizadas
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cambios_materializacion (
+            proveedor TEXT,
+            zona TEXT,
+            UNIQUE (proveedor, zona)
+        )
+    """)
+    referencias_por_evento = {'INSERT': ('NEW',), 'UPDATE': ('OLD', 'NEW'), 'DELETE': ('OLD',)}
+    for tabla in ('cobertura_transportistas', 'tarifas_envio'):
+        for evento, referencias in referencias_por_evento.items():
+            inserciones = ''.join(
+                f"INSERT OR IGNORE INTO cambios_materializacion (proveedor, zona) "
+                f"VALUES ({ref}.proveedor, {ref}.zona);\n"
+                for ref in referencias
+            )
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_materializacion_{tabla}_{evento.lower()}
+                AFTER {evento} ON {tabla}
+                BEGIN
+                    {inserciones}
+                END
+            """)
+
+def m007_cobertura_rangos(conn):
+    # Cobertura compactada en rangos de CP contiguos; la genera rangos_cp.py. RateBook solo la usa
+    # si version_cobertura coincide con la versión actual de cobertura_transportistas
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cobertura_rangos (
+            cp_inicio TEXT NOT NULL,
+            cp_fin TEXT NOT NULL,
+            orden INTEGER PRIMARY KEY,
+            proveedor TEXT,
+            zona TEXT,
+            periodicidad TEXT,
+            validacion_tipo TEXT,
+            largo_max_cm REAL,
+            ancho_max_cm REAL,
+            alto_max_cm REAL,
+            peso_max_kg REAL,
+            volumen_max_m3 REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS estado_cobertura_rangos (
+            version_cobertura INTEGER NOT NULL
+        )
+    """)
+
+TABLAS_CON_PROVEEDOR = ('cobertura_transportistas', 'tarifas_envio', 'descuentos_usuario')
+
+# Asignación de id_proveedor a partir del nombre (sin normalizar) de la misma fila
+ASIGNAR_ID_PROVEEDOR = (
+    "id_proveedor = (SELECT id_proveedor FROM proveedores WHERE nombre = "
+    + PROVEEDOR_NORMALIZADO_SQL + ")"
+)
+
+def m008_dimension_proveedores(conn):
+    # Un id entero por proveedor normalizado; las tablas conservan 'proveedor' tal como se cargó y los
+    # triggers mantienen id_proveedor, así los scripts que escriben nombres siguen funcionando
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS proveedores (
+            id_proveedor INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL UNIQUE
+        )
+    """)
+    for tabla in TABLAS_CON_PROVEEDOR:
+        if 'id_proveedor' not in _columnas(conn, tabla):
+            conn.execute(f"ALTER TABLE {tabla} ADD COLUMN id_proveedor INTEGER REFERENCES proveedores(id_proveedor)")
+        conn.execute(f"""
+            INSERT OR IGNORE INTO proveedores (nombre)
+            SELECT DISTINCT {PROVEEDOR_NORMALIZADO_SQL.format('proveedor')} FROM {tabla}
+            WHERE proveedor IS NOT NULL
+            ORDER BY 1
+        """)
+        conn.execute(f"UPDATE {tabla} SET {ASIGNAR_ID_PROVEEDOR.format('proveedor')}")
+        for evento in ('INSERT', 'UPDATE OF proveedor'):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_proveedor_{tabla}_{evento.split()[0].lower()}
+                AFTER {evento} ON {tabla}
+                BEGIN
+                    INSERT OR IGNORE INTO proveedores (nombre)
+                    SELECT {PROVEEDOR_NORMALIZADO_SQL.format('NEW.proveedor')} WHERE NEW.proveedor IS NOT NULL;
+                    UPDATE {tabla} SET {ASIGNAR_ID_PROVEEDOR.format('NEW.proveedor')} WHERE rowid = NEW.rowid;
+                END
+            """)
+
+    # Los índices de cotización pasan a la clave entera
+    conn.execute("DROP INDEX IF EXISTS idx_cobertura_cp")
+    conn.execute("""
+        CREATE INDEX idx_cobertura_cp ON cobertura_transportistas (
+            cp, validacion_tipo, id_proveedor, zona, peso_max_kg,
+            largo_max_cm, ancho_max_cm, alto_max_cm, volumen_max_m3, periodicidad
+        )
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_tarifas_proveedor_zona")
+    conn.execute("""
+        CREATE INDEX idx_tarifas_proveedor_zona ON tarifas_envio (
+            id_proveedor, zona, tipo_tarifa, rango_peso_min, rango_peso_max,
+            m3_amparado, precio_base, umbral_kg_adicional, costo_kg_adicional
+        )
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_descuentos_usuario")
+    conn.execute("""
+        CREATE INDEX idx_descuentos_usuario ON descuentos_usuario (
+            id_usuario, id_proveedor, zona, descuento_porcentaje
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_cobertura_proveedor_zona
+        ON cobertura_transportistas (id_proveedor, zona)
+    """)
+    # Los rangos compactados guardan el nombre sin normalizar: se descartan hasta volver a compactar
+    conn.execute("DELETE FROM estado_cobertura_rangos")
+
+def m009_registro_cotizaciones(conn):
+    # Una fila por cotización mostrada y otra por la opción elegida, enlazadas por id_cotizacion.
+    # proveedor/zona/precio: la opción más barata al mostrar, la elegida al elegir
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS quotes_log (
+            id_registro INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            evento TEXT NOT NULL,
+            id_cotizacion TEXT NOT NULL,
+            id_usuario INTEGER,
+            id_producto TEXT,
+            cp TEXT,
+            peso_max REAL,
+            m3 REAL,
+            motor TEXT,
+            n_opciones INTEGER,
+            opciones TEXT,
+            proveedor TEXT,
+            zona TEXT,
+            tipo_tarifa TEXT,
+            precio REAL
+        )
+    """)
+    # Cubre las estadísticas por proveedor en un rango de fechas sin leer la tabla
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_quotes_log_evento_ts
+        ON quotes_log (evento, ts, proveedor, zona, precio)
+    """)
+
+def m010_opciones_por_perfil(conn):
+    # Las opciones materializadas guardan el precio final y el perfil de límites de su cobertura
+    # (perfiles_materializacion) en lugar de los límites: la lectura filtra por los perfiles que
+    # aceptan el paquete y no vuelve a validar cada fila. Las filas viejas se descartan; el próximo
+    # refresco es completo porque no quedan parámetros.
+    conn.execute("DROP TABLE IF EXISTS opciones_materializadas")
+    conn.execute("""
+        CREATE TABLE opciones_materializadas (
+            cp TEXT NOT NULL,
+            peso_max INTEGER NOT NULL,
+            m3_tramo INTEGER NOT NULL,
+            rango_peso_min REAL NOT NULL,
+            orden_cobertura INTEGER NOT NULL,
+            orden_tarifa INTEGER NOT NULL,
+            perfil INTEGER NOT NULL,
+            precio REAL,
+            id_proveedor INTEGER,
+            nombre TEXT NOT NULL,
+            proveedor TEXT NOT NULL,
+            zona TEXT NOT NULL,
+            tipo_tarifa TEXT NOT NULL,
+            periodicidad TEXT,
+            rango_peso_max REAL,
+            m3_amparado REAL,
+            PRIMARY KEY (cp, peso_max, m3_tramo, rango_peso_min, orden_cobertura, orden_tarifa)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE INDEX idx_opciones_materializadas_tramo
+        ON opciones_materializadas (proveedor, zona)
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS perfiles_materializacion (
+            perfil INTEGER PRIMARY KEY,
+            validacion_tipo TEXT,
+            largo_max_cm REAL,
+            ancho_max_cm REAL,
+            alto_max_cm REAL,
+            peso_max_kg REAL,
+            volumen_max_m3 REAL
+        )
+    """)
+    conn.execute("DELETE FROM parametros_materializacion")
+    conn.execute("DELETE FROM cambios_materializacion")
+
+def m011_triggers_proveedor_sin_recursion(conn):
+    # Los triggers de m008 actualizaban la fila recién escrita y esa actualización volvía a disparar
+    # los triggers de version_datos y de cambios_materializacion. Ahora solo actúan si id_proveedor no
+    # corresponde al nombre (quien ya escribe el id no paga nada) y los triggers de UPDATE ignoran los
+    # cambios que solo tocan id_proveedor.
+    for tabla in TABLAS_CON_PROVEEDOR:
+        columnas = ', '.join(sorted(_columnas(conn, tabla) - {'id_proveedor'}))
+        for nombre in (f"trg_version_{tabla}_update", f"trg_materializacion_{tabla}_update"):
+            fila = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (nombre,)).fetchone()
+            if fila is None:
+                continue
+            sql = fila[0].replace(f"AFTER UPDATE ON {tabla}", f"AFTER UPDATE OF {columnas} ON {tabla}", 1)
+            if sql == fila[0]:
+                raise RuntimeError(f"No se reconoce la definición de {nombre}")
+            conn.execute(f"DROP TRIGGER {nombre}")
+            conn.execute(sql)
+
+        # Al insertar se confía en el id que trae la fila; al actualizar se compara con el nombre
+        id_del_nombre = (f"(SELECT id_proveedor FROM proveedores WHERE nombre = "
+                         f"{PROVEEDOR_NORMALIZADO_SQL.format('NEW.proveedor')})")
+        condiciones = {
+            'INSERT': "NEW.id_proveedor IS NULL AND NEW.proveedor IS NOT NULL",
+            'UPDATE OF proveedor, id_proveedor': f"(NEW.id_proveedor IS NULL AND NEW.proveedor IS NOT NULL) "
+                                                 f"OR NEW.id_proveedor IS NOT {id_del_nombre}",
+        }
+        for evento, condicion in condiciones.items():
+            nombre = f"trg_proveedor_{tabla}_{evento.split()[0].lower()}"
+            conn.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+            conn.execute(f"""
+                CREATE TRIGGER {nombre}
+                AFTER {evento} ON {tabla}
+                WHEN {condicion}
+                BEGIN
+                    INSERT OR IGNORE INTO proveedores (nombre)
+                    SELECT {PROVEEDOR_NORMALIZADO_SQL.format('NEW.proveedor')} WHERE NEW.proveedor IS NOT NULL;
+                    UPDATE {tabla} SET {ASIGNAR_ID_PROVEEDOR.format('NEW.proveedor')} WHERE rowid = NEW.rowid;
+                END
+            """)
+
+def m012_registro_cotizaciones_unico(conn):
+    # Un registro se identifica por (id_cotizacion, evento, ts): volver a volcar un archivo de respaldo
+    # (INSERT OR IGNORE) no duplica filas. Se conservan las filas duplicadas más antiguas.
+    conn.execute("""
+        DELETE FROM quotes_log
+        WHERE id_registro NOT IN (SELECT MIN(id_registro) FROM quotes_log GROUP BY id_cotizacion, evento, ts)
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_quotes_log_registro
+        ON quotes_log (id_cotizacion, evento, ts)
+    """)
+
+MIGRACIONES = [
+    (1, "Esquema base", m001_esquema_base),
+    (2, "Columna 'zona' en descuentos_usuario", m002_zona_descuentos),
+    (3, "Índices de cobertura para las consultas de cotización", m003_indices_consultas_calientes),
+    (4, "Versión de datos por tabla para invalidar cachés", m004_version_datos),
+    (5, "Índice de productos por ID_PRODUCTO", m005_indice_productos),
+    (6, "Opciones materializadas y registro de cambios por (proveedor, zona)", m006_opciones_materializadas),
+    (7, "Cobertura compactada en rangos de CP", m007_cobertura_rangos),
+    (8, "Dimensión proveedores con id entero en cobertura, tarifas y descuentos", m008_dimension_proveedores),
+    (9, "Registro de cotizaciones mostradas y elegidas (quotes_log)", m009_registro_cotizaciones),
+    (10, "Opciones materializadas con precio final por perfil de cobertura", m010_opciones_por_perfil),
+    (11, "Triggers de id_proveedor sin volver a disparar versión y materialización", m011_triggers_proveedor_sin_recursion),
+    (12, "Registro de cotizaciones único por (id_cotizacion, evento, ts)", m012_registro_cotizaciones_unico),
+]
+
+
+def version_actual(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrar(conn, hasta=None):
+    # Cada migración corre en su propia transacción junto con el cambio de user_version
+    aplicadas = []
+    for version, descripcion, aplicar in MIGRACIONES:
+        if version <= version_actual(conn) or (hasta is not None and version > hasta):
+            continue
+        conn.execute("BEGIN")
+        try:
+            aplicar(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"✅ Migración {version:03d} aplicada: {descripcion}")
+        aplicadas.append(version)
+    if aplicadas:
+        conn.execute("PRAGMA optimize")
+    return aplicadas
+
+class EsquemaDesactualizado(Exception):
+    pass
+
+def verificar_esquema(db_path=DB_PATH):
+    # Los procesos que cotizan no migran: migrar es un paso explícito del despliegue (python migraciones.py)
+    if not os.path.exists(db_path):
+        raise EsquemaDesactualizado(f"No existe la base de datos {db_path}")
+    conn = sqlite3.connect(db_path)
+    try:
+        version = version_actual(conn)
+    finally:
+        conn.close()
+    esperada = MIGRACIONES[-1][0]
+    if version < esperada:
+        raise EsquemaDesactualizado(
+            f"La base de datos {db_path} está en la versión {version} del esquema y se necesita la {esperada}: "
+            f"ejecuta python migraciones.py --db {db_path}"
+        )
+    return version
+
+
+# --- VERIFICACIÓN DE PLANES DE CONSULTA ---
+
+_SELECT_COBERTURA_TARIFAS = """
+    SELECT c.id_proveedor, c.zona, c.periodicidad, t.tipo_tarifa, t.rango_peso_min, t.rango_peso_max,
+           t.m3_amparado, t.precio_base, t.umbral_kg_adicional, t.costo_kg_adicional
+    FROM cobertura_transportistas AS c
+    JOIN tarifas_envio AS t ON c.id_proveedor = t.id_proveedor AND c.zona = t.zona
+"""
+
+CONSULTAS_CALIENTES = {
+    'cobertura_dimensiones': (
+        _SELECT_COBERTURA_TARIFAS + """
+        WHERE c.cp = ? AND (c.validacion_tipo = 'DIMENSIONES' OR c.validacion_tipo IS NULL)
+          AND c.largo_max_cm >= ? AND c.ancho_max_cm >= ? AND c.alto_max_cm >= ? AND c.peso_max_kg >= ?
+        """,
+        ('01000', 10, 10, 10, 1),
+    ),
+    'cobertura_volumen': (
+        _SELECT_COBERTURA_TARIFAS + """
+        WHERE c.cp = ? AND c.validacion_tipo = 'VOLUMEN' AND c.peso_max_kg >= ? AND c.volumen_max_m3 >= ?
+        """,
+        ('01000', 1, 0.01),
+    ),
+    'tarifas_tramo': (
+        """
+        SELECT rango_peso_min, rango_peso_max, precio_base FROM tarifas_envio
+        WHERE id_proveedor = ? AND zona = ? AND tipo_tarifa = 'volumetrico' AND rango_peso_min <= ?
+        ORDER BY rango_peso_min DESC
+        """,
+        (1, '1', 5),
+    ),
+    'busqueda_skus': (
+        """
+        SELECT DISTINCT ID_PRODUCTO FROM productos
+        WHERE ID_PRODUCTO IS NOT NULL AND ID_PRODUCTO >= ? AND ID_PRODUCTO < ?
+        ORDER BY ID_PRODUCTO
+        LIMIT ?
+        """,
+        ('SKU-01', 'SKU-02', 51),
+    ),
+    'descuentos_usuario': (
+        "SELECT id_proveedor, descuento_porcentaje, zona FROM descuentos_usuario WHERE id_usuario = ?",
+        (1,),
+    ),
+    'opciones_materializadas': (
+        """
+        SELECT nombre, zona, precio, orden_cobertura, rango_peso_min, orden_tarifa FROM opciones_materializadas
+        WHERE cp = ? AND peso_max = ? AND m3_tramo = 0 AND perfil IN (SELECT value FROM json_each(?))
+        """,
+        ('01000', 3, '[1, 2]'),
+    ),
+    'estadisticas_cotizaciones': (
+        """
+        SELECT proveedor, zona, COUNT(*), SUM(precio) FROM quotes_log
+        WHERE evento = ? AND ts >= ? AND ts < ?
+        GROUP BY proveedor, zona
+        """,
+        ('elegida', 0, 1e10),
+    ),
+}
+
+def plan_consulta(conn, query, params=()):
+    return [fila[3] for fila in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+
+def verificar_planes(conn, consultas=None):
+    # Una consulta caliente pasa si ningún paso del plan recorre una tabla completa
+    resultados = []
+    for nombre, (query, params) in (consultas or CONSULTAS_CALIENTES).items():
+        plan = plan_consulta(conn, query, params)
+        recorridos = [paso for paso in plan if paso.startswith('SCAN') and 'INDEX' not in paso]
+        resultados.append((nombre, not recorridos, plan))
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aplica las migraciones pendientes de la base de datos.")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--verificar', action='store_true', help="Muestra el plan de las consultas de cotización")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        print(f"Versión del esquema: {version_actual(conn)}")
+        if not migrar(conn):
+            print("La base de datos ya está al día.")
+        if args.verificar:
+            for nombre, ok, plan in verificar_planes(conn):
+                print(f"{'✅' if ok else '❌'} {nombre}")
+                for paso in plan:
+                    print(f"    {paso}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,535 @@
+import bisect
+import math
+import sqlite3
+import time
+from array import array
+from collections import namedtuple
+from itertools import chain, count
+
+DB_PATH = 'db_envios.db.db'
+DIVISOR_VOLUMETRICO = 5000
+
+OpcionEnvio = namedtuple('OpcionEnvio', [
+    'proveedor', 'zona', 'tipo_tarifa', 'precio_envio', 'periodicidad', 'descuento_aplicado'
+])
+
+Cobertura = namedtuple('Cobertura', [
+    'orden', 'proveedor', 'zona', 'periodicidad', 'validacion_tipo',
+    'largo_max_cm', 'ancho_max_cm', 'alto_max_cm', 'peso_max_kg', 'volumen_max_m3'
+])
+
+Tarifa = namedtuple('Tarifa', [
+    'orden', 'rango_peso_min', 'rango_peso_max', 'm3_amparado',
+    'precio_base', 'umbral_kg_adicional', 'costo_kg_adicional'
+])
+
+
+# --- NORMALIZACIÓN Y CÁLCULOS BÁSICOS ---
+
+def normalizar_cp(cp):
+    return str(cp).strip().zfill(5)
+
+def normalizar_proveedor(proveedor):
+    return str(proveedor).strip().upper().replace(' ', '')
+
+# Equivalente SQL de normalizar_proveedor; con él se llena la tabla proveedores
+PROVEEDOR_NORMALIZADO_SQL = "UPPER(REPLACE(TRIM({0}), ' ', ''))"
+
+def normalizar_zona(zona):
+    return str(zona)
+
+def a_numero(valor):
+    # Equivalente a pd.to_numeric(errors='coerce') para un valor suelto.
+    if valor is None:
+        return math.nan
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return math.nan
+
+def calcular_pesos(largo, ancho, alto, peso_real):
+    peso_vol = (largo * ancho * alto) / DIVISOR_VOLUMETRICO
+    # Redondeamos el peso_max al siguiente entero.
+    peso_max = math.ceil(max(peso_real, peso_vol))
+    return peso_vol, peso_max
+
+def calcular_m3(largo, ancho, alto):
+    return (largo * ancho * alto) / 1_000_000
+
+def _ge(limite, valor):
+    # Comparación con semántica SQL: un límite NULL nunca acepta el paquete.
+    return limite is not None and limite >= valor
+
+def cobertura_acepta(cob, largo, ancho, alto, peso_real, m3):
+    if cob.validacion_tipo == 'DIMENSIONES' or cob.validacion_tipo is None:
+        return (_ge(cob.largo_max_cm, largo) and _ge(cob.ancho_max_cm, ancho)
+                and _ge(cob.alto_max_cm, alto) and _ge(cob.peso_max_kg, peso_real))
+    if cob.validacion_tipo == 'VOLUMEN':
+        return _ge(cob.peso_max_kg, peso_real) and _ge(cob.volumen_max_m3, m3)
+    return False
+
+
+# --- TARIFAS INDEXADAS POR (PROVEEDOR, ZONA) ---
+
+class TablaTarifas:
+    """Tramos de todas las (proveedor, zona) en columnas contiguas (array de float/int).
+
+    Los tramos de cada (proveedor, zona) ocupan filas seguidas: primero los volumétricos y después
+    los de m3, cada grupo ordenado por (rango_peso_min, orden). Valores ausentes o no numéricos
+    quedan como NaN. Ocupa 64 bytes por tramo en vez de un namedtuple con sus objetos float.
+    """
+
+    __slots__ = ('orden', 'minimo', 'maximo', 'max_acum', 'm3_amparado', 'precio', 'umbral', 'costo')
+
+    def __init__(self):
+        self.orden = array('q')
+        for columna in self.__slots__[1:]:
+            setattr(self, columna, array('d'))
+
+    def __len__(self):
+        return len(self.orden)
+
+    @classmethod
+    def construida(cls, columnas):
+        # Columnas ya construidas, de solo lectura (p. ej. memoryview sobre una instantánea)
+        tabla = cls.__new__(cls)
+        for columna in cls.__slots__:
+            setattr(tabla, columna, columnas[columna])
+        return tabla
+
+    def agregar(self, tarifa, max_acum=math.nan):
+        self.orden.append(tarifa.orden)
+        self.minimo.append(tarifa.rango_peso_min)
+        self.maximo.append(tarifa.rango_peso_max)
+        self.max_acum.append(max_acum)
+        self.m3_amparado.append(tarifa.m3_amparado)
+        self.precio.append(a_numero(tarifa.precio_base))
+        self.umbral.append(a_numero(tarifa.umbral_kg_adicional))
+        self.costo.append(a_numero(tarifa.costo_kg_adicional))
+
+    def tarifa(self, i):
+        return Tarifa(self.orden[i], self.minimo[i], self.maximo[i], self.m3_amparado[i],
+                      self.precio[i], self.umbral[i], self.costo[i])
+
+class TarifasZona:
+    # Vista de los tramos de un (proveedor, zona) dentro de una TablaTarifas. 'codigo' es el entero
+    # que identifica al (proveedor, zona); 'clave' es (proveedor, zona) normalizados, compartida con
+    # los descuentos.
+
+    __slots__ = ('tabla', 'codigo', 'clave', 'vol_ini', 'vol_fin', 'm3_fin')
+
+    def __init__(self, tabla, codigo, clave, vol_ini, vol_fin, m3_fin):
+        self.tabla = tabla
+        self.codigo = codigo
+        self.clave = clave
+        self.vol_ini = vol_ini
+        self.vol_fin = vol_fin
+        self.m3_fin = m3_fin
+
+    def _indices_volumetricos(self, peso_max):
+        t = self.tabla
+        i = bisect.bisect_right(t.minimo, peso_max, self.vol_ini, self.vol_fin) - 1
+        encontrados = []
+        # El máximo acumulado de rango_peso_max permite cortar la búsqueda hacia atrás
+        # aunque existan tramos solapados.
+        while i >= self.vol_ini and t.max_acum[i] >= peso_max:
+            if t.maximo[i] >= peso_max:
+                encontrados.append(i)
+            i -= 1
+        encontrados.reverse()
+        return encontrados
+
+    def tramos_volumetricos(self, peso_max):
+        return [self.tabla.tarifa(i) for i in self._indices_volumetricos(peso_max)]
+
+    def precios_volumetricos(self, peso_max):
+        # Igual que precio_volumetrico() sobre tramos_volumetricos(), sin construir las Tarifa
+        t = self.tabla
+        i = bisect.bisect_right(t.minimo, peso_max, self.vol_ini, self.vol_fin) - 1
+        precios = []
+        while i >= self.vol_ini and t.max_acum[i] >= peso_max:
+            if t.maximo[i] >= peso_max:
+                precio = t.precio[i]
+                umbral = t.umbral[i]
+                if not math.isnan(umbral) and peso_max > umbral:
+                    precio += (peso_max - umbral) * t.costo[i]
+                precios.append(precio)
+            i -= 1
+        precios.reverse()
+        return precios
+
+    @property
+    def m3(self):
+        return [self.tabla.tarifa(i) for i in range(self.vol_fin, self.m3_fin)]
+
+    def indice_primer_tramo_m3(self, peso_real, m3):
+        # Fila en la tabla del primer tramo m3 que ampara el envío, o -1
+        t = self.tabla
+        fin = bisect.bisect_right(t.minimo, peso_real, self.vol_fin, self.m3_fin)
+        for i in range(self.vol_fin, fin):
+            if t.maximo[i] >= peso_real and t.m3_amparado[i] >= m3:
+                return i
+        return -1
+
+    def primer_tramo_m3(self, peso_real, m3):
+        i = self.indice_primer_tramo_m3(peso_real, m3)
+        return self.tabla.tarifa(i) if i >= 0 else None
+
+
+def construir_tarifas(tarifas, tabla=None):
+    """{(proveedor, zona): {'volumetrico': [Tarifa], 'm3': [Tarifa]}} -> {(proveedor, zona): TarifasZona}.
+
+    Todas las vistas comparten una sola TablaTarifas y las claves normalizadas iguales son el mismo objeto.
+    """
+    tabla = tabla if tabla is not None else TablaTarifas()
+    claves = {}
+    resultado = {}
+    for codigo, ((proveedor, zona), tipos) in enumerate(tarifas.items()):
+        volumetricas = sorted(
+            (t for t in tipos.get('volumetrico', ()) if not math.isnan(t.rango_peso_min) and not math.isnan(t.rango_peso_max)),
+            key=lambda t: (t.rango_peso_min, t.orden),
+        )
+        m3 = sorted(
+            (t for t in tipos.get('m3', ()) if not any(math.isnan(v) for v in (t.rango_peso_min, t.rango_peso_max, t.m3_amparado))),
+            key=lambda t: (t.rango_peso_min, t.orden),
+        )
+        vol_ini = len(tabla)
+        acumulado = -math.inf
+        for t in volumetricas:
+            acumulado = max(acumulado, t.rango_peso_max)
+            tabla.agregar(t, acumulado)
+        vol_fin = len(tabla)
+        for t in m3:
+            tabla.agregar(t)
+        clave = (normalizar_proveedor(proveedor), normalizar_zona(zona))
+        clave = claves.setdefault(clave, clave)
+        resultado[(proveedor, zona)] = TarifasZona(tabla, codigo, clave, vol_ini, vol_fin, len(tabla))
+    return resultado
+
+def precio_volumetrico(tarifa, peso_max):
+    precio = a_numero(tarifa.precio_base)
+    umbral = a_numero(tarifa.umbral_kg_adicional)
+    if not math.isnan(umbral) and peso_max > umbral:
+        precio += (peso_max - umbral) * a_numero(tarifa.costo_kg_adicional)
+    return precio
+
+
+# --- COBERTURA POR RANGOS DE CP ---
+
+def cp_numerico(cp):
+    return len(cp) == 5 and cp.isascii() and cp.isdigit()
+
+def compactar_coberturas(coberturas):
+    """Agrupa CPs contiguos con la misma cobertura en rangos (inicio, fin, Cobertura).
+
+    El 'orden' de cada Cobertura se renumera, pero dentro de cada CP sigue el orden original de sus filas.
+    Los CPs no numéricos quedan aparte, sin compactar.
+    """
+    rangos = []
+    exactos = {}
+    abiertos = {}
+    siguiente = 0
+    for cp in sorted(coberturas):
+        filas = sorted(coberturas[cp], key=lambda c: c.orden)
+        if not cp_numerico(cp):
+            exactos[cp] = tuple(cob._replace(orden=siguiente + i) for i, cob in enumerate(filas))
+            siguiente += len(filas)
+            continue
+        numero = int(cp)
+        ultimo = -1
+        for cob in filas:
+            clave = cob[1:]
+            rango = abiertos.get(clave)
+            # Solo se extiende el rango si el orden relativo dentro del CP se mantiene
+            if rango is not None and rango[1] == numero - 1 and rango[2].orden > ultimo:
+                rango[1] = numero
+            else:
+                if rango is not None:
+                    rangos.append(tuple(rango))
+                rango = [numero, numero, cob._replace(orden=siguiente)]
+                abiertos[clave] = rango
+                siguiente += 1
+            ultimo = rango[2].orden
+    rangos.extend(tuple(rango) for rango in abiertos.values())
+    rangos.sort(key=lambda r: r[2].orden)
+    return rangos, exactos
+
+class IndiceRangosCP:
+    # Segmentos elementales de CP ordenados por inicio; cada uno apunta a la tupla de coberturas vigente,
+    # compartida entre segmentos iguales. Se consulta como el dict {cp: coberturas} al que reemplaza.
+
+    __slots__ = ('inicios', 'segmentos', 'exactos', 'n_rangos')
+
+    def __init__(self, rangos, exactos=None):
+        altas, bajas = {}, {}
+        for inicio, fin, cob in rangos:
+            altas.setdefault(inicio, []).append(cob)
+            bajas.setdefault(fin + 1, []).append(cob)
+        activos = {}
+        compartidas = {}
+        self.inicios = []
+        self.segmentos = []
+        for frontera in sorted(altas.keys() | bajas.keys()):
+            for cob in bajas.get(frontera, ()):
+                del activos[cob.orden]
+            for cob in altas.get(frontera, ()):
+                activos[cob.orden] = cob
+            segmento = tuple(activos[orden] for orden in sorted(activos))
+            segmento = compartidas.setdefault(segmento, segmento)
+            if self.segmentos and self.segmentos[-1] is segmento:
+                continue
+            self.inicios.append(frontera)
+            self.segmentos.append(segmento)
+        self.exactos = exactos or {}
+        self.n_rangos = len(rangos)
+
+    @classmethod
+    def construido(cls, inicios, segmentos, exactos, n_rangos):
+        # Partes ya calculadas (p. ej. vistas sobre una instantánea, ver instantanea.py)
+        indice = cls.__new__(cls)
+        indice.inicios, indice.segmentos, indice.exactos, indice.n_rangos = inicios, segmentos, exactos, n_rangos
+        return indice
+
+    def get(self, cp, default=()):
+        if not cp_numerico(cp):
+            return self.exactos.get(cp, default)
+        i = bisect.bisect_right(self.inicios, int(cp)) - 1
+        return (self.segmentos[i] if i >= 0 else None) or default
+
+def leer_coberturas(conn):
+    # El proveedor de cada Cobertura es el nombre normalizado de la tabla proveedores
+    coberturas = {}
+    for fila in conn.execute("""
+        SELECT c.rowid, c.cp, p.nombre, c.zona, c.periodicidad, c.validacion_tipo,
+               c.largo_max_cm, c.ancho_max_cm, c.alto_max_cm, c.peso_max_kg, c.volumen_max_m3
+        FROM cobertura_transportistas AS c
+        LEFT JOIN proveedores AS p ON p.id_proveedor = c.id_proveedor
+    """):
+        coberturas.setdefault(normalizar_cp(fila[1]), []).append(Cobertura(fila[0], *fila[2:]))
+    return coberturas
+
+def leer_cobertura_rangos(conn):
+    # Rangos guardados por rangos_cp.py; None si no existen o si la cobertura cambió después de compactar
+    try:
+        vigente = conn.execute("""
+            SELECT e.version_cobertura = v.version
+            FROM estado_cobertura_rangos AS e
+            JOIN version_datos AS v ON v.tabla = 'cobertura_transportistas'
+        """).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if not vigente or not vigente[0]:
+        return None
+    rangos, exactos = [], {}
+    for fila in conn.execute("""
+        SELECT cp_inicio, cp_fin, orden, proveedor, zona, periodicidad, validacion_tipo,
+               largo_max_cm, ancho_max_cm, alto_max_cm, peso_max_kg, volumen_max_m3
+        FROM cobertura_rangos
+        ORDER BY orden
+    """):
+        cob = Cobertura(*fila[2:])
+        if cp_numerico(fila[0]):
+            rangos.append((int(fila[0]), int(fila[1]), cob))
+        else:
+            exactos.setdefault(fila[0], []).append(cob)
+    return IndiceRangosCP(rangos, {cp: tuple(filas) for cp, filas in exactos.items()})
+
+
+# --- MOTOR DE COTIZACIÓN ---
+
+_generaciones = count()
+
+class RateBook:
+    """Cobertura, tarifas y descuentos cargados una sola vez para cotizar en memoria."""
+
+    def __init__(self, coberturas, tarifas, descuentos):
+        # coberturas: {cp: [Cobertura, ...]} o un IndiceRangosCP ya construido
+        # tarifas: {(proveedor, zona): {'volumetrico': [Tarifa], 'm3': [Tarifa]}}
+        # descuentos: {id_usuario: {(proveedor_normalizado, zona): porcentaje}}
+        if not isinstance(coberturas, IndiceRangosCP):
+            coberturas = IndiceRangosCP(*compactar_coberturas(coberturas))
+        self.coberturas = coberturas
+        self.tarifas = construir_tarifas(tarifas)
+        # Distingue cada carga en las claves de caché: un RateBook recargado no reutiliza entradas del anterior
+        self.generacion = next(_generaciones)
+        self._limites = None
+        # Los descuentos reutilizan las claves (proveedor, zona) normalizadas de las tarifas
+        claves = {tz.clave: tz.clave for tz in self.tarifas.values()}
+        self.descuentos = {
+            id_usuario: {claves.get(clave, clave): porcentaje for clave, porcentaje in por_clave.items()}
+            for id_usuario, por_clave in descuentos.items()
+        }
+
+    @classmethod
+    def construido(cls, coberturas, tarifas, descuentos):
+        # Estructuras finales ya construidas (ver instantanea.py): no se compacta ni se indexa nada
+        rate_book = cls.__new__(cls)
+        rate_book.coberturas, rate_book.tarifas, rate_book.descuentos = coberturas, tarifas, descuentos
+        rate_book.generacion = next(_generaciones)
+        rate_book._limites = None
+        return rate_book
+
+    @classmethod
+    def load(cls, db_path=DB_PATH):
+        conn = sqlite3.connect(db_path)
+        try:
+            return cls.from_connection(conn)
+        finally:
+            conn.close()
+
+    @classmethod
+    def from_connection(cls, conn):
+        coberturas = leer_cobertura_rangos(conn) or leer_coberturas(conn)
+
+        # Cobertura, tarifas y descuentos llegan con el nombre de proveedores: cruzarlos ya no normaliza
+        tarifas = {}
+        for fila in conn.execute("""
+            SELECT t.rowid, p.nombre, t.zona, t.tipo_tarifa, t.rango_peso_min, t.rango_peso_max,
+                   t.m3_amparado, t.precio_base, t.umbral_kg_adicional, t.costo_kg_adicional
+            FROM tarifas_envio AS t
+            LEFT JOIN proveedores AS p ON p.id_proveedor = t.id_proveedor
+        """):
+            orden, proveedor, zona, tipo_tarifa = fila[:4]
+            if proveedor is None or zona is None or tipo_tarifa not in ('volumetrico', 'm3'):
+                continue
+            tarifa = Tarifa(orden, a_numero(fila[4]), a_numero(fila[5]), a_numero(fila[6]), *fila[7:])
+            tarifas.setdefault((proveedor, zona), {}).setdefault(tipo_tarifa, []).append(tarifa)
+
+        descuentos = {}
+        for id_usuario, proveedor, zona, porcentaje in conn.execute("""
+            SELECT d.id_usuario, p.nombre, d.zona, d.descuento_porcentaje
+            FROM descuentos_usuario AS d
+            JOIN proveedores AS p ON p.id_proveedor = d.id_proveedor
+            ORDER BY d.rowid
+        """):
+            clave = (proveedor, normalizar_zona(zona))
+            descuentos.setdefault(id_usuario, {}).setdefault(clave, porcentaje)
+
+        return cls(coberturas, tarifas, descuentos)
+
+    def quote(self, cp, largo, ancho, alto, peso_real, user_id=None, m3=None, medidor=None, cache=None):
+        # medidor (perfilado.Medidor, opcional) acumula el tiempo de cada etapa.
+        # cache (cache_datos.CacheLRU, opcional) guarda las opciones por firma del envío, ver _firma
+        inicio = time.perf_counter() if medidor is not None else None
+        if m3 is None:
+            m3 = calcular_m3(largo, ancho, alto)
+        _, peso_max = calcular_pesos(largo, ancho, alto, peso_real)
+        cp = normalizar_cp(cp)
+
+        if cache is not None:
+            # La firma se calcula antes de recorrer la cobertura: un acierto no hace nada más
+            firma = self._firma(cp, largo, ancho, alto, peso_real, m3, peso_max, user_id)
+            if medidor is not None:
+                medidor.marcar('firma', inicio)
+            if firma is not None:
+                # Se guarda una tupla (el recolector de basura deja de recorrerla) y cada llamada recibe su lista
+                return list(cache.obtener(firma, lambda: tuple(self._cotizar(
+                    cp, largo, ancho, alto, peso_real, m3, peso_max, user_id, medidor))))
+        return self._cotizar(cp, largo, ancho, alto, peso_real, m3, peso_max, user_id, medidor)
+
+    def _cotizar(self, cp, largo, ancho, alto, peso_real, m3, peso_max, user_id, medidor=None):
+        inicio = time.perf_counter() if medidor is not None else None
+        aceptadas = []
+        for cob in self.coberturas.get(cp, ()):
+            if not cobertura_acepta(cob, largo, ancho, alto, peso_real, m3):
+                continue
+            tarifas_zona = self.tarifas.get((cob.proveedor, cob.zona))
+            if tarifas_zona is not None:
+                aceptadas.append((cob, tarifas_zona))
+        if medidor is not None:
+            inicio = medidor.marcar('cobertura', inicio)
+
+        # Solo una tarifa m3 en total: la de menor rango_peso_min entre todos los proveedores.
+        mejor_m3 = None
+        for cob, tarifas_zona in aceptadas:
+            i = tarifas_zona.indice_primer_tramo_m3(peso_real, m3)
+            if i >= 0:
+                tabla = tarifas_zona.tabla
+                clave = (tabla.minimo[i], cob.orden, tabla.orden[i])
+                if mejor_m3 is None or clave < mejor_m3[0]:
+                    mejor_m3 = (clave, cob, tarifas_zona, i)
+        if medidor is not None:
+            medidor.marcar('seleccion_m3', inicio)
+
+        return self._opciones(aceptadas, mejor_m3, peso_max, user_id, medidor)
+
+    def _umbrales(self):
+        """Valores distintos de cada límite con el que se compara un envío, ordenados.
+
+        Toda la cobertura y la selección m3 son comparaciones 'límite >= valor' (medidas, peso, m3) o
+        'rango_peso_min <= peso_real': la posición del valor entre los límites distintos decide todas.
+        Se calculan al primer uso de la caché.
+        """
+        if self._limites is None:
+            medidas, pesos, m3s, minimos = set(), set(), set(), set()
+            vistos = set()
+            for segmento in chain(self.coberturas.segmentos, self.coberturas.exactos.values()):
+                if id(segmento) in vistos:
+                    continue
+                vistos.add(id(segmento))
+                for cob in segmento:
+                    medidas.update((cob.largo_max_cm, cob.ancho_max_cm, cob.alto_max_cm))
+                    pesos.add(cob.peso_max_kg)
+                    m3s.add(cob.volumen_max_m3)
+            for tarifas_zona in self.tarifas.values():
+                t = tarifas_zona.tabla
+                for i in range(tarifas_zona.vol_fin, tarifas_zona.m3_fin):
+                    minimos.add(t.minimo[i])
+                    pesos.add(t.maximo[i])
+                    m3s.add(t.m3_amparado[i])
+            # Un límite NULL o NaN nunca acepta: no separa envíos
+            self._limites = tuple(
+                sorted(v for v in valores if isinstance(v, (int, float)) and not math.isnan(v))
+                for valores in (medidas, pesos, m3s, minimos)
+            )
+        return self._limites
+
+    def _firma(self, cp, largo, ancho, alto, peso_real, m3, peso_max, user_id):
+        """Clave que determina por completo el resultado de quote, o None si no se puede cachear.
+
+        La clase de encaje es la posición de cada medida, del peso real y del m3 entre los límites de
+        _umbrales: dos envíos con la misma clase pasan exactamente las mismas validaciones de cobertura y
+        de tramos m3. Las tarifas volumétricas dependen solo de peso_max. Los usuarios sin descuentos
+        comparten entradas.
+        """
+        # Un valor NaN no se ordena entre los límites (y nunca pasa una validación)
+        if largo != largo or ancho != ancho or alto != alto or peso_real != peso_real or m3 != m3:
+            return None
+        medidas, pesos, m3s, minimos = self._limites or self._umbrales()
+        clase = (
+            bisect.bisect_left(medidas, largo), bisect.bisect_left(medidas, ancho),
+            bisect.bisect_left(medidas, alto), bisect.bisect_left(pesos, peso_real),
+            bisect.bisect_right(minimos, peso_real), bisect.bisect_left(m3s, m3),
+        )
+        usuario = (user_id,) if user_id in self.descuentos else ()
+        return self.generacion, cp, peso_max, clase, usuario
+
+    def _opciones(self, aceptadas, mejor_m3, peso_max, user_id, medidor=None):
+        inicio = time.perf_counter() if medidor is not None else None
+        calculadas = []
+        for cob, tarifas_zona in aceptadas:
+            for precio in tarifas_zona.precios_volumetricos(peso_max):
+                calculadas.append((cob, tarifas_zona, 'volumetrico', precio))
+        if mejor_m3 is not None:
+            _, cob, tarifas_zona, i = mejor_m3
+            calculadas.append((cob, tarifas_zona, 'm3', tarifas_zona.tabla.precio[i]))
+        if medidor is not None:
+            inicio = medidor.marcar('tarifas_volumetricas', inicio)
+
+        descuentos_usuario = self.descuentos.get(user_id, {})
+        opciones = []
+        for cob, tarifas_zona, tipo_tarifa, precio in calculadas:
+            if math.isnan(precio):
+                continue
+            proveedor, zona = tarifas_zona.clave
+            descuento = descuentos_usuario.get(tarifas_zona.clave)
+            precio_envio = precio * (1 - (descuento or 0))
+            opciones.append(OpcionEnvio(
+                proveedor, zona, tipo_tarifa, round(precio_envio, 2), cob.periodicidad,
+                'Sí' if descuento is not None else 'No',
+            ))
+
+        opciones.sort(key=lambda o: o.precio_envio)
+        if medidor is not None:
+            medidor.marcar('descuentos', inicio)
+        return opciones
@@ -0,0 +1,131 @@
+import argparse
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+RUTA_TIEMPOS = 'tiempos_cotizacion.log'
+DIRECTORIO_PERFILES = 'perfiles'
+LINEAS_PERFIL = 30
+
+registro = logging.getLogger('cotizacion.tiempos')
+
+
+class Medidor:
+    """Acumula la duración de cada etapa de una solicitud."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.etapas = {}
+
+    def marcar(self, nombre, desde):
+        # Suma a la etapa el tiempo transcurrido desde 'desde' y devuelve el instante actual
+        ahora = time.perf_counter()
+        self.etapas[nombre] = self.etapas.get(nombre, 0.0) + ahora - desde
+        return ahora
+
+    @contextmanager
+    def etapa(self, nombre):
+        desde = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.marcar(nombre, desde)
+
+    def resumen(self, **contexto):
+        return {
+            **contexto,
+            'etapas_ms': {nombre: round(s * 1000, 3) for nombre, s in self.etapas.items()},
+            'total_ms': round((time.perf_counter() - self.inicio) * 1000, 3),
+        }
+
+    def emitir(self, **contexto):
+        # Una línea JSON por solicitud
+        resumen = self.resumen(ts=round(time.time(), 3), **contexto)
+        registro.info(json.dumps(resumen, ensure_ascii=False))
+        return resumen
+
+
+def configurar_registro(ruta=RUTA_TIEMPOS):
+    # Sin ruta las líneas van a stderr; llamar varias veces no duplica el handler
+    if registro.handlers:
+        return
+    handler = logging.FileHandler(ruta, encoding='utf-8') if ruta else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    registro.addHandler(handler)
+    registro.setLevel(logging.INFO)
+    registro.propagate = False
+
+
+@contextmanager
+def capturar_perfil(activo, directorio=DIRECTORIO_PERFILES, lineas=LINEAS_PERFIL):
+    """Perfila el bloque con cProfile si 'activo'.
+
+    Entrega un dict que al salir contiene 'ruta' (volcado .prof para snakeviz/pstats)
+    y 'texto' (funciones con más tiempo acumulado); None si no se perfila.
+    """
+    if not activo:
+        yield None
+        return
+    resultado = {}
+    perfil = cProfile.Profile()
+    perfil.enable()
+    try:
+        yield resultado
+    finally:
+        perfil.disable()
+        os.makedirs(directorio, exist_ok=True)
+        ruta = os.path.join(directorio, f"cotizacion_{time.strftime('%Y%m%d_%H%M%S')}.prof")
+        perfil.dump_stats(ruta)
+        salida = io.StringIO()
+        pstats.Stats(perfil, stream=salida).sort_stats('cumulative').print_stats(lineas)
+        resultado['ruta'] = ruta
+        resultado['texto'] = salida.getvalue()
+
+
+# --- RESUMEN DEL REGISTRO ---
+
+def resumir_registro(ruta):
+    # Percentiles por etapa a partir de las líneas JSON emitidas por Medidor.emitir
+    tiempos = {}
+    with open(ruta, encoding='utf-8') as f:
+        for linea in f:
+            try:
+                resumen = json.loads(linea)
+            except json.JSONDecodeError:
+                continue
+            for nombre, ms in resumen.get('etapas_ms', {}).items():
+                tiempos.setdefault(nombre, []).append(ms)
+            tiempos.setdefault('total', []).append(resumen.get('total_ms', 0.0))
+    return {
+        nombre: {
+            'n': len(valores),
+            'p50_ms': float(np.percentile(valores, 50)),
+            'p95_ms': float(np.percentile(valores, 95)),
+            'max_ms': float(np.max(valores)),
+        }
+        for nombre, valores in tiempos.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resume por etapa el registro de tiempos de cotización.")
+    parser.add_argument('archivo', nargs='?', default=RUTA_TIEMPOS)
+    args = parser.parse_args()
+
+    resumen = resumir_registro(args.archivo)
+    if not resumen:
+        print(f"⚠️ {args.archivo} no contiene líneas de tiempos.")
+        return
+    print(f"{'Etapa':<22}{'n':>8}{'p50 ms':>10}{'p95 ms':>10}{'máx ms':>10}")
+    for nombre, r in resumen.items():
+        print(f"{nombre:<22}{r['n']:>8}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['max_ms']:>10.3f}")
+
+if __name__ == '__main__':
+    main()
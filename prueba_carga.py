@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import json
+import sqlite3
+import time
+
+import numpy as np
+
+from benchmark import DB_BENCHMARK, generar_envios
+from servicio_cotizacion import HOST, PUERTO
+
+
+def _payload(envio):
+    return {
+        'cp': envio.cp, 'largo': envio.largo, 'ancho': envio.ancho, 'alto': envio.alto,
+        'peso_real': envio.peso_real, 'm3': envio.m3, 'id_usuario': envio.id_usuario,
+    }
+
+async def _enviar(reader, writer, host, ruta, datos):
+    cuerpo = json.dumps(datos).encode()
+    writer.write(
+        f"POST {ruta} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(cuerpo)}\r\n\r\n".encode('latin-1') + cuerpo
+    )
+    await writer.drain()
+    estado = int((await reader.readline()).split()[1])
+    largo = 0
+    while True:
+        linea = await reader.readline()
+        if linea in (b'\r\n', b''):
+            break
+        nombre, _, valor = linea.decode('latin-1').partition(':')
+        if nombre.strip().lower() == 'content-length':
+            largo = int(valor)
+    await reader.readexactly(largo)
+    return estado
+
+async def _cliente(host, puerto, ruta, cuerpos, siguiente, latencias, estados):
+    # Cada cliente mantiene su conexión abierta y toma la siguiente solicitud pendiente
+    reader, writer = await asyncio.open_connection(host, puerto)
+    try:
+        while True:
+            i = next(siguiente, None)
+            if i is None:
+                break
+            inicio = time.perf_counter()
+            estado = await _enviar(reader, writer, host, ruta, cuerpos[i])
+            latencias[i] = time.perf_counter() - inicio
+            estados[estado] = estados.get(estado, 0) + 1
+    finally:
+        writer.close()
+
+async def prueba_carga(host, puerto, envios, clientes=32, lote=0):
+    if lote:
+        ruta = '/quote/batch'
+        cuerpos = [{'envios': [_payload(e) for e in envios[i:i + lote]]} for i in range(0, len(envios), lote)]
+    else:
+        ruta = '/quote'
+        cuerpos = [_payload(e) for e in envios]
+    latencias = np.full(len(cuerpos), np.nan)
+    estados = {}
+    siguiente = iter(range(len(cuerpos)))
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(
+        _cliente(host, puerto, ruta, cuerpos, siguiente, latencias, estados) for _ in range(clientes)
+    ))
+    total = time.perf_counter() - inicio
+    return {
+        'solicitudes': len(cuerpos),
+        'envios': len(envios),
+        'estados': estados,
+        'solicitudes_s': len(cuerpos) / total,
+        'envios_s': len(envios) / total,
+        'p50_ms': float(np.nanpercentile(latencias, 50) * 1000),
+        'p95_ms': float(np.nanpercentile(latencias, 95) * 1000),
+        'p99_ms': float(np.nanpercentile(latencias, 99) * 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de servicio_cotizacion.py con clientes en paralelo.")
+    parser.add_argument('--db', default=DB_BENCHMARK, help="Base de la que se toman los CPs de los envíos")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--puerto', type=int, default=PUERTO)
+    parser.add_argument('--clientes', type=int, default=32, help="Conexiones concurrentes")
+    parser.add_argument('--envios', type=int, default=5000)
+    parser.add_argument('--lote', type=int, default=0, help="Envíos por solicitud a /quote/batch (0 = /quote)")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        envios = generar_envios(conn, args.envios)
+    finally:
+        conn.close()
+
+    r = asyncio.run(prueba_carga(args.host, args.puerto, envios, args.clientes, args.lote))
+    print(f"Solicitudes: {r['solicitudes']} ({r['envios']} envíos) con {args.clientes} clientes")
+    print(f"Estados HTTP: {r['estados']}")
+    print(f"Solicitudes/s: {r['solicitudes_s']:.0f}   Envíos/s: {r['envios_s']:.0f}")
+    print(f"Latencia p50 {r['p50_ms']:.2f} ms   p95 {r['p95_ms']:.2f} ms   p99 {r['p99_ms']:.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import gc
+import random
+import sqlite3
+import time
+import tracemalloc
+
+from motor_cotizacion import DB_PATH, IndiceRangosCP, compactar_coberturas, leer_coberturas
+
+
+def compactar_tabla(conn):
+    """Reescribe cobertura_rangos a partir de cobertura_transportistas.
+
+    La conexión debe estar en modo autocommit (isolation_level=None).
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute(
+            "SELECT version FROM version_datos WHERE tabla = 'cobertura_transportistas'"
+        ).fetchone()[0]
+        coberturas = leer_coberturas(conn)
+        rangos, exactos = compactar_coberturas(coberturas)
+        filas = [(f"{inicio:05d}", f"{fin:05d}", *cob) for inicio, fin, cob in rangos]
+        filas += [(cp, cp, *cob) for cp, cobs in exactos.items() for cob in cobs]
+        conn.execute("DELETE FROM cobertura_rangos")
+        conn.executemany("""
+            INSERT INTO cobertura_rangos (
+                cp_inicio, cp_fin, orden, proveedor, zona, periodicidad, validacion_tipo,
+                largo_max_cm, ancho_max_cm, alto_max_cm, peso_max_kg, volumen_max_m3
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, filas)
+        conn.execute("DELETE FROM estado_cobertura_rangos")
+        conn.execute("INSERT INTO estado_cobertura_rangos (version_cobertura) VALUES (?)", (version,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return {
+        'filas_cobertura': sum(len(filas) for filas in coberturas.values()),
+        'rangos': len(rangos),
+        'filas_sin_compactar': sum(len(cobs) for cobs in exactos.values()),
+    }
+
+
+# --- MEDICIÓN ---
+
+def _memoria_retenida(construir):
+    # Bytes que siguen asignados después de construir la estructura (sin contar temporales)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        estructura = construir()
+        gc.collect()
+        retenida = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return estructura, retenida
+
+def _tiempo_por_consulta(buscar, cps, repeticiones=3):
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for cp in cps:
+            buscar(cp)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor / len(cps)
+
+def medir(conn, n_consultas=20_000, semilla=7):
+    # Compara el dict {cp: coberturas} por coincidencia exacta con el índice de rangos
+    def construir_dict():
+        return {cp: tuple(sorted(filas, key=lambda c: c.orden)) for cp, filas in leer_coberturas(conn).items()}
+
+    def construir_indice():
+        return IndiceRangosCP(*compactar_coberturas(leer_coberturas(conn)))
+
+    exacto, memoria_exacto = _memoria_retenida(construir_dict)
+    indice, memoria_indice = _memoria_retenida(construir_indice)
+
+    r = random.Random(semilla)
+    existentes = list(exacto)
+    cps = [r.choice(existentes) if r.random() < 0.9 else f"{r.randint(0, 99999):05d}" for _ in range(n_consultas)]
+    # El índice renumera 'orden'; se comparan el resto de campos y la secuencia dentro del CP
+    diferencias = sum([c[1:] for c in exacto.get(cp, ())] != [c[1:] for c in indice.get(cp)] for cp in cps)
+
+    consulta = "SELECT rowid, proveedor, zona FROM cobertura_transportistas WHERE cp = ? ORDER BY rowid"
+    return {
+        'filas': sum(len(filas) for filas in exacto.values()),
+        'rangos': indice.n_rangos,
+        'segmentos': len(indice.inicios),
+        'memoria_exacto_mb': memoria_exacto / 2**20,
+        'memoria_rangos_mb': memoria_indice / 2**20,
+        'dict_us': _tiempo_por_consulta(exacto.get, cps) * 1e6,
+        'rangos_us': _tiempo_por_consulta(indice.get, cps) * 1e6,
+        'sql_exacto_us': _tiempo_por_consulta(lambda cp: conn.execute(consulta, (cp,)).fetchall(), cps[:2000]) * 1e6,
+        'diferencias': diferencias,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compacta cobertura_transportistas en rangos de CP contiguos.")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--medir', action='store_true', help="Compara memoria y tiempo de búsqueda con la coincidencia exacta")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        resultado = compactar_tabla(conn)
+        print(f"✅ {resultado['filas_cobertura']} filas de cobertura → {resultado['rangos']} rangos "
+              f"({resultado['filas_sin_compactar']} filas con CP no numérico sin compactar)")
+        if args.medir:
+            m = medir(conn)
+            print(f"Segmentos del índice: {m['segmentos']}")
+            print(f"Memoria: {m['memoria_exacto_mb']:.1f} MB por CP exacto vs {m['memoria_rangos_mb']:.1f} MB por rangos")
+            print(f"Búsqueda: dict {m['dict_us']:.2f} µs, rangos {m['rangos_us']:.2f} µs, "
+                  f"SQL cp = ? {m['sql_exacto_us']:.2f} µs")
+            print(f"{'✅' if not m['diferencias'] else '❌'} Diferencias con la coincidencia exacta: {m['diferencias']}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+import argparse
+import asyncio
+import json
+import math
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from cache_datos import CacheLRU, leer_versiones
+from conexion_db import GestorConexiones
+from instantanea import cargar_instantanea, ruta_instantanea
+from migraciones import EsquemaDesactualizado, verificar_esquema
+from motor_cotizacion import DB_PATH, RateBook, calcular_m3, calcular_pesos, normalizar_cp
+
+HOST = '127.0.0.1'
+PUERTO = 8080
+MAX_CONCURRENCIA = 64
+# Tiempo que una solicitud espera turno antes de responder 503
+ESPERA_MAX_S = 2.0
+HILOS_SQLITE = 8
+MAX_LOTE = 1_000
+MAX_COTIZACIONES_CACHE = 50_000
+MAX_CUERPO = 4 * 1024 * 1024
+# Cada cuánto se consulta version_datos para recargar las tarifas
+INTERVALO_VERSIONES_S = 1.0
+TABLAS_TARIFAS = ('cobertura_transportistas', 'tarifas_envio', 'descuentos_usuario')
+
+
+class ErrorSolicitud(Exception):
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+        self.mensaje = mensaje
+
+
+# --- COTIZACIÓN ---
+
+def _numero(datos, campo):
+    valor = datos.get(campo)
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)) or not math.isfinite(valor) or valor <= 0:
+        raise ErrorSolicitud(HTTPStatus.BAD_REQUEST, f"'{campo}' debe ser un número mayor que cero")
+    return float(valor)
+
+def _id_usuario(datos):
+    # Los descuentos se indexan por id entero: un texto nunca coincidiría y una lista no es hashable
+    valor = datos.get('id_usuario')
+    if valor is not None and (isinstance(valor, bool) or not isinstance(valor, int)):
+        raise ErrorSolicitud(HTTPStatus.BAD_REQUEST, "'id_usuario' debe ser un número entero")
+    return valor
+
+def _leer_producto(conn, id_producto):
+    return conn.execute("""
+        SELECT LARGO_CM, ANCHO_CM, ALTO_CM, PESO_KG, M3 FROM productos WHERE ID_PRODUCTO = ? LIMIT 1
+    """, (id_producto,)).fetchone()
+
+def cotizar_envio(rate_book, datos, productos, cotizaciones=None):
+    """Misma ruta que main_app: medidas del producto o manuales, pesos y RateBook.quote."""
+    if not isinstance(datos, dict):
+        raise ErrorSolicitud(HTTPStatus.BAD_REQUEST, "Cada envío debe ser un objeto JSON")
+    cp = datos.get('cp')
+    if cp is None or not str(cp).strip():
+        raise ErrorSolicitud(HTTPStatus.BAD_REQUEST, "Falta 'cp'")
+    id_usuario = _id_usuario(datos)
+
+    id_producto = datos.get('id_producto')
+    if id_producto is not None:
+        if not isinstance(id_producto, str):
+            raise ErrorSolicitud(HTTPStatus.BAD_REQUEST, "'id_producto' debe ser texto")
+        producto = productos.get(id_producto)
+        if producto is None:
+            raise ErrorSolicitud(HTTPStatus.NOT_FOUND, f"Producto no encontrado: {id_producto}")
+        if any(v is None for v in producto[:4]):
+            raise ErrorSolicitud(HTTPStatus.UNPROCESSABLE_ENTITY, f"Producto sin medidas: {id_producto}")
+        largo, ancho, alto, peso_real = (float(v) for v in producto[:4])
+        m3 = float(producto[4]) if producto[4] is not None else calcular_m3(largo, ancho, alto)
+    else:
+        largo, ancho, alto, peso_real = (_numero(datos, c) for c in ('largo', 'ancho', 'alto', 'peso_real'))
+        m3 = _numero(datos, 'm3') if datos.get('m3') is not None else calcular_m3(largo, ancho, alto)
+
+    peso_vol, peso_max = calcular_pesos(largo, ancho, alto, peso_real)
+    opciones = rate_book.quote(normalizar_cp(cp), largo, ancho, alto, peso_real, id_usuario, m3=m3,
+                               cache=cotizaciones)
+    return {
+        'cp': normalizar_cp(cp),
+        'peso_volumetrico': peso_vol,
+        'peso_max': peso_max,
+        'm3': m3,
+        'opciones': [opcion._asdict() for opcion in opciones],
+    }
+
+
+class ServicioCotizacion:
+    """Tarifas en memoria compartidas por todas las solicitudes; SQLite solo se lee en el pool de hilos."""
+
+    def __init__(self, db_path=DB_PATH, max_concurrencia=MAX_CONCURRENCIA, hilos=HILOS_SQLITE, instantanea=None):
+        self.instantanea = instantanea
+        self.gestor = GestorConexiones(db_path, max_conexiones=hilos)
+        self.ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='sqlite')
+        self.limite = asyncio.Semaphore(max_concurrencia)
+        self.productos = CacheLRU(maxsize=10_000, tablas=('productos',))
+        self.cotizaciones = CacheLRU(maxsize=MAX_COTIZACIONES_CACHE, tablas=TABLAS_TARIFAS)
+        self.rate_book = None
+        self._version_tarifas = None
+        self._revisado = 0.0
+        self._recarga = asyncio.Lock()
+        self.en_curso = 0
+        self.atendidas = 0
+        self.rechazadas = 0
+
+    async def _en_hilo(self, funcion, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.ejecutor, funcion, *args)
+
+    def _leer(self, funcion, *args):
+        with self.gestor.conexion() as conn:
+            return funcion(conn, *args)
+
+    def _cargar_rate_book(self, conn):
+        # La instantánea solo se usa si corresponde a la versión actual de los datos
+        return cargar_instantanea(conn, self.instantanea) or RateBook.from_connection(conn)
+
+    async def rate_book_vigente(self):
+        if self.rate_book is not None and time.monotonic() - self._revisado < INTERVALO_VERSIONES_S:
+            return self.rate_book
+        async with self._recarga:
+            if self.rate_book is not None and time.monotonic() - self._revisado < INTERVALO_VERSIONES_S:
+                return self.rate_book
+            versiones = await self._en_hilo(self._leer, leer_versiones)
+            version = tuple(versiones.get(tabla) for tabla in TABLAS_TARIFAS) if versiones else None
+            if self.rate_book is None or version != self._version_tarifas:
+                self.rate_book = await self._en_hilo(self._leer, self._cargar_rate_book)
+                self._version_tarifas = version
+            self.productos.sincronizar(versiones)
+            self.cotizaciones.sincronizar(versiones)
+            self._revisado = time.monotonic()
+        return self.rate_book
+
+    def _productos(self, ids):
+        # {id_producto: fila o None}, pasando por la caché
+        return {
+            id_producto: self.productos.obtener(id_producto, lambda: self._leer(_leer_producto, id_producto))
+            for id_producto in ids
+        }
+
+    async def _preparar(self, envios):
+        rate_book = await self.rate_book_vigente()
+        ids = {e['id_producto'] for e in envios if isinstance(e, dict) and isinstance(e.get('id_producto'), str)}
+        productos = await self._en_hilo(self._productos, ids) if ids else {}
+        return rate_book, productos
+
+    # --- RUTAS ---
+
+    async def quote(self, datos):
+        rate_book, productos = await self._preparar([datos])
+        return cotizar_envio(rate_book, datos, productos, self.cotizaciones)
+
+    async def quote_batch(self, datos):
+        envios = datos.get('envios') if isinstance(datos, dict) else None
+        if not isinstance(envios, list):
+            raise ErrorSolicitud(HTTPStatus.BAD_REQUEST, "Se espera {'envios': [...]}")
+        if len(envios) > MAX_LOTE:
+            raise ErrorSolicitud(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Máximo {MAX_LOTE} envíos por lote")
+        rate_book, productos = await self._preparar(envios)
+
+        def cotizar():
+            resultados = []
+            for datos in envios:
+                try:
+                    resultados.append(cotizar_envio(rate_book, datos, productos, self.cotizaciones))
+                except ErrorSolicitud as e:
+                    resultados.append({'error': e.mensaje})
+            return resultados
+        # El lote se cotiza fuera del bucle de eventos para no frenar las demás conexiones
+        return {'resultados': await self._en_hilo(cotizar)}
+
+    async def health(self, datos):
+        return {
+            'tarifas_cargadas': self.rate_book is not None,
+            'en_curso': self.en_curso,
+            'atendidas': self.atendidas,
+            'rechazadas': self.rechazadas,
+            'cache_productos': self.productos.estadisticas(),
+            'cache_cotizaciones': self.cotizaciones.estadisticas(),
+        }
+
+    async def despachar(self, metodo, ruta, cuerpo):
+        rutas = {'/quote': ('POST', self.quote), '/quote/batch': ('POST', self.quote_batch), '/health': ('GET', self.health)}
+        if ruta not in rutas:
+            return HTTPStatus.NOT_FOUND, {'error': f"Ruta desconocida: {ruta}"}
+        metodo_ruta, manejador = rutas[ruta]
+        if metodo != metodo_ruta:
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': f"Usa {metodo_ruta} {ruta}"}
+
+        try:
+            await asyncio.wait_for(self.limite.acquire(), ESPERA_MAX_S)
+        except asyncio.TimeoutError:
+            self.rechazadas += 1
+            return HTTPStatus.SERVICE_UNAVAILABLE, {'error': "Servicio saturado, reintenta más tarde"}
+        self.en_curso += 1
+        try:
+            datos = json.loads(cuerpo) if cuerpo else {}
+            return HTTPStatus.OK, await manejador(datos)
+        except json.JSONDecodeError as e:
+            return HTTPStatus.BAD_REQUEST, {'error': f"JSON inválido: {e}"}
+        except ErrorSolicitud as e:
+            return e.estado, {'error': e.mensaje}
+        except Exception:
+            traceback.print_exc()
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "Error interno"}
+        finally:
+            self.en_curso -= 1
+            self.atendidas += 1
+            self.limite.release()
+
+    # --- HTTP/1.1 CON KEEP-ALIVE ---
+
+    async def atender(self, reader, writer):
+        try:
+            while True:
+                try:
+                    solicitud = await _leer_solicitud(reader)
+                except ErrorSolicitud as e:
+                    await _responder(writer, e.estado, {'error': e.mensaje}, cerrar=True)
+                    break
+                if solicitud is None:
+                    break
+                metodo, ruta, cabeceras, cuerpo = solicitud
+                estado, respuesta = await self.despachar(metodo, ruta, cuerpo)
+                cerrar = cabeceras.get('connection', '').lower() == 'close'
+                await _responder(writer, estado, respuesta, cerrar)
+                if cerrar:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def cerrar(self):
+        self.ejecutor.shutdown(wait=False)
+        self.gestor.cerrar()
+
+
+async def _leer_solicitud(reader):
+    linea = await reader.readline()
+    if not linea:
+        return None
+    try:
+        metodo, ruta, _ = linea.decode('latin-1').split()
+    except ValueError:
+        raise ErrorSolicitud(HTTPStatus.BAD_REQUEST, "Línea de solicitud inválida")
+    cabeceras = {}
+    while True:
+        linea = await reader.readline()
+        if linea in (b'\r\n', b'\n', b''):
+            break
+        nombre, _, valor = linea.decode('latin-1').partition(':')
+        cabeceras[nombre.strip().lower()] = valor.strip()
+    try:
+        largo = int(cabeceras.get('content-length', 0))
+    except ValueError:
+        raise ErrorSolicitud(HTTPStatus.BAD_REQUEST, "Content-Length inválido")
+    if largo > MAX_CUERPO:
+        raise ErrorSolicitud(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Cuerpo demasiado grande")
+    cuerpo = await reader.readexactly(largo) if largo else b''
+    return metodo.upper(), ruta.split('?', 1)[0], cabeceras, cuerpo
+
+async def _responder(writer, estado, datos, cerrar=False):
+    cuerpo = json.dumps(datos, ensure_ascii=False).encode()
+    estado = HTTPStatus(estado)
+    writer.write(
+        f"HTTP/1.1 {estado.value} {estado.phrase}\r\n"
+        f"Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(cuerpo)}\r\n"
+        f"Connection: {'close' if cerrar else 'keep-alive'}\r\n\r\n".encode('latin-1') + cuerpo
+    )
+    await writer.drain()
+
+
+async def servir(db_path=DB_PATH, host=HOST, puerto=PUERTO, max_concurrencia=MAX_CONCURRENCIA, hilos=HILOS_SQLITE,
+                 instantanea=None):
+    verificar_esquema(db_path)
+    servicio = ServicioCotizacion(db_path, max_concurrencia, hilos, instantanea)
+    # Las tarifas se cargan antes de aceptar conexiones
+    await servicio.rate_book_vigente()
+    servidor = await asyncio.start_server(servicio.atender, host, puerto)
+    print(f"🚀 Servicio de cotización en http://{host}:{puerto} (POST /quote, POST /quote/batch, GET /health)")
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        servicio.cerrar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio HTTP de cotización para integrar ERP/WMS.")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--puerto', type=int, default=PUERTO)
+    parser.add_argument('--max-concurrencia', type=int, default=MAX_CONCURRENCIA)
+    parser.add_argument('--hilos', type=int, default=HILOS_SQLITE, help="Hilos y conexiones para leer SQLite")
+    parser.add_argument('--instantanea', default=None, help="Instantánea de tarifas (por defecto, la base + '.tarifas')")
+    args = parser.parse_args()
+    try:
+        asyncio.run(servir(args.db, args.host, args.puerto, args.max_concurrencia, args.hilos,
+                           args.instantanea or ruta_instantanea(args.db)))
+    except EsquemaDesactualizado as e:
+        raise SystemExit(f"❌ {e}")
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
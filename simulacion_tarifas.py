@@ -0,0 +1,272 @@
+import argparse
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from cotizador_lote import TAMANO_BLOQUE, cargar_tablas, cotizar_lote, leer_por_bloques, leer_tarifas, preparar_pedidos
+from importador import (
+    DESTINOS, MAX_ERRORES_REPORTADOS, ErrorImportacion, bloques_validados, filas_sql, validaciones_finales,
+)
+from migraciones import ASIGNAR_ID_PROVEEDOR, verificar_esquema
+from motor_cotizacion import DB_PATH, DIVISOR_VOLUMETRICO, normalizar_proveedor
+
+TABLA_CANDIDATA = 'tarifas_candidatas'
+# Lo que el motor ve de cada tarifa; el rowid solo decide el orden entre empates
+COLUMNAS_CONTENIDO = [
+    'id_proveedor', 'zona', 'tipo_tarifa', 'rango_peso_min', 'rango_peso_max',
+    'm3_amparado', 'precio_base', 'umbral_kg_adicional', 'costo_kg_adicional',
+]
+COLUMNAS_NUMERICAS = COLUMNAS_CONTENIDO[3:]
+
+
+# --- TARIFAS CANDIDATAS ---
+
+def cargar_candidata(conn, ruta, por_proveedor=False, tamano_bloque=TAMANO_BLOQUE, separador=','):
+    """Carga un CSV de tarifas en la tabla temporal tarifas_candidatas, junto a tarifas_envio.
+
+    Aplica las validaciones de `importador.py tarifas` y, con por_proveedor, conserva las tarifas vigentes
+    de los proveedores que no vienen en el archivo. No escribe en la base: la tabla vive en 'temp'.
+    La conexión debe estar en modo autocommit (isolation_level=None).
+    """
+    tabla, especificacion = DESTINOS['tarifas']
+    columnas = [columna for columna, _, _ in especificacion]
+    lista = ', '.join(columnas)
+    conn.execute(f"DROP TABLE IF EXISTS temp.{TABLA_CANDIDATA}")
+    conn.execute(f"CREATE TEMP TABLE {TABLA_CANDIDATA} AS SELECT * FROM {tabla} WHERE 0")
+    insertar = f"INSERT INTO temp.{TABLA_CANDIDATA} ({lista}) VALUES ({', '.join('?' * len(columnas))})"
+
+    leidas = 0
+    errores = []
+    proveedores = set()
+    conn.execute("BEGIN")
+    try:
+        for leidas_bloque, validas, errores_bloque in bloques_validados('tarifas', ruta, tamano_bloque, separador):
+            leidas += leidas_bloque
+            errores.extend(errores_bloque)
+            proveedores.update(validas['proveedor'].unique())
+            conn.executemany(insertar, filas_sql(validas))
+        if errores:
+            raise ErrorImportacion(f"{len(errores)} filas inválidas en {ruta}",
+                                   [f"línea {linea}: {mensaje}" for linea, mensaje in errores[:MAX_ERRORES_REPORTADOS]])
+
+        conservadas = 0
+        if por_proveedor:
+            nombres = sorted({normalizar_proveedor(p) for p in proveedores})
+            conservadas = conn.execute(f"""
+                INSERT INTO temp.{TABLA_CANDIDATA} ({lista})
+                SELECT {lista} FROM main.{tabla}
+                WHERE id_proveedor IS NULL
+                   OR id_proveedor NOT IN (SELECT id_proveedor FROM proveedores WHERE nombre IN ({', '.join('?' * len(nombres))}))
+                ORDER BY rowid
+            """, nombres).rowcount
+        # Sin tocar proveedores: un proveedor desconocido no tiene cobertura y queda con id NULL
+        conn.execute(f"UPDATE temp.{TABLA_CANDIDATA} SET {ASIGNAR_ID_PROVEEDOR.format('proveedor')}")
+
+        errores = [fila[0] for query in validaciones_finales('tarifas', f"temp.{TABLA_CANDIDATA}") for fila in conn.execute(query)]
+        if errores:
+            raise ErrorImportacion(f"{len(errores)} errores de validación en las tarifas candidatas", errores)
+        sin_cobertura = [fila[0] for fila in conn.execute(f"""
+            SELECT DISTINCT proveedor FROM temp.{TABLA_CANDIDATA} WHERE id_proveedor IS NULL AND proveedor IS NOT NULL
+        """)]
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return {'filas_leidas': leidas, 'filas_conservadas': conservadas, 'proveedores_sin_cobertura': sin_cobertura}
+
+
+# --- DIFERENCIA ENTRE VERSIONES ---
+
+def _con_posicion(df):
+    df = df.sort_values('orden', kind='stable').copy()
+    for columna in COLUMNAS_NUMERICAS:
+        df[columna] = pd.to_numeric(df[columna], errors='coerce')
+    df['zona'] = df['zona'].astype(str)
+    df['posicion'] = df.groupby(['id_proveedor', 'zona', 'tipo_tarifa', 'rango_peso_min'], dropna=False).cumcount()
+    return df[COLUMNAS_CONTENIDO + ['posicion']]
+
+def tarifas_modificadas(vigentes, candidatas):
+    """Tarifas que están en una sola de las dos versiones, con la columna 'version' (vigente o candidata).
+
+    Se comparan por contenido, no por rowid. Entre tarifas del mismo (proveedor, zona, tipo_tarifa,
+    rango_peso_min) el orden decide qué tarifa m3 se elige, así que la posición en el empate también cuenta.
+    """
+    comparacion = _con_posicion(vigentes).merge(_con_posicion(candidatas), how='outer', indicator=True)
+    modificadas = comparacion[comparacion['_merge'] != 'both'].copy()
+    modificadas['version'] = np.where(modificadas['_merge'] == 'left_only', 'vigente', 'candidata')
+    return modificadas.drop(columns=['_merge', 'posicion']).reset_index(drop=True)
+
+def cps_por_tramo(conn, modificadas):
+    # {(id_proveedor, zona): array de CPs cubiertos} para los (proveedor, zona) con tarifas modificadas
+    claves = set(zip(modificadas['id_proveedor'], modificadas['zona']))
+    if not claves:
+        return {}
+    ids = sorted({int(id_proveedor) for id_proveedor, _ in claves})
+    df = pd.read_sql_query(f"""
+        SELECT DISTINCT cp, id_proveedor, zona FROM cobertura_transportistas
+        WHERE id_proveedor IN ({', '.join('?' * len(ids))})
+    """, conn, params=ids)
+    df['cp'] = df['cp'].astype(str).str.strip().str.zfill(5)
+    df['zona'] = df['zona'].astype(str)
+    return {
+        clave: np.unique(grupo['cp'].to_numpy(dtype=str))
+        for clave, grupo in df.groupby(['id_proveedor', 'zona'])
+        if clave in claves
+    }
+
+def envios_afectados(pedidos, modificadas, cps):
+    """Máscara de los pedidos cuya cotización puede cambiar.
+
+    Un pedido se recotiza si su CP está cubierto por un (proveedor, zona) con tarifas modificadas y su peso
+    cae en alguno de esos tramos: peso_max para las volumétricas y peso real para las m3. El resto cotiza
+    exactamente igual con las dos versiones.
+    """
+    afectados = np.zeros(len(pedidos), dtype=bool)
+    cp = pedidos['cp'].to_numpy(dtype=str)
+    pesos = {'volumetrico': pedidos['peso_max'].to_numpy(dtype=float), 'm3': pedidos['PESO_KG'].to_numpy(dtype=float)}
+    for clave, tramos in modificadas.groupby(['id_proveedor', 'zona']):
+        cubiertos = cps.get(clave)
+        if cubiertos is None:
+            continue
+        en_cp = np.isin(cp, cubiertos)
+        for tipo, minimo, maximo in tramos[['tipo_tarifa', 'rango_peso_min', 'rango_peso_max']].itertuples(index=False):
+            if tipo in pesos:
+                afectados |= en_cp & (pesos[tipo] >= minimo) & (pesos[tipo] <= maximo)
+    return afectados
+
+
+# --- SIMULACIÓN ---
+
+def _comparar(antes, despues):
+    comparacion = antes[['envio', 'cp', 'peso_max']].copy()
+    for sufijo, df in (('antes', antes), ('despues', despues)):
+        for columna in ('proveedor', 'zona', 'precio_envio'):
+            comparacion[f"{columna}_{sufijo}"] = df[columna].to_numpy()
+    return comparacion
+
+def _delta(comparacion, columnas):
+    """Diferencias por grupo: envíos que salen y entran, y variación de costo.
+
+    Solo se informan diferencias: los envíos no recotizados cotizan igual con las dos versiones, así que
+    el resultado es el mismo recotizando solo los afectados o todos.
+    """
+    grupos_antes = comparacion[[f"{c}_antes" for c in columnas]].set_axis(columnas, axis=1)
+    grupos_despues = comparacion[[f"{c}_despues" for c in columnas]].set_axis(columnas, axis=1)
+    cambia = (grupos_antes.fillna('').to_numpy() != grupos_despues.fillna('').to_numpy()).any(axis=1)
+    salen = grupos_antes[cambia].assign(envios_salen=1).groupby(columnas)['envios_salen'].sum()
+    entran = grupos_despues[cambia].assign(envios_entran=1).groupby(columnas)['envios_entran'].sum()
+    costo_antes = grupos_antes.assign(c=comparacion['precio_envio_antes']).groupby(columnas)['c'].sum()
+    costo_despues = grupos_despues.assign(c=comparacion['precio_envio_despues']).groupby(columnas)['c'].sum()
+    df = pd.concat([salen, entran, costo_antes.rename('costo_antes'), costo_despues.rename('costo_despues')],
+                   axis=1).fillna(0)
+    df['envios_delta'] = df['envios_entran'] - df['envios_salen']
+    df['costo_delta'] = (df['costo_despues'] - df['costo_antes']).round(2)
+    df = df.astype({c: int for c in ('envios_salen', 'envios_entran', 'envios_delta')})
+    df = df[['envios_salen', 'envios_entran', 'envios_delta', 'costo_delta']]
+    return df[(df['envios_salen'] != 0) | (df['envios_entran'] != 0) | (df['costo_delta'] != 0)].sort_values('costo_delta')
+
+def simular(conn, ruta_envios, id_usuario=None, tamano_bloque=TAMANO_BLOQUE, completo=False):
+    """Compara el costo de los envíos con tarifas_envio y con tarifas_candidatas (ver cargar_candidata).
+
+    Solo recotiza los envíos afectados por la diferencia entre las dos versiones; con completo=True
+    recotiza todos (sirve para comparar tiempos y comprobar que el resultado es el mismo).
+    """
+    inicio = time.perf_counter()
+    vigentes = cargar_tablas(conn)
+    candidatas = cargar_tablas(conn, f"temp.{TABLA_CANDIDATA}")
+    modificadas = tarifas_modificadas(leer_tarifas(conn), leer_tarifas(conn, f"temp.{TABLA_CANDIDATA}"))
+    cps = cps_por_tramo(conn, modificadas)
+    tiempos = {'carga_s': time.perf_counter() - inicio, 'seleccion_s': 0.0, 'cotizacion_s': 0.0}
+
+    total = 0
+    comparaciones = []
+    for bloque in leer_por_bloques(ruta_envios, tamano_bloque):
+        desde = time.perf_counter()
+        pedidos = preparar_pedidos(conn, bloque, id_usuario)
+        pedidos['envio'] = np.arange(total, total + len(pedidos))
+        total += len(pedidos)
+        volumen = pedidos['LARGO_CM'] * pedidos['ANCHO_CM'] * pedidos['ALTO_CM'] / DIVISOR_VOLUMETRICO
+        pedidos['peso_max'] = np.ceil(np.fmax(pedidos['PESO_KG'], volumen))
+        if not completo:
+            pedidos = pedidos[envios_afectados(pedidos, modificadas, cps)]
+        tiempos['seleccion_s'] += time.perf_counter() - desde
+
+        desde = time.perf_counter()
+        if len(pedidos):
+            comparaciones.append(_comparar(cotizar_lote(vigentes, pedidos), cotizar_lote(candidatas, pedidos)))
+        tiempos['cotizacion_s'] += time.perf_counter() - desde
+
+    columnas = ['envio', 'cp', 'peso_max'] + [f"{c}_{s}" for s in ('antes', 'despues') for c in ('proveedor', 'zona', 'precio_envio')]
+    comparacion = pd.concat(comparaciones, ignore_index=True) if comparaciones else pd.DataFrame(columns=columnas)
+    asignacion_antes = comparacion['proveedor_antes'].fillna('') + '/' + comparacion['zona_antes'].fillna('')
+    asignacion_despues = comparacion['proveedor_despues'].fillna('') + '/' + comparacion['zona_despues'].fillna('')
+    cambios = comparacion[asignacion_antes != asignacion_despues].reset_index(drop=True)
+    tiempos['total_s'] = time.perf_counter() - inicio
+    return {
+        'envios': total,
+        'recotizados': len(comparacion),
+        'tarifas_modificadas': len(modificadas),
+        'con_cambio_de_precio': int((comparacion['precio_envio_antes'].fillna(-1) != comparacion['precio_envio_despues'].fillna(-1)).sum()),
+        'costo_delta': round(float(comparacion['precio_envio_despues'].sum() - comparacion['precio_envio_antes'].sum()), 2),
+        'pierden_opciones': int((comparacion['precio_envio_antes'].notna() & comparacion['precio_envio_despues'].isna()).sum()),
+        'ganan_opciones': int((comparacion['precio_envio_antes'].isna() & comparacion['precio_envio_despues'].notna()).sum()),
+        'por_proveedor': _delta(comparacion, ['proveedor']),
+        'por_zona': _delta(comparacion, ['proveedor', 'zona']),
+        'cambios': cambios,
+        'tiempos': tiempos,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simula el efecto de una nueva versión de tarifas sobre envíos históricos.")
+    parser.add_argument('envios', help="Envíos (CSV o Parquet) con el formato de entrada de cotizador_lote.py")
+    parser.add_argument('tarifas', help="Tarifas candidatas (CSV con el formato de importador.py tarifas)")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--por-proveedor', action='store_true',
+                        help="Las tarifas candidatas reemplazan solo a los proveedores presentes en el archivo")
+    parser.add_argument('--usuario', type=int, default=None, help="id_usuario para los descuentos si los envíos no traen la columna")
+    parser.add_argument('--cambios', default=None, help="CSV donde guardar los envíos que cambian de proveedor o zona")
+    parser.add_argument('--completo', action='store_true', help="Recotiza todos los envíos, no solo los afectados")
+    parser.add_argument('--tamano-bloque', type=int, default=TAMANO_BLOQUE)
+    parser.add_argument('--separador', default=',')
+    args = parser.parse_args()
+    for ruta in (args.envios, args.tarifas):
+        if not os.path.exists(ruta):
+            parser.error(f"No existe el archivo: {ruta}")
+
+    verificar_esquema(args.db)
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        try:
+            carga = cargar_candidata(conn, args.tarifas, args.por_proveedor, args.tamano_bloque, args.separador)
+        except ErrorImportacion as e:
+            print(f"❌ {e}")
+            for error in e.errores:
+                print(f"    {error}")
+            raise SystemExit(1)
+        r = simular(conn, args.envios, args.usuario, args.tamano_bloque, args.completo)
+    finally:
+        conn.close()
+
+    print(f"Tarifas candidatas: {carga['filas_leidas']} filas del archivo, {carga['filas_conservadas']} vigentes conservadas, "
+          f"{r['tarifas_modificadas']} tarifas distintas de las vigentes")
+    if carga['proveedores_sin_cobertura']:
+        print(f"⚠️ Proveedores sin cobertura (no afectan la simulación): {', '.join(carga['proveedores_sin_cobertura'])}")
+    print(f"Envíos: {r['envios']}   recotizados: {r['recotizados']} ({r['recotizados'] / max(r['envios'], 1):.1%})   "
+          f"con cambio de precio: {r['con_cambio_de_precio']}   cambian de proveedor/zona: {len(r['cambios'])}")
+    print(f"Costo total: {r['costo_delta']:+,.2f}   envíos que pierden/ganan opciones: {r['pierden_opciones']}/{r['ganan_opciones']}")
+    for titulo, df in (("Por proveedor", r['por_proveedor']), ("Por proveedor y zona", r['por_zona'])):
+        print(f"\n{titulo}:")
+        print(df.to_string() if not df.empty else "  sin cambios")
+    t = r['tiempos']
+    print(f"\n⏱️ {t['total_s']:.2f} s (carga {t['carga_s']:.2f} s, selección {t['seleccion_s']:.2f} s, "
+          f"cotización {t['cotizacion_s']:.2f} s)")
+    if args.cambios:
+        r['cambios'].to_csv(args.cambios, index=False)
+        print(f"✅ {len(r['cambios'])} cambios de asignación -> {args.cambios}")
+
+if __name__ == '__main__':
+    main()
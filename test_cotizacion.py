@@ -0,0 +1,234 @@
+import math
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from benchmark import generar_envios
+from cache_datos import CacheLRU
+from cotizacion_sql import cotizar_sql
+from cotizador_lote import cargar_tablas, cotizar_lote, opciones_lote, preparar_pedidos
+from generar_datos import generar
+from instantanea import cargar_instantanea, exportar, ruta_instantanea
+from materializacion import ContextoMaterializacion, cotizar_materializado, refrescar
+from migraciones import migrar
+from motor_cotizacion import RateBook, calcular_pesos
+
+N_ENVIOS = 1_500
+
+
+def _clave(opcion):
+    # SQLite no garantiza el orden entre opciones del mismo precio
+    return (opcion[3], opcion[0], opcion[1], opcion[2], opcion[4], opcion[5])
+
+def _comparables(opciones):
+    return sorted(_clave(o) for o in opciones)
+
+
+# --- BASE GENERADA: LAS CUATRO RUTAS COINCIDEN ---
+
+@pytest.fixture(scope='module')
+def base_generada(tmp_path_factory):
+    db_path = str(tmp_path_factory.mktemp('generada') / 'envios.db')
+    generar(db_path, n_cps=600, n_proveedores=6, n_tramos=8, n_zonas=4, n_usuarios=6, n_productos=50)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    yield db_path, conn
+    conn.close()
+
+@pytest.fixture(scope='module')
+def envios(base_generada):
+    _, conn = base_generada
+    return generar_envios(conn, N_ENVIOS, semilla=11)
+
+def _cotizar(rate_book, envios, cache=None):
+    return [rate_book.quote(e.cp, e.largo, e.ancho, e.alto, e.peso_real, e.id_usuario, m3=e.m3, cache=cache)
+            for e in envios]
+
+def test_envios_con_opciones(base_generada, envios):
+    # Sin opciones no se estaría comparando nada
+    rate_book = RateBook.from_connection(base_generada[1])
+    resultados = _cotizar(rate_book, envios)
+    assert sum(1 for r in resultados if r) > N_ENVIOS // 2
+    assert any(o.tipo_tarifa == 'm3' for r in resultados for o in r)
+    assert any(o.descuento_aplicado == 'Sí' for r in resultados for o in r)
+
+def test_sql_igual_a_rate_book(base_generada, envios):
+    _, conn = base_generada
+    rate_book = RateBook.from_connection(conn)
+    for e, opciones in zip(envios, _cotizar(rate_book, envios)):
+        sql = cotizar_sql(conn, e.cp, e.largo, e.ancho, e.alto, e.peso_real, e.id_usuario, m3=e.m3)
+        assert _comparables(sql) == _comparables(opciones), e
+
+def test_lote_igual_a_rate_book(base_generada, envios):
+    _, conn = base_generada
+    rate_book = RateBook.from_connection(conn)
+    df = pd.DataFrame({
+        'cp': [e.cp for e in envios], 'LARGO_CM': [e.largo for e in envios], 'ANCHO_CM': [e.ancho for e in envios],
+        'ALTO_CM': [e.alto for e in envios], 'PESO_KG': [e.peso_real for e in envios], 'M3': [e.m3 for e in envios],
+        'id_usuario': [e.id_usuario for e in envios],
+    })
+    tablas = cargar_tablas(conn)
+    pedidos = preparar_pedidos(conn, df)
+    opciones = opciones_lote(tablas, pedidos)
+    mas_baratas = cotizar_lote(tablas, pedidos)
+    por_pedido = {pedido: grupo for pedido, grupo in opciones.groupby('pedido')}
+    for i, esperadas in enumerate(_cotizar(rate_book, envios)):
+        grupo = por_pedido.get(i)
+        lote = [] if grupo is None else list(grupo.drop(columns='pedido').itertuples(index=False, name=None))
+        assert _comparables(lote) == _comparables(esperadas), envios[i]
+        precio = mas_baratas['precio_envio'].iloc[i]
+        if esperadas:
+            assert precio == esperadas[0].precio_envio
+        else:
+            assert math.isnan(precio)
+
+def test_instantanea_igual_a_sqlite(base_generada, envios):
+    db_path, conn = base_generada
+    ruta = ruta_instantanea(db_path)
+    exportar(conn, ruta)
+    desde_instantanea = cargar_instantanea(conn, ruta)
+    assert desde_instantanea is not None
+    assert _cotizar(desde_instantanea, envios) == _cotizar(RateBook.from_connection(conn), envios)
+
+def test_materializado_igual_a_rate_book(base_generada, envios):
+    _, conn = base_generada
+    refrescar(conn)
+    rate_book = RateBook.from_connection(conn)
+    contexto = ContextoMaterializacion()
+    contexto.cargar(conn)
+    cubiertos = 0
+    for e, opciones in zip(envios, _cotizar(rate_book, envios)):
+        materializadas = cotizar_materializado(conn, e.cp, e.largo, e.ancho, e.alto, e.peso_real, e.id_usuario,
+                                               m3=e.m3, contexto=contexto)
+        if materializadas is not None:
+            cubiertos += 1
+            assert materializadas == opciones, e
+    assert cubiertos > N_ENVIOS // 4
+
+def test_materializado_con_cambios_pendientes(base_generada, envios):
+    _, conn = base_generada
+    refrescar(conn)
+    e = envios[0]
+    conn.execute("BEGIN")
+    try:
+        # Cualquier cambio de cobertura deja la tabla desactualizada hasta el próximo refresco
+        conn.execute("UPDATE cobertura_transportistas SET periodicidad = periodicidad WHERE rowid = 1")
+        assert cotizar_materializado(conn, e.cp, e.largo, e.ancho, e.alto, e.peso_real, e.id_usuario, m3=e.m3) is None
+    finally:
+        conn.execute("ROLLBACK")
+
+def test_cache_no_cambia_el_resultado(base_generada, envios):
+    rate_book = RateBook.from_connection(base_generada[1])
+    cache = CacheLRU(maxsize=10_000)
+    # Dos pasadas: la segunda sale de la caché
+    assert _cotizar(rate_book, envios, cache) == _cotizar(rate_book, envios)
+    assert _cotizar(rate_book, envios, cache) == _cotizar(rate_book, envios)
+    assert cache.aciertos > 0
+
+
+# --- REGLAS DE PRECIO CALCULADAS A MANO ---
+
+CP = '01000'
+
+@pytest.fixture
+def base_reglas(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'reglas.db'), isolation_level=None)
+    migrar(conn)
+    conn.executemany("""
+        INSERT INTO cobertura_transportistas (cp, proveedor, zona, periodicidad, validacion_tipo,
+            largo_max_cm, ancho_max_cm, alto_max_cm, peso_max_kg, volumen_max_m3)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (CP, 'PROVEEDOR A', '1', 'DIARIA', 'DIMENSIONES', 100, 100, 100, 50, None),
+        (CP, 'PROVEEDOR B', '1', 'L-V', 'VOLUMEN', None, None, None, 50, 1.0),
+    ])
+    conn.executemany("""
+        INSERT INTO tarifas_envio (proveedor, zona, tipo_tarifa, rango_peso_min, rango_peso_max,
+            m3_amparado, precio_base, umbral_kg_adicional, costo_kg_adicional)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        ('PROVEEDOR A', '1', 'volumetrico', 0, 1, None, 100.0, None, None),
+        ('PROVEEDOR A', '1', 'volumetrico', 2, 4, None, 150.0, None, None),
+        ('PROVEEDOR A', '1', 'volumetrico', 5, 999, None, 200.0, 5, 10.0),
+        # m3: A tiene el precio más bajo pero B el menor rango_peso_min, y solo se ofrece una
+        ('PROVEEDOR A', '1', 'm3', 1, 40, 1.0, 50.0, None, None),
+        ('PROVEEDOR B', '1', 'm3', 0, 40, 1.0, 500.0, None, None),
+    ])
+    conn.execute("INSERT INTO usuarios (id_usuario, nombre_usuario, password_hash) VALUES (1, 'u', 'x')")
+    # Dos descuentos para el mismo (proveedor, zona), con distinta grafía: gana la primera fila
+    conn.executemany("""
+        INSERT INTO descuentos_usuario (id_usuario, proveedor, descuento_porcentaje, zona) VALUES (?, ?, ?, ?)
+    """, [(1, 'PROVEEDOR A', 0.10, '1'), (1, 'proveedor a', 0.50, '1')])
+    yield conn
+    conn.close()
+
+def _rutas(conn, largo, ancho, alto, peso_real, user_id=None):
+    # Misma cotización por el motor en memoria y por SQL
+    rate_book = RateBook.from_connection(conn)
+    return (rate_book.quote(CP, largo, ancho, alto, peso_real, user_id),
+            cotizar_sql(conn, CP, largo, ancho, alto, peso_real, user_id))
+
+def _volumetricas(opciones):
+    return sorted(o.precio_envio for o in opciones if o.tipo_tarifa == 'volumetrico')
+
+def test_peso_max_redondea_hacia_arriba():
+    # 30x20x10 / 5000 = 1.2 kg volumétricos > 0.5 kg reales -> 2 kg
+    assert calcular_pesos(30, 20, 10, 0.5) == (1.2, 2)
+    assert calcular_pesos(10, 10, 10, 1.01) == (0.2, 2)
+    assert calcular_pesos(10, 10, 10, 2.0) == (0.2, 2)
+
+def test_tramo_por_peso_max_redondeado(base_reglas):
+    # 1.3 kg reales -> peso_max 2: cae en el tramo 2-4, no en el 0-1
+    for opciones in _rutas(base_reglas, 10, 10, 10, 1.3):
+        assert _volumetricas(opciones) == [150.0]
+
+def test_kg_adicional_solo_por_encima_del_umbral(base_reglas):
+    for opciones in _rutas(base_reglas, 10, 10, 10, 5.0):
+        assert _volumetricas(opciones) == [200.0]
+    # peso_max 8: 200 + (8 - 5) * 10
+    for opciones in _rutas(base_reglas, 10, 10, 10, 7.2):
+        assert _volumetricas(opciones) == [230.0]
+
+def test_una_sola_tarifa_m3_la_de_menor_rango_peso_min(base_reglas):
+    for opciones in _rutas(base_reglas, 10, 10, 10, 3.0):
+        m3 = [(o.proveedor, o.precio_envio) for o in opciones if o.tipo_tarifa == 'm3']
+        assert m3 == [('PROVEEDORB', 500.0)]
+    # Con 0.5 kg el tramo de A (desde 1 kg) no aplica: sigue siendo B
+    for opciones in _rutas(base_reglas, 10, 10, 10, 0.5):
+        assert [o.proveedor for o in opciones if o.tipo_tarifa == 'm3'] == ['PROVEEDORB']
+
+def test_descuento_primera_fila_gana(base_reglas):
+    for opciones in _rutas(base_reglas, 10, 10, 10, 1.3, user_id=1):
+        volumetrica = [o for o in opciones if o.tipo_tarifa == 'volumetrico']
+        assert [(o.precio_envio, o.descuento_aplicado) for o in volumetrica] == [(135.0, 'Sí')]
+        # B no tiene descuento
+        assert [o.descuento_aplicado for o in opciones if o.proveedor == 'PROVEEDORB'] == ['No']
+
+def test_medidas_fuera_de_limites(base_reglas):
+    # Más de 100 cm de largo: A (DIMENSIONES) no acepta; B (VOLUMEN) sí mientras el m3 quepa
+    for opciones in _rutas(base_reglas, 120, 10, 10, 1.3):
+        assert {o.proveedor for o in opciones} == {'PROVEEDORB'}
+
+def test_id_proveedor_sin_disparar_version(base_reglas):
+    version = lambda: base_reglas.execute(
+        "SELECT version FROM version_datos WHERE tabla = 'tarifas_envio'").fetchone()[0]
+    inicial = version()
+    base_reglas.execute("UPDATE tarifas_envio SET proveedor = 'proveedor  b' WHERE rowid = 1")
+    # El trigger reasigna el id (una sola versión nueva por el cambio de nombre)
+    assert base_reglas.execute("""
+        SELECT p.nombre FROM tarifas_envio AS t JOIN proveedores AS p USING (id_proveedor) WHERE t.rowid = 1
+    """).fetchone() == ('PROVEEDORB',)
+    assert version() == inicial + 1
+    base_reglas.execute("UPDATE tarifas_envio SET id_proveedor = NULL WHERE rowid = 2")
+    assert version() == inicial + 1
+    assert base_reglas.execute("SELECT id_proveedor IS NOT NULL FROM tarifas_envio WHERE rowid = 2").fetchone() == (1,)
+
+def test_cache_por_clase_de_encaje(base_reglas):
+    rate_book = RateBook.from_connection(base_reglas)
+    cache = CacheLRU(maxsize=100)
+    # El segundo envío no cruza ningún límite respecto al primero (mismo peso_max y clase): sale de la caché
+    for largo, ancho, alto, peso_real in [(10, 10, 10, 1.3), (12, 11, 10, 1.4), (10, 10, 10, 0.5),
+                                          (120, 10, 10, 1.3), (10, 10, 10, 1.0)]:
+        assert (rate_book.quote(CP, largo, ancho, alto, peso_real, cache=cache)
+                == rate_book.quote(CP, largo, ancho, alto, peso_real))
+    assert cache.aciertos == 1